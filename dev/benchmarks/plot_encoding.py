@@ -0,0 +1,86 @@
+"""Benchmark encoding a Plot figure in different image formats.
+
+Reports the time to save the figure (which includes drawing it) and the size
+of the resulting image for each format and set of options.
+
+Usage::
+
+    python dev/benchmarks/plot_encoding.py
+"""
+
+import sys
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+
+import matplotlib
+import numpy as np
+import pandas as pd
+from kpireport.report import Report
+from kpireport_plot import plot as plot_module
+from kpireport_plot import Plot
+from matplotlib.figure import Figure
+
+REPEAT = 5
+ENCODINGS = [
+    ("png", {}),
+    ("png", dict(compress_level=1)),
+    ("png", dict(compress_level=9)),
+    ("png", dict(colors=16)),
+    ("png", dict(colors=64)),
+    ("png", dict(colors=64, compress_level=9)),
+    ("webp", dict(quality=80)),
+    ("webp", dict(lossless=True)),
+    ("svg", {}),
+]
+
+
+def make_plot():
+    report = Report(
+        title="Benchmark",
+        start_date=datetime(2020, 5, 1, tzinfo=timezone.utc),
+        end_date=datetime(2020, 5, 8, tzinfo=timezone.utc),
+        timezone="UTC",
+    )
+    return Plot(report, None, datasource="db", query="q")
+
+
+def make_figure_data(num_series=3):
+    index = pd.date_range("2020-05-01", "2020-05-08", freq="1h", tz="UTC")
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {f"series{i}": rng.random(len(index)).cumsum() for i in range(num_series)},
+        index=index,
+    )
+    return df, df.index, df.columns, [df[col] for col in df.columns]
+
+
+def bench(fig, image_format, options):
+    elapsed = float("inf")
+    for _ in range(REPEAT):
+        start = timer()
+        image = plot_module._encode_figure(fig, image_format, options)
+        elapsed = min(elapsed, timer() - start)
+    return elapsed, len(image)
+
+
+def main(argv):
+    plot = make_plot()
+    rc = plot.matplotlib_rc
+    df, index_data, series_labels, series_data = make_figure_data()
+    figsize = [(plot.cols * plot.report.theme.column_width) / plot_module.FIGURE_PPI, 2]
+    print(f"{'format':>6} {'options':<36} {'time (ms)':>10} {'size (KB)':>10}")
+    with matplotlib.rc_context(rc):
+        fig = Figure(figsize=figsize, constrained_layout=True)
+        ax = fig.subplots()
+        plot._make_plot(ax, index_data, series_data)
+        ax.legend(series_labels, bbox_to_anchor=(0, -0.5), ncol=plot.cols)
+        for image_format, options in ENCODINGS:
+            elapsed, size = bench(fig, image_format, options)
+            print(
+                f"{image_format:>6} {str(options):<36} {elapsed * 1000:>10.1f} "
+                f"{size / 1024:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,80 @@
+"""Benchmark splitting a query result into one series per group for a Plot.
+
+Compares pivoting all groups at once against the previous implementation,
+which extracted and reindexed each group separately.
+
+Usage::
+
+    python dev/benchmarks/plot_groupby.py [num_groups ...]
+"""
+
+import logging
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+from kpireport_plot import Plot
+
+NUM_SAMPLES = 24 * 30
+
+
+def make_df(num_groups, num_samples=NUM_SAMPLES):
+    times = pd.date_range("2020-01-01", periods=num_samples, freq="1h")
+    df = pd.DataFrame(
+        {
+            "time": np.tile(times, num_groups),
+            "value": np.random.default_rng(0).random(num_groups * num_samples),
+            "instance": np.repeat([f"host{i}" for i in range(num_groups)], num_samples),
+        }
+    )
+    # Leave gaps in the series, so they have to be aligned.
+    df = df.sample(frac=0.9, random_state=0)
+    return df.set_index("time").sort_index()
+
+
+def make_plot():
+    plot = Plot.__new__(Plot)
+    plot.groupby = "instance"
+    return plot
+
+
+def group_reindex(plot, df):
+    index_data = df.index.unique()
+    grouped = df.groupby(plot.groupby)
+
+    def _flatten_group(group_df):
+        df = group_df.drop(plot.groupby, axis=1)
+        df = plot._prune_nonnumeric_columns(df)
+        df = df.reindex(index_data, fill_value=0)
+        return df[df.columns[0]]
+
+    return grouped.groups, [
+        _flatten_group(grouped.get_group(g)) for g in grouped.groups
+    ]
+
+
+def group_pivot(plot, df):
+    return plot._pivot_groups(df, df.index.unique())
+
+
+def bench(fn, plot, df):
+    start = timer()
+    fn(plot, df)
+    return timer() - start
+
+
+def main(argv):
+    logging.disable(logging.WARNING)
+    sizes = [int(arg) for arg in argv[1:]] or [10, 100, 1000]
+    plot = make_plot()
+    print(f"{'groups':>8} {'reindex (s)':>12} {'pivot (s)':>10} {'speedup':>8}")
+    for num_groups in sizes:
+        df = make_df(num_groups)
+        before = bench(group_reindex, plot, df)
+        after = bench(group_pivot, plot, df)
+        print(f"{num_groups:>8} {before:>12.3f} {after:>10.3f} {before / after:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,63 @@
+"""Benchmark decoding Prometheus range query results into a DataFrame.
+
+Compares the vectorized decoder against the previous implementation, which
+appended a DataFrame per series.
+
+Usage::
+
+    python dev/benchmarks/prometheus_decode.py [num_series ...]
+"""
+
+import sys
+from timeit import default_timer as timer
+
+import pandas as pd
+from kpireport_prometheus.datasource import _decode_matrix
+
+NUM_SAMPLES = 100
+
+
+def make_result(num_series, num_samples=NUM_SAMPLES):
+    return [
+        {
+            "metric": {
+                "__name__": "ALERTS",
+                "alertname": f"alert{i % 20}",
+                "alertstate": "firing",
+                "instance": f"host{i}:9100",
+            },
+            "values": [[1600000000 + 60 * j, "1"] for j in range(num_samples)],
+        }
+        for i in range(num_series)
+    ]
+
+
+def decode_append(result):
+    df = pd.DataFrame()
+    for metric in result:
+        mdf = pd.DataFrame(metric["values"], columns=["time", "value"])
+        mdf["time"] = pd.to_datetime(mdf["time"], unit="s")
+        mdf = mdf.assign(**metric["metric"])
+        mdf = mdf.astype({"value": "float"})
+        df = pd.concat([df, mdf])
+    return df
+
+
+def bench(fn, result):
+    start = timer()
+    fn(result)
+    return timer() - start
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10, 1000, 10000]
+    print(f"{'series':>8} {'append (s)':>12} {'vectorized (s)':>16} {'speedup':>8}")
+    for num_series in sizes:
+        result = make_result(num_series)
+        before = bench(decode_append, result)
+        after = bench(_decode_matrix, result)
+        print(f"{num_series:>8} {before:>12.3f} {after:>16.3f} {before / after:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import io
+import threading
+from typing import TYPE_CHECKING
+
+from kpireport.utils import cached_method
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterator, Optional, Union
+
+    BlobData = Union[bytes, bytearray, memoryview, io.BytesIO, str, "BlobContent"]
+
+
+class BlobContent:
+    """The content of a blob, addressed by its hash.
+
+    Contents are immutable, so they can be shared between blobs with the same
+    content, and encodings of the content are only computed once, no matter how
+    many output drivers need them.
+
+    Attributes:
+        digest (str): the SHA-256 hex digest of the content.
+        data (memoryview): a read-only view of the content.
+    """
+
+    def __init__(self, data: bytes, digest: str):
+        self._bytes = data
+        self.digest = digest
+        # Views of bytes are read-only.
+        self.data = memoryview(data)
+
+    @property
+    def size(self) -> int:
+        """The size of the content, in bytes."""
+        return len(self._bytes)
+
+    def getvalue(self) -> bytes:
+        """Get the content as bytes.
+
+        The bytes are not copied. This is compatible with
+        :meth:`io.BytesIO.getvalue`, which blob contents used to be.
+        """
+        return self._bytes
+
+    @cached_method
+    def base64(self) -> str:
+        """The content encoded as Base64, e.g., for email attachments."""
+        return base64.b64encode(self._bytes).decode("ascii")
+
+    @cached_method
+    def etag(self) -> str:
+        """The ETag of the content, as reported by S3 and other object stores
+        for objects uploaded in a single part (the quoted MD5 hex digest.)
+        """
+        return f'"{hashlib.md5(self._bytes).hexdigest()}"'
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"BlobContent(digest={self.digest!r}, size={self.size})"
+
+
+class BlobStore:
+    """A content-addressed store of blob contents.
+
+    All Views in a report share one store (see
+    :attr:`~kpireport.view.ViewManager.blob_store`.) Each blob is hashed once
+    when it is added, and blobs with the same content share a single
+    :class:`BlobContent`.
+    """
+
+    def __init__(self):
+        self._contents: "Dict[str, BlobContent]" = {}
+        self._lock = threading.Lock()
+
+    def add(self, content: "BlobData") -> BlobContent:
+        """Add a blob's content to the store.
+
+        Args:
+            content (Union[bytes, io.BytesIO, memoryview, str, BlobContent]):
+                the content. Strings are encoded as UTF-8.
+
+        Returns:
+            BlobContent: the stored content, which is shared with any blobs
+                previously added with the same content.
+        """
+        if not isinstance(content, BlobContent):
+            data = _to_bytes(content)
+            content = BlobContent(data, hashlib.sha256(data).hexdigest())
+        with self._lock:
+            return self._contents.setdefault(content.digest, content)
+
+    def get(self, digest: str) -> "Optional[BlobContent]":
+        """Get stored content by its digest.
+
+        Args:
+            digest (str): the SHA-256 hex digest of the content.
+
+        Returns:
+            Optional[BlobContent]: the content, if it is in the store.
+        """
+        return self._contents.get(digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._contents
+
+    def __iter__(self) -> "Iterator[BlobContent]":
+        return iter(list(self._contents.values()))
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+
+def _to_bytes(content: "BlobData") -> bytes:
+    if isinstance(content, bytes):
+        return content
+    if isinstance(content, io.BytesIO):
+        # This does not copy the buffer if it is not written to afterwards.
+        return content.getvalue()
+    if isinstance(content, str):
+        return content.encode("utf-8")
+    if isinstance(content, (bytearray, memoryview)):
+        return bytes(content)
+    raise TypeError(f"Unsupported blob content type: {type(content).__name__}")
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import pandas as pd
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, Optional, Sequence, Tuple
+
+    import pyarrow as pa
+
+    from kpireport.report import Report
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+WINDOW_METADATA_KEY = b"kpireport.window"
+
+
+def default_cache_dir():
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "kpireporter")
+
+
+class QueryCache:
+    """A persistent on-disk cache of Datasource query results.
+
+    Results are stored as Parquet files, keyed by the Datasource ID and
+    configuration, the query arguments and the report window, so they can be
+    reused by later runs of reports with the same window. Entries can also be
+    keyed independently of the report window, in which case the window the result
+    covers is stored alongside it (see :meth:`get_window`.) Entries expire after
+    ``ttl`` seconds, except for those stored with a window, which are only reused
+    for the part of a later window they cover, and are typically read again a
+    whole report interval later. When the cache grows beyond ``max_size`` bytes,
+    the least recently used entries are evicted.
+
+    .. note::
+
+       The cache requires :mod:`pyarrow` to be installed, e.g., via the
+       ``kpireport[cache]`` extra.
+
+    Attributes:
+        path (str): the directory to store cache entries in.
+            (Default ``$XDG_CACHE_HOME/kpireporter``)
+        ttl (int): how long entries are valid for, in seconds. (Default 1 day)
+        max_size (int): the maximum total size of all entries, in bytes.
+            (Default 256MB)
+    """
+
+    suffix = ".parquet"
+    window_suffix = ".window.parquet"
+
+    def __init__(
+        self, report: "Report", path=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE
+    ):
+        # Fail early if the storage engine is not available.
+        import pyarrow  # noqa
+
+        self.report = report
+        self.path = os.path.abspath(path or default_cache_dir())
+        self.ttl = int(ttl)
+        self.max_size = int(max_size)
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(
+        self,
+        datasource: str,
+        args: "Sequence[Any]" = (),
+        kwargs: "Optional[Dict[str, Any]]" = None,
+        windowed=True,
+        config: "Optional[Dict[str, Any]]" = None,
+    ) -> str:
+        """Compute the cache key for a query.
+
+        Args:
+            datasource (str): the Datasource ID.
+            args (Sequence[Any]): the positional query arguments, typically the
+                query text.
+            kwargs (Dict[str, Any]): the keyword query arguments.
+            windowed (bool): whether the key includes the report window.
+            config (Dict[str, Any]): the Datasource configuration, i.e., its
+                plugin and arguments. The cache directory is shared by all
+                reports, so Datasources with the same ID but, e.g., a different
+                host, do not share entries.
+
+        Returns:
+            str: the cache key.
+        """
+        parts = [datasource, config or {}, list(args), kwargs or {}]
+        if windowed:
+            parts.extend(
+                [self.report.start_date.isoformat(), self.report.end_date.isoformat()]
+            )
+        # Unknown types (e.g., timedeltas) are keyed by their string value.
+        serialized = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str, window=False) -> str:
+        suffix = self.window_suffix if window else self.suffix
+        return os.path.join(self.path, f"{key}{suffix}")
+
+    def _read(self, key: str, window=False) -> "Optional[pa.Table]":
+        import pyarrow.parquet as pq
+
+        entry = self._entry_path(key, window=window)
+        try:
+            mtime = os.stat(entry).st_mtime
+            if not window and time.time() - mtime > self.ttl:
+                os.remove(entry)
+                return None
+            table = pq.read_table(entry)
+            # The access time tracks usage for eviction, while the modification
+            # time is kept, as entries expire based on when they were written.
+            os.utime(entry, (time.time(), mtime))
+            return table
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            LOG.warning(f"Failed to read query cache entry {key}: {exc}")
+            return None
+
+    def get(self, key: str) -> "Optional[pd.DataFrame]":
+        """Get a cached query result.
+
+        Args:
+            key (str): the cache key.
+
+        Returns:
+            Optional[pandas.DataFrame]: the cached result, if it exists and has
+                not expired.
+        """
+        table = self._read(key)
+        if table is None:
+            return None
+        return table.to_pandas()
+
+    def get_window(
+        self, key: str
+    ) -> "Optional[Tuple[pd.DataFrame, Tuple[datetime, datetime]]]":
+        """Get a cached query result along with the window it covers.
+
+        Args:
+            key (str): the cache key.
+
+        Returns:
+            Optional[Tuple[pandas.DataFrame, Tuple[datetime, datetime]]]: the
+                cached result and its (start, end) window, if the entry exists
+                and was stored with a window.
+        """
+        table = self._read(key, window=True)
+        if table is None:
+            return None
+        window = (table.schema.metadata or {}).get(WINDOW_METADATA_KEY)
+        if not window:
+            return None
+        start, end = [datetime.fromisoformat(d) for d in json.loads(window)]
+        return table.to_pandas(), (start, end)
+
+    def set(
+        self,
+        key: str,
+        df: "pd.DataFrame",
+        window: "Optional[Tuple[datetime, datetime]]" = None,
+    ):
+        """Store a query result.
+
+        Results that cannot be stored (e.g., those that are not DataFrames, or
+        which contain columns that cannot be serialized) are skipped.
+
+        Args:
+            key (str): the cache key.
+            df (pandas.DataFrame): the query result.
+            window (Optional[Tuple[datetime, datetime]]): the (start, end) window
+                covered by the result. Results stored with a window are read
+                with :meth:`get_window`, and do not expire.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not isinstance(df, pd.DataFrame):
+            return
+
+        entry = self._entry_path(key, window=bool(window))
+        # Write to a temporary file first, so concurrent readers never see a
+        # partially written entry.
+        tmp_entry = f"{entry}.{uuid.uuid4().hex}.tmp"
+        try:
+            table = pa.Table.from_pandas(df)
+            if window:
+                metadata = dict(table.schema.metadata or {})
+                metadata[WINDOW_METADATA_KEY] = json.dumps(
+                    [d.isoformat() for d in window]
+                )
+                table = table.replace_schema_metadata(metadata)
+            pq.write_table(table, tmp_entry)
+            os.replace(tmp_entry, entry)
+        except Exception as exc:
+            LOG.debug(f"Failed to write query cache entry {key}: {exc}")
+            if os.path.exists(tmp_entry):
+                os.remove(tmp_entry)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, and the least recently used entries (including
+        those stored with a window) until the cache is within its maximum size.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                stat = os.stat(entry)
+                expires = not name.endswith(self.window_suffix)
+                if expires and now - stat.st_mtime > self.ttl:
+                    os.remove(entry)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, entry))
+            except FileNotFoundError:
+                continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total_size -= size
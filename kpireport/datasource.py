@@ -1,18 +1,28 @@
+import copy
+import json
 import logging
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
 
 from kpireport.plugin import PluginManager
 
 if TYPE_CHECKING:
+    from typing import Any, Dict, Optional, Tuple
+
+    from kpireport.cache import QueryCache
     from kpireport.report import Report
 
 LOG = logging.getLogger(__name__)
 
 EXTENSION_NAMESPACE = "kpireport.datasource"
 
+DEFAULT_MAX_CONCURRENCY = 1
+
 
 class DatasourceError(Exception):
     """
@@ -24,6 +34,22 @@ class DatasourceError(Exception):
 
 class Datasource(ABC):
     """
+    Datasources returning time-indexed results can additionally support
+    incremental fetching, by implementing ``query_window(start_date, end_date,
+    *args, **kwargs)``, which executes a query over an arbitrary time window, and
+    ``time_index(df)``, which returns the (timezone-aware) time of each row of
+    a query result as a :class:`pandas.DatetimeIndex`.
+
+    Views can describe the shape of the result they need with hints, which
+    Datasources may use to return less data. A Datasource lists the hints it
+    supports in ``supported_hints``; these are passed to ``query`` as additional
+    keyword arguments, while other hints are dropped. Hints are:
+
+    * ``limit`` (int): only the first ``limit`` rows of the result are used.
+    * ``target_points`` (int): the result is displayed with about this many
+      points per series (e.g., the width of a plot, in pixels), so it may be
+      aggregated or sampled down to that resolution.
+
     :param report: the Report object.
     :type report: :class:`kpireport.report.Report`
     :param id: the Datasource ID declared in the report configuration.
@@ -33,6 +59,7 @@ class Datasource(ABC):
     """
 
     id = None
+    supported_hints: "Tuple[str, ...]" = ()
 
     def __init__(self, report: "Report", **kwargs):
         self.report = report
@@ -65,13 +92,207 @@ class Datasource(ABC):
 
 
 class DatasourceManager(PluginManager[Datasource]):
+    """Manages all Datasources declared in the report configuration.
+
+    Queries may be issued from multiple threads. The number of queries running
+    concurrently against a single Datasource is bounded by its ``max_concurrency``
+    setting (default 1), so Datasources need not be thread-safe by default.
+
+    If a :class:`~kpireport.cache.QueryCache` is given, query results are cached
+    on disk, unless the Datasource's ``cache`` setting is ``false``.
+
+    Identical queries are only executed once per report; concurrent callers wait
+    for the same result. As results are shared between callers, they are
+    read-only: modifying their data in place raises a :class:`ValueError`.
+    Results with Python object columns (e.g., strings), which pandas cannot
+    operate on when read-only, are instead copied for each caller.
+
+    Queries of time series can be fetched incrementally, if the caller opts in
+    and the Datasource supports it (see :class:`Datasource`.) Their results are
+    cached independently of the report window. When a later report window
+    overlaps with the cached window, the overlapping part of the cached result
+    is reused, and only the remainder of the window is queried from the
+    Datasource. This is only correct for queries whose rows each describe a
+    single point in time, and not, e.g., aggregates over the window.
+    """
 
     namespace = "kpireport.datasource"
     type_noun = "datasource"
     exc_class = DatasourceError
 
-    def query(self, name, *args, **kwargs) -> pd.DataFrame:
-        result = self.call_instance(name, "query", *args, **kwargs)
+    def __init__(
+        self,
+        report: "Report",
+        config: "Dict",
+        extension_manager=None,
+        cache: "Optional[QueryCache]" = None,
+    ):
+        self.cache = cache
+        self._cache_enabled = {
+            id: conf.get("cache", True) for id, conf in config.items()
+        }
+        # The plugin and its arguments identify what a Datasource queries, e.g.,
+        # which host, in the cache; they are copied before plugins can modify them.
+        self._cache_config = {
+            id: copy.deepcopy({"plugin": conf.get("plugin"), "args": conf.get("args")})
+            for id, conf in config.items()
+        }
+        self._max_concurrency = {
+            id: int(conf.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+            for id, conf in config.items()
+        }
+        self._semaphores = {
+            id: threading.BoundedSemaphore(value)
+            for id, value in self._max_concurrency.items()
+        }
+        self._queries: "Dict[str, Future]" = {}
+        self._queries_lock = threading.Lock()
+        super(DatasourceManager, self).__init__(report, config, extension_manager)
+
+    def max_concurrency(self, name: str) -> int:
+        """Get the number of queries that can run concurrently against a Datasource.
+
+        Args:
+            name (str): the Datasource ID.
+
+        Returns:
+            int: the maximum number of concurrent queries.
+        """
+        return self._max_concurrency.get(name, DEFAULT_MAX_CONCURRENCY)
+
+    def query(
+        self,
+        name,
+        *args,
+        hints: "Optional[Dict[str, Any]]" = None,
+        incremental=False,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Query a Datasource.
+
+        Args:
+            name (str): the Datasource ID.
+            args: positional arguments for the Datasource's ``query``.
+            hints (Optional[Dict[str, Any]]): hints about the shape of the result
+                needed (see :class:`Datasource`.) Hints not supported by the
+                Datasource are ignored.
+            incremental (bool): whether the result is a time series, whose rows
+                can be reused by later reports with an overlapping window. This
+                requires the query cache, and is ignored if any hints are passed
+                to the Datasource, as those apply to the whole result.
+            kwargs: keyword arguments for the Datasource's ``query``.
+
+        Returns:
+            pandas.DataFrame: the query result.
+        """
+        if hints:
+            supported_hints = self._supported_hints(name, hints)
+            # A limited or downsampled result cannot be combined with the result
+            # of another window.
+            incremental = incremental and not supported_hints
+            # Explicit query arguments take precedence over hints.
+            kwargs = {**supported_hints, **kwargs}
+
+        # Unknown types (e.g., timedeltas) are keyed by their string value.
+        key = json.dumps([name, args, kwargs, incremental], sort_keys=True, default=str)
+        with self._queries_lock:
+            future = self._queries.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._queries[key] = Future()
+
+        if is_owner:
+            try:
+                result = self._query(name, incremental, *args, **kwargs)
+                future.set_result(_read_only(result))
+            except Exception as exc:
+                future.set_exception(exc)
+                # Allow failed queries to be retried by later callers.
+                with self._queries_lock:
+                    del self._queries[key]
+
+        return _isolate(future.result())
+
+    def _supported_hints(self, name, hints: "Dict[str, Any]") -> "Dict[str, Any]":
+        supported = getattr(self.get_instance(name), "supported_hints", ())
+        if not isinstance(supported, (tuple, list, set, frozenset)):
+            return {}
+        return {
+            hint: value
+            for hint, value in hints.items()
+            if hint in supported and value is not None
+        }
+
+    def _query(self, name, incremental, *args, **kwargs) -> pd.DataFrame:
+        if not (self.cache and self._cache_enabled.get(name, True)):
+            return self._call(name, "query", *args, **kwargs)
+
+        if incremental and callable(
+            getattr(self.get_instance(name), "query_window", None)
+        ):
+            return self._query_incremental(name, *args, **kwargs)
+
+        cache_key = self.cache.key(
+            name, args, kwargs, config=self._cache_config.get(name)
+        )
+        result = self.cache.get(cache_key)
+        if result is not None:
+            self.log.debug(f"Using cached result for {self.type_noun} {name}")
+            return result
+
+        result = self._call(name, "query", *args, **kwargs)
+        self.cache.set(cache_key, result)
+        return result
+
+    def _query_incremental(self, name, *args, **kwargs) -> pd.DataFrame:
+        instance = self.get_instance(name)
+        start, end = self.report.start_date, self.report.end_date
+        cache_key = self.cache.key(
+            name, args, kwargs, windowed=False, config=self._cache_config.get(name)
+        )
+
+        parts = []
+        fetch_start = start
+        cached = self.cache.get_window(cache_key)
+        if cached:
+            df, (cached_start, cached_end) = cached
+            if cached_start <= start < cached_end:
+                try:
+                    times = instance.time_index(df)
+                except ValueError as exc:
+                    self.log.warning(
+                        f"Cannot fetch {self.type_noun} {name} incrementally: {exc}"
+                    )
+                else:
+                    if end > cached_end:
+                        # The rest of the window is fetched from the high-water
+                        # mark; samples at the mark are included in that query.
+                        overlap = (times >= start) & (times < cached_end)
+                        fetch_start = cached_end
+                    else:
+                        overlap = (times >= start) & (times <= end)
+                        fetch_start = end
+                    parts.append(df[overlap])
+
+        if fetch_start < end or not parts:
+            self.log.debug(
+                f"Fetching {self.type_noun} {name} from {fetch_start} to {end}"
+            )
+            parts.append(
+                self._call(name, "query_window", fetch_start, end, *args, **kwargs)
+            )
+
+        result = pd.concat(parts) if len(parts) > 1 else parts[0]
+        self.cache.set(cache_key, result, window=(start, end))
+        return result
+
+    def _call(self, name, method, *args, **kwargs) -> pd.DataFrame:
+        semaphore = self._semaphores.get(name)
+        if semaphore:
+            with semaphore:
+                result = self.call_instance(name, method, *args, **kwargs)
+        else:
+            result = self.call_instance(name, method, *args, **kwargs)
 
         if not isinstance(result, pd.core.base.PandasObject):
             raise self.exc_class(
@@ -79,3 +300,29 @@ class DatasourceManager(PluginManager[Datasource]):
             )
 
         return result
+
+
+def _read_only(result: "pd.core.base.PandasObject") -> "pd.core.base.PandasObject":
+    """Mark the underlying data of a query result as read-only."""
+    mgr = getattr(result, "_mgr", None)
+    for values in getattr(mgr, "arrays", []):
+        # Extension arrays, e.g., for dates, are backed by a NumPy array.
+        values = getattr(values, "_ndarray", values)
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            values.flags.writeable = False
+    return result
+
+
+def _isolate(result: "pd.core.base.PandasObject") -> "pd.core.base.PandasObject":
+    """Get a copy of a shared query result for a single caller.
+
+    The copy shares the read-only data, but not the container, so e.g. adding
+    columns does not affect other callers. pandas cannot operate on read-only
+    Python object arrays (e.g., strings), so those results are copied instead.
+    """
+    dtypes = getattr(result, "dtypes", None)
+    if isinstance(dtypes, pd.Series):
+        has_objects = (dtypes == object).any()
+    else:
+        has_objects = dtypes == object
+    return result.copy(deep=bool(has_objects))
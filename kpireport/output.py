@@ -53,7 +53,9 @@ class OutputDriver(ABC):
         in the mail message, while a HTML file output driver may use an <img>
         tag and link to the file, or perhaps use a data-uri.
 
-        This function is used when invoking the ``blob`` template filter.
+        This function is used when invoking the ``blob`` template filter. The
+        returned markup is substituted into the already-rendered View output, so
+        it should only depend on the blob and the output format.
 
         Args:
             blob (`~kpireport.view.Blob`): the Blob to render.
@@ -8,12 +8,13 @@ from dateutil.tz import gettz, tzlocal
 from jinja2 import TemplateNotFound
 from slugify import slugify
 
+from .cache import QueryCache
 from .datasource import DatasourceManager
 from .license import License
 from .output import OutputDriverManager
 from .utils import make_jinja_environment
 from .version import VERSION
-from .view import ViewManager
+from .view import RenderPlan, ViewManager
 
 if TYPE_CHECKING:
     from typing import List, Optional
@@ -54,6 +55,12 @@ class Theme:
             due to Jinja escaping rules, this does not like embedded quotes. Quotes
             are *not* required even when a typeface has a space in the name, so they
             are safe to simply omit.
+        image_format (str): the default format of images rendered by views, such
+            as plots. Either "png", "webp" or "svg"; views may not support all
+            formats. (Default "png")
+        image_options (dict): the default options for encoding images, such as
+            the PNG compression level or the size of the color palette. The
+            options supported depend on the view and image format.
 
     """
 
@@ -68,6 +75,8 @@ class Theme:
         success_colors=None,
         series_colors=None,
         heading_font=None,
+        image_format="png",
+        image_options=None,
     ):
         self.num_columns = num_columns
         self.column_width = column_width
@@ -99,6 +108,8 @@ class Theme:
         ]
         self.heading_font = heading_font or "Helvetica, Arial, sans-serif"
         self.text_font = "Helvetica, Arial, sans-serif"
+        self.image_format = image_format
+        self.image_options = image_options or {}
 
     @property
     def text_color(self):
@@ -275,6 +286,8 @@ class ReportFactory:
 
     Attributes:
         config (dict): the (parsed) configuration YAML file.
+        max_workers (Optional[int]): the number of threads used to fetch the data
+            for all Views concurrently.
         supported_formats (List[str]): the output formats that any report can
             target.
     """
@@ -311,6 +324,7 @@ class ReportFactory:
 
         title = config.get("title", "Status report")
         theme = Theme(**config.get("theme", {}))
+        self.max_workers = config.get("max_workers")
 
         self.report = Report(
             title=title,
@@ -320,7 +334,9 @@ class ReportFactory:
             timezone=timezone,
             theme=theme,
         )
-        self.dm = DatasourceManager(self.report, datasource_conf)
+        self.dm = DatasourceManager(
+            self.report, datasource_conf, cache=self._make_cache(config.get("cache"))
+        )
         self.vm = ViewManager(self.dm, self.report, view_conf)
         self.odm = OutputDriverManager(self.report, output_conf)
         self.env = make_jinja_environment(theme)
@@ -328,6 +344,22 @@ class ReportFactory:
         self.license = License(config.get("license_key"))
         self.env.globals["print_license"] = self.license.render
 
+    def _make_cache(self, cache_conf) -> "Optional[QueryCache]":
+        if not cache_conf:
+            return None
+        if not isinstance(cache_conf, dict):
+            cache_conf = {}
+        try:
+            return QueryCache(self.report, **cache_conf)
+        except ImportError:
+            LOG.warning(
+                (
+                    "Query caching requires pyarrow; ensure the [cache] extras "
+                    "are installed. Continuing without a query cache."
+                )
+            )
+            return None
+
     def create(self):
         """Render all Views in the report and output using the output driver.
 
@@ -336,13 +368,20 @@ class ReportFactory:
            This will send the report using all configured output drivers!
            Disable any output drivers you don't wish to send to during testing.
 
+        The data for all Views is first fetched concurrently, using up to
+        ``max_workers`` threads (see :meth:`~kpireport.view.ViewManager.prefetch`.)
+        Each View is then only rendered once per format; the rendered output is
+        shared between all output drivers (see :class:`~kpireport.view.RenderPlan`).
         """
+        self.vm.prefetch(max_workers=self.max_workers)
+
+        plan = RenderPlan(self.vm, self.env)
         for id, output_driver in self.odm.instances:
             LOG.info(f"Sending report via output driver {id}")
             content = Content(self.env, self.report)
             for fmt in self.supported_formats:
                 self.env.globals["print_license"] = partial(self.license.render, fmt)
-                blocks = self.vm.render(self.env, fmt, output_driver)
+                blocks = plan.render(fmt, output_driver)
                 content.add_format(fmt, blocks)
             if not self.license.rendered:
                 raise ValueError("Template is missing `{{ print_license() }}` call")
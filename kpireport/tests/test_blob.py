@@ -0,0 +1,53 @@
+import base64
+import hashlib
+import io
+
+import pytest
+from kpireport.blob import BlobContent, BlobStore
+
+
+def test_add_hashes_content():
+    store = BlobStore()
+    content = store.add(b"fake-image")
+    assert content.digest == hashlib.sha256(b"fake-image").hexdigest()
+    assert content.digest in store
+    assert store.get(content.digest) is content
+    assert content.size == len(b"fake-image")
+    assert bytes(content.data) == b"fake-image"
+
+
+def test_add_shares_identical_content():
+    store = BlobStore()
+    first = store.add(b"fake-image")
+    second = store.add(io.BytesIO(b"fake-image"))
+    third = store.add(memoryview(b"fake-image"))
+    assert first is second is third
+    assert len(store) == 1
+    assert store.add(b"other-image") is not first
+    assert len(store) == 2
+
+
+def test_add_content_from_other_store():
+    content = BlobStore().add(b"fake-image")
+    store = BlobStore()
+    assert store.add(content) is content
+    assert store.add(b"fake-image") is content
+
+
+def test_add_unsupported_type():
+    with pytest.raises(TypeError):
+        BlobStore().add(42)
+
+
+def test_content_is_read_only():
+    content = BlobStore().add(bytearray(b"fake-image"))
+    with pytest.raises(TypeError):
+        content.data[0] = 0
+
+
+def test_encodings():
+    content = BlobContent(b"fake-image", digest="fake-digest")
+    assert content.getvalue() == b"fake-image"
+    assert content.base64() == base64.b64encode(b"fake-image").decode()
+    assert content.base64() is content.base64()
+    assert content.etag() == f'"{hashlib.md5(b"fake-image").hexdigest()}"'
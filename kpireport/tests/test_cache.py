@@ -0,0 +1,212 @@
+import os
+import time
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+from kpireport.datasource import DatasourceManager
+from kpireport.report import Report
+from kpireport.tests.fixtures import FakePlugin, report
+from kpireport.tests.utils import make_fake_extension_manager
+
+pytest.importorskip("pyarrow")
+
+from kpireport.cache import DEFAULT_TTL, QueryCache  # noqa: E402
+
+NAME = "my_datasource"
+PLUGIN = "my_plugin"
+
+
+def make_df():
+    return pd.DataFrame(
+        {"value": [1.0, 2.0]},
+        index=pd.DatetimeIndex(["2020-05-01", "2020-05-02"], name="time"),
+    )
+
+
+@pytest.fixture
+def cache(report: "Report", tmp_path):
+    return QueryCache(report, path=str(tmp_path))
+
+
+def make_datasource_manager(cache, conf=None):
+    calls = []
+
+    class TestPlugin(FakePlugin):
+        def __init__(self, report, **kwargs):
+            pass
+
+        def query(self, input, **kwargs):
+            calls.append(input)
+            return make_df()
+
+    conf = conf or {NAME: {"plugin": PLUGIN}}
+    ext_mgr = make_fake_extension_manager([(PLUGIN, TestPlugin)])
+    return DatasourceManager(MagicMock(), conf, ext_mgr, cache=cache), calls
+
+
+def test_key(cache: "QueryCache", report: "Report"):
+    key = cache.key(NAME, ["select 1"], {"step": timedelta(minutes=5)})
+    assert key == cache.key(NAME, ["select 1"], {"step": timedelta(minutes=5)})
+    assert key != cache.key(NAME, ["select 2"], {"step": timedelta(minutes=5)})
+    assert key != cache.key("other", ["select 1"], {"step": timedelta(minutes=5)})
+    assert key != cache.key(NAME, ["select 1"], {"step": timedelta(minutes=1)})
+
+    config = {"plugin": PLUGIN, "args": {"host": "first"}}
+    key = cache.key(NAME, ["select 1"], config=config)
+    assert key == cache.key(NAME, ["select 1"], config=dict(config))
+    assert key != cache.key(NAME, ["select 1"])
+    assert key != cache.key(
+        NAME, ["select 1"], config={"plugin": PLUGIN, "args": {"host": "second"}}
+    )
+    assert key != cache.key(
+        NAME, ["select 1"], config={"plugin": "other", "args": {"host": "first"}}
+    )
+
+    report.start_date -= timedelta(days=1)
+    assert key != cache.key(NAME, ["select 1"], config=config)
+
+
+def test_roundtrip(cache: "QueryCache"):
+    cache.set("key", make_df())
+    pd.testing.assert_frame_equal(cache.get("key"), make_df())
+    assert cache.get("missing") is None
+
+
+def test_ttl(cache: "QueryCache"):
+    cache.set("key", make_df())
+    entry = os.path.join(cache.path, "key.parquet")
+    expired = time.time() - cache.ttl - 1
+    os.utime(entry, (expired, expired))
+    assert cache.get("key") is None
+    assert not os.path.exists(entry)
+
+
+def test_window(cache: "QueryCache", report: "Report"):
+    window = (report.start_date, report.end_date)
+    cache.set("key", make_df(), window=window)
+    df, cached_window = cache.get_window("key")
+    pd.testing.assert_frame_equal(df, make_df())
+    assert cached_window == window
+    assert cache.get("key") is None
+    assert cache.get_window("missing") is None
+
+
+def test_max_size(cache: "QueryCache"):
+    cache.set("first", make_df())
+    entry_size = os.path.getsize(os.path.join(cache.path, "first.parquet"))
+    os.utime(os.path.join(cache.path, "first.parquet"), (0, time.time()))
+    cache.max_size = entry_size
+    cache.set("second", make_df())
+    assert cache.get("first") is None
+    assert cache.get("second") is not None
+
+
+def test_datasource_manager_cache(cache: "QueryCache"):
+    first_mgr, first_calls = make_datasource_manager(cache)
+    second_mgr, second_calls = make_datasource_manager(cache)
+    pd.testing.assert_frame_equal(first_mgr.query(NAME, "some input"), make_df())
+    pd.testing.assert_frame_equal(second_mgr.query(NAME, "some input"), make_df())
+    assert first_calls == ["some input"]
+    assert second_calls == []
+
+
+def test_datasource_manager_cache_config(cache: "QueryCache"):
+    def make_conf(host):
+        return {NAME: {"plugin": PLUGIN, "args": {"host": host}}}
+
+    first_mgr, first_calls = make_datasource_manager(cache, make_conf("first"))
+    second_mgr, second_calls = make_datasource_manager(cache, make_conf("second"))
+    same_mgr, same_calls = make_datasource_manager(cache, make_conf("first"))
+    for mgr in [first_mgr, second_mgr, same_mgr]:
+        mgr.query(NAME, "some input")
+    # Datasources with the same ID, but querying another host, are not cached
+    # together.
+    assert first_calls == ["some input"]
+    assert second_calls == ["some input"]
+    assert same_calls == []
+
+
+def test_datasource_manager_cache_disabled(cache: "QueryCache"):
+    conf = {NAME: {"plugin": PLUGIN, "cache": False}}
+    first_mgr, first_calls = make_datasource_manager(cache, conf)
+    second_mgr, second_calls = make_datasource_manager(cache, conf)
+    first_mgr.query(NAME, "some input")
+    second_mgr.query(NAME, "some input")
+    assert first_calls == ["some input"]
+    assert second_calls == ["some input"]
+
+
+def make_window_plugin(calls):
+    class TestPlugin(FakePlugin):
+        supported_hints = ("limit",)
+
+        def query(self, input, **kwargs):
+            calls.append(("query", input, kwargs))
+            return make_df()
+
+        def query_window(self, start_date, end_date, input):
+            calls.append(("query_window", start_date, end_date))
+            index = pd.date_range(start_date, end_date, freq="1h", name="time")
+            return pd.DataFrame({"value": index.hour}, index=index)
+
+        def time_index(self, df):
+            return df.index
+
+    return make_fake_extension_manager([(PLUGIN, TestPlugin)])
+
+
+def next_window(report: "Report"):
+    report.start_date += timedelta(days=1)
+    report.end_date += timedelta(days=1)
+
+
+@pytest.mark.parametrize("elapsed", [0, DEFAULT_TTL + 60])
+def test_incremental(cache: "QueryCache", report: "Report", elapsed):
+    calls = []
+    conf = {NAME: {"plugin": PLUGIN}}
+    ext_mgr = make_window_plugin(calls)
+
+    first_end = report.end_date
+    mgr = DatasourceManager(report, conf, ext_mgr, cache=cache)
+    mgr.query(NAME, "some input", incremental=True)
+    # A daily report runs again about a TTL later; its entry has not expired, nor
+    # is it evicted when other entries are written.
+    for name in os.listdir(cache.path):
+        mtime = time.time() - elapsed
+        os.utime(os.path.join(cache.path, name), (mtime, mtime))
+    cache.evict()
+    next_window(report)
+    mgr = DatasourceManager(report, conf, ext_mgr, cache=cache)
+    df = mgr.query(NAME, "some input", incremental=True)
+
+    assert len(calls) == 2
+    assert calls[-1] == ("query_window", first_end, report.end_date)
+    expected = pd.date_range(report.start_date, report.end_date, freq="1h")
+    assert list(df.index) == list(expected)
+    assert list(df["value"]) == list(expected.hour)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        # Queries are only fetched incrementally if the caller opts in, as
+        # e.g. aggregates cannot be combined across windows.
+        dict(),
+        # Limited results cannot be combined across windows either.
+        dict(incremental=True, hints=dict(limit=5)),
+    ],
+)
+def test_incremental_skipped(cache: "QueryCache", report: "Report", kwargs):
+    calls = []
+    conf = {NAME: {"plugin": PLUGIN}}
+    ext_mgr = make_window_plugin(calls)
+
+    for _ in range(2):
+        mgr = DatasourceManager(report, conf, ext_mgr, cache=cache)
+        mgr.query(NAME, "some input", **kwargs)
+        next_window(report)
+
+    expected_kwargs = kwargs.get("hints", {})
+    assert calls == [("query", "some input", expected_kwargs)] * 2
@@ -1,8 +1,12 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
 import pandas as pd
 import pytest
-from kpireport.datasource import DatasourceError
+from kpireport.datasource import DatasourceError, DatasourceManager
 from kpireport.tests.fixtures import FakePlugin
-from kpireport.tests.utils import make_datasource_manager
+from kpireport.tests.utils import make_datasource_manager, make_fake_extension_manager
 
 NAME = "my_datasource"
 PLUGIN = "my_plugin"
@@ -62,3 +66,105 @@ def test_multiple_plugins():
     mgr = make_datasource_manager({"first": FirstTestPlugin, NAME: SecondTestPlugin})
 
     pd.testing.assert_frame_equal(df, mgr.query(NAME, "some input"))
+
+
+def test_max_concurrency():
+    class TestPlugin(FakePlugin):
+        def query(self, input):
+            return pd.DataFrame()
+
+    conf = {
+        NAME: {"plugin": PLUGIN, "max_concurrency": 4},
+        "second": {"plugin": PLUGIN},
+    }
+    ext_mgr = make_fake_extension_manager([(PLUGIN, TestPlugin)])
+    mgr = DatasourceManager(MagicMock(), conf, extension_manager=ext_mgr)
+
+    assert mgr.max_concurrency(NAME) == 4
+    assert mgr.max_concurrency("second") == 1
+    pd.testing.assert_frame_equal(pd.DataFrame(), mgr.query(NAME, "some input"))
+
+
+def test_identical_queries_coalesced():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    class TestPlugin(FakePlugin):
+        def query(self, input, **kwargs):
+            calls.append(input)
+            started.set()
+            release.wait(timeout=5)
+            return pd.DataFrame({"value": [1.0, 2.0]})
+
+    mgr = make_datasource_manager({NAME: TestPlugin})
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(mgr.query, NAME, "some input")
+        started.wait(timeout=5)
+        second = pool.submit(mgr.query, NAME, "some input")
+        release.set()
+        first_df, second_df = first.result(), second.result()
+
+    third_df = mgr.query(NAME, "some input")
+    mgr.query(NAME, "other input")
+
+    assert calls == ["some input", "other input"]
+    pd.testing.assert_frame_equal(first_df, second_df)
+    pd.testing.assert_frame_equal(first_df, third_df)
+
+
+def test_query_result_read_only():
+    class TestPlugin(FakePlugin):
+        def query(self, input):
+            return pd.DataFrame({"value": [1.0, 2.0]})
+
+    mgr = make_datasource_manager({NAME: TestPlugin})
+
+    first_df = mgr.query(NAME, "some input")
+    with pytest.raises(ValueError):
+        first_df.iloc[0, 0] = 3.0
+    first_df["other"] = 1
+
+    second_df = mgr.query(NAME, "some input")
+    assert list(second_df.columns) == ["value"]
+    assert second_df["value"][0] == 1.0
+
+
+def test_failed_query_retried():
+    calls = []
+
+    class TestPlugin(FakePlugin):
+        def query(self, input):
+            calls.append(input)
+            if len(calls) == 1:
+                raise ValueError("Temporary failure")
+            return pd.DataFrame()
+
+    mgr = make_datasource_manager({NAME: TestPlugin})
+
+    with pytest.raises(ValueError):
+        mgr.query(NAME, "some input")
+    mgr.query(NAME, "some input")
+    assert len(calls) == 2
+
+
+def test_query_hints():
+    class TestPlugin(FakePlugin):
+        supported_hints = ("limit",)
+
+        def query(self, input, limit=None):
+            return pd.DataFrame({"value": range(10)}).head(limit)
+
+    class UnsupportedPlugin(FakePlugin):
+        def query(self, input):
+            return pd.DataFrame({"value": range(10)})
+
+    mgr = make_datasource_manager({NAME: TestPlugin, "second": UnsupportedPlugin})
+    hints = dict(limit=3, target_points=100)
+
+    assert len(mgr.query(NAME, "some input", hints=hints)) == 3
+    # Explicit arguments take precedence
+    assert len(mgr.query(NAME, "some input", hints=hints, limit=5)) == 5
+    assert len(mgr.query(NAME, "some input", hints=dict(limit=None))) == 10
+    assert len(mgr.query("second", "some input", hints=hints)) == 10
@@ -1,2 +1,136 @@
+import threading
+import time
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+from jinja2 import DictLoader, Environment
+from kpireport.report import Report
+from kpireport.tests.fixtures import FakeOutputDriver, report
+from kpireport.tests.utils import make_fake_extension_manager
+from kpireport.view import RenderPlan, View, ViewManager
+
+NAME = "my_view"
+PLUGIN = "my_plugin"
+
+
+class FakeView(View):
+    def init(self):
+        self.render_count = 0
+        self.add_blob("figure.png", b"", mime_type="image/png")
+
+    def render_html(self, j2):
+        self.render_count += 1
+        return j2.from_string("<p>{{ 'figure.png' | blob }}</p>").render()
+
+
+class FakeBlobOutputDriver(FakeOutputDriver):
+    def init(self, prefix=""):
+        self.prefix = prefix
+
+    def render_blob_inline(self, blob, fmt=None):
+        return f"{self.prefix}/{blob.id}"
+
+
+def make_view_manager(report: "Report"):
+    mgr = make_fake_extension_manager([(PLUGIN, FakeView)])
+    return ViewManager(MagicMock(), report, {NAME: {"plugin": PLUGIN}}, mgr)
+
+
 def test_view():
     pass
+
+
+def test_render_plan_renders_once(report: "Report"):
+    vm = make_view_manager(report)
+    plan = RenderPlan(vm, Environment(loader=DictLoader({})))
+    first = FakeBlobOutputDriver(report, prefix="first")
+    second = FakeBlobOutputDriver(report, prefix="second")
+
+    first_blocks = plan.render("html", first)
+    second_blocks = plan.render("html", second)
+
+    assert vm.get_instance(NAME).render_count == 1
+    assert first_blocks[0].output == f"<p>first/{NAME}/figure.png</p>"
+    assert second_blocks[0].output == f"<p>second/{NAME}/figure.png</p>"
+
+
+def test_render_plan_shares_blocks(report: "Report"):
+    vm = make_view_manager(report)
+    plan = RenderPlan(vm, Environment(loader=DictLoader({})))
+
+    first_blocks = plan.render("html", FakeBlobOutputDriver(report))
+    second_blocks = plan.render("html", FakeBlobOutputDriver(report))
+
+    assert first_blocks is second_blocks
+
+
+def test_render_plan_unsupported_blobs(report: "Report"):
+    class NoBlobOutputDriver(FakeOutputDriver):
+        def render_blob_inline(self, blob, fmt=None):
+            raise NotImplementedError()
+
+    vm = make_view_manager(report)
+    plan = RenderPlan(vm, Environment(loader=DictLoader({})))
+
+    blocks = plan.render("html", NoBlobOutputDriver(report))
+    assert blocks[0].tags == ["error"]
+    assert plan.render("html", FakeBlobOutputDriver(report))[0].tags == []
+
+
+def test_render_plan_unsupported_format(report: "Report"):
+    vm = make_view_manager(report)
+    plan = RenderPlan(vm, Environment(loader=DictLoader({})))
+
+    assert plan.render("slack", FakeBlobOutputDriver(report)) == []
+    assert vm.get_instance(NAME).render_count == 0
+
+
+def test_prefetch_limits_datasource_concurrency(report: "Report"):
+    lock = threading.Lock()
+    running = defaultdict(int)
+    max_running = defaultdict(int)
+
+    class PrefetchView(View):
+        def init(self, datasource=None):
+            self.datasource = datasource
+            self.prefetched = False
+
+        def prefetch(self):
+            with lock:
+                running[self.datasource] += 1
+                max_running[self.datasource] = max(
+                    max_running[self.datasource], running[self.datasource]
+                )
+            time.sleep(0.01)
+            with lock:
+                running[self.datasource] -= 1
+            self.prefetched = True
+
+    conf = {
+        f"view_{i}": {"plugin": PLUGIN, "args": {"datasource": f"ds_{i % 2}"}}
+        for i in range(8)
+    }
+    dm = MagicMock()
+    dm.max_concurrency.side_effect = lambda ds: {"ds_0": 1, "ds_1": 2}[ds]
+    mgr = make_fake_extension_manager([(PLUGIN, PrefetchView)])
+    vm = ViewManager(dm, report, conf, mgr)
+
+    vm.prefetch(max_workers=4)
+
+    assert all(view.prefetched for _, view in vm.instances)
+    assert max_running["ds_0"] == 1
+    assert max_running["ds_1"] <= 2
+
+
+def test_views_share_blob_store(report: "Report"):
+    mgr = make_fake_extension_manager([(PLUGIN, FakeView)])
+    vm = ViewManager(
+        MagicMock(),
+        report,
+        {"first": {"plugin": PLUGIN}, "second": {"plugin": PLUGIN}},
+        mgr,
+    )
+    first, second = [blob for _, view in vm.instances for blob in view.blobs]
+    assert first.id != second.id
+    assert first.content is second.content
+    assert len(vm.blob_store) == 1
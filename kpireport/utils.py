@@ -1,4 +1,6 @@
+import threading
 from datetime import datetime
+from functools import wraps
 
 from jinja2 import ChoiceLoader, Environment, FileSystemLoader, PackageLoader
 
@@ -24,3 +26,25 @@ def make_jinja_loader(theme: "~kpireport.report.Theme"):
         return ChoiceLoader([FileSystemLoader(theme.theme_dir), package_loader])
     else:
         return package_loader
+
+
+def cached_method(fn):
+    """Cache the result of a method without arguments on the instance.
+
+    Unlike :func:`functools.lru_cache`, the result is stored per instance, and
+    concurrent callers wait for the first call to finish instead of invoking the
+    method again. Exceptions are not cached.
+    """
+    result_attr = f"_cached_{fn.__name__}"
+    lock_attr = f"_cached_{fn.__name__}_lock"
+
+    @wraps(fn)
+    def wrapper(self):
+        if result_attr not in self.__dict__:
+            # dict.setdefault is atomic, so only one lock is ever created.
+            with self.__dict__.setdefault(lock_attr, threading.Lock()):
+                if result_attr not in self.__dict__:
+                    self.__dict__[result_attr] = fn(self)
+        return self.__dict__[result_attr]
+
+    return wrapper
@@ -1,21 +1,33 @@
 import inspect
+import re
 import traceback
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
 from typing import TYPE_CHECKING
 
 from jinja2 import ChoiceLoader, Environment, PackageLoader, pass_eval_context
+from jinja2.utils import markupsafe
 
+from kpireport.blob import BlobStore
 from kpireport.datasource import DatasourceManager
 from kpireport.output import OutputDriver
 from kpireport.plugin import PluginManager
 from kpireport.utils import module_root
 
 if TYPE_CHECKING:
-    from typing import List, Optional
+    from typing import Dict, List, Optional, Tuple
 
+    from kpireport.blob import BlobContent, BlobData
     from kpireport.report import Report
 
+# Inline blobs are rendered as placeholders when a View is first rendered, and
+# only later substituted with the markup of a given output driver. NUL bytes are
+# used as delimiters as they are never escaped by Jinja's autoescaping.
+BLOB_PLACEHOLDER = "\x00kpireport-blob:{}\x00"
+BLOB_PLACEHOLDER_REGEX = re.compile(r"\x00kpireport-blob:([0-9]+)\x00")
+
 
 class ViewException(Exception):
     pass
@@ -35,7 +47,7 @@ class Block:
 @dataclass
 class Blob:
     id: str
-    content: str
+    content: "BlobContent"
     mime_type: "Optional[str]"
     title: "Optional[str]"
 
@@ -110,6 +122,10 @@ class View(ABC):
         self.report = report
         self.datasources = datasources
         self._blobs = {}
+        self.blob_store = kwargs.pop("blob_store", None)
+        if self.blob_store is None:
+            # Views created outside of a ViewManager keep their own blob store.
+            self.blob_store = BlobStore()
 
         if "id" in kwargs:
             self.id = kwargs.pop("id")
@@ -128,6 +144,16 @@ class View(ABC):
     def init(self, **kwargs):
         pass
 
+    def prefetch(self):
+        """Fetch any data needed by the View ahead of rendering.
+
+        This is invoked from a worker thread, concurrently with the prefetching
+        of other Views, before any View is rendered. Views that query
+        Datasources should override this to call their (cached) data step, so
+        that rendering does not have to wait on the Datasource.
+        """
+        pass
+
     def supports(self, fmt) -> bool:
         return callable(getattr(self, f"render_{fmt}", None))
 
@@ -140,10 +166,23 @@ class View(ABC):
 
         return getattr(self, f"render_{fmt}")(env)
 
-    def add_blob(self, id, blob, mime_type, title=None):
+    def add_blob(self, id, blob: "BlobData", mime_type, title=None):
+        """Add a blob, e.g., an image, to the View's output.
+
+        The content is added to the :class:`~kpireport.blob.BlobStore` shared by
+        all Views, so it is only hashed once, and blobs with the same content
+        share a single buffer.
+
+        Args:
+            id (str): the blob ID, unique within the View.
+            blob (Union[bytes, io.BytesIO]): the blob content.
+            mime_type (str): the MIME type of the content.
+            title (Optional[str]): the title of the blob. Defaults to the title
+                of the View.
+        """
         self._blobs[id] = Blob(
             id=f"{self.id}/{id}",
-            content=blob,
+            content=self.blob_store.add(blob),
             mime_type=mime_type,
             title=title or self.title,
         )
@@ -156,6 +195,98 @@ class View(ABC):
         return self._blobs.values()
 
 
+class InlineBlobRecorder:
+    """Stand-in for an output driver when rendering a View independently of one.
+
+    Instead of rendering a blob inline, a placeholder is emitted, which is later
+    substituted with the output driver's markup by :class:`RenderPlan`.
+    """
+
+    def __init__(self):
+        self.blobs: "List[Blob]" = []
+
+    def render_blob_inline(self, blob: "Blob", fmt=None):
+        self.blobs.append(blob)
+        return markupsafe.Markup(BLOB_PLACEHOLDER.format(len(self.blobs) - 1))
+
+
+class RenderPlan:
+    """Renders each View at most once per output format.
+
+    The View templates are rendered the first time a format is requested, and
+    the resulting Blocks are shared between all output drivers targeting that
+    format. Only the inline blob markup differs between output drivers; it is
+    substituted into the rendered output via a cheap string replacement, and
+    output drivers that render identical blob markup share the same Blocks.
+
+    Args:
+        view_manager (ViewManager): the manager of the Views to render.
+        env (Environment): the Jinja environment to render the Views with.
+    """
+
+    def __init__(self, view_manager: "ViewManager", env: Environment):
+        self.view_manager = view_manager
+        self.env = env
+        self._rendered: "Dict[str, List[Tuple[Block, List[Blob]]]]" = {}
+        self._resolved: "Dict[Tuple, List[Block]]" = {}
+
+    def render(self, fmt: str, output_driver: OutputDriver) -> "List[Block]":
+        """Get the rendered Blocks for a given format and output driver.
+
+        Args:
+            fmt (str): the output format.
+            output_driver (OutputDriver): the output driver rendering the blobs.
+
+        Returns:
+            List[Block]: the rendered Blocks, which may be shared with other
+                output drivers and should not be modified.
+        """
+        if not output_driver.can_render(fmt):
+            return []
+
+        if fmt not in self._rendered:
+            self._rendered[fmt] = self.view_manager.render_unresolved(self.env, fmt)
+        rendered = self._rendered[fmt]
+
+        markups = tuple(
+            self._render_inline_blobs(block, blobs, fmt, output_driver)
+            for block, blobs in rendered
+        )
+        key = (fmt, markups)
+        if key not in self._resolved:
+            self._resolved[key] = [
+                _substitute_blobs(block, markup)
+                for (block, _), markup in zip(rendered, markups)
+            ]
+
+        return self._resolved[key]
+
+    def _render_inline_blobs(
+        self, block: "Block", blobs: "List[Blob]", fmt: str, output_driver
+    ) -> "Optional[Tuple[str, ...]]":
+        try:
+            return tuple(
+                str(output_driver.render_blob_inline(blob, fmt)) for blob in blobs
+            )
+        except Exception as exc:
+            log = self.view_manager.log
+            log.error((f"Error rendering view {block.id} ({fmt}): {exc}"))
+            log.debug(traceback.format_exc())
+            return None
+
+
+def _substitute_blobs(block: "Block", markup: "Optional[Tuple[str, ...]]") -> "Block":
+    if markup is None:
+        return replace(block, output=f"Error rendering {block.id}", tags=["error"])
+    if not markup:
+        return block
+
+    output = BLOB_PLACEHOLDER_REGEX.sub(
+        lambda match: markup[int(match.group(1))], block.output
+    )
+    return replace(block, output=output)
+
+
 class ViewManager(PluginManager[View]):
 
     namespace = "kpireport.view"
@@ -164,6 +295,7 @@ class ViewManager(PluginManager[View]):
 
     def __init__(self, datasource_manager, report, config, extension_manager=None):
         self.datasource_manager = datasource_manager
+        self.blob_store = BlobStore()
         super(ViewManager, self).__init__(report, config, extension_manager)
 
     def plugin_factory(self, config, plugin_class, plugin_kwargs) -> "View":
@@ -172,15 +304,78 @@ class ViewManager(PluginManager[View]):
             if value:
                 plugin_kwargs.setdefault(attr, value)
 
-        return plugin_class(self.report, self.datasource_manager, **plugin_kwargs)
+        return plugin_class(
+            self.report,
+            self.datasource_manager,
+            blob_store=self.blob_store,
+            **plugin_kwargs,
+        )
+
+    def prefetch(self, max_workers: "Optional[int]" = None):
+        """Prefetch the data for all Views concurrently.
+
+        Each View's :meth:`View.prefetch` is run in a thread pool. Views
+        querying the same Datasource are scheduled such that no more than the
+        Datasource's ``max_concurrency`` occupy a worker at once, so that a
+        single slow Datasource cannot take up every worker.
+
+        Errors are only logged; they will surface again when the View is rendered.
+
+        Args:
+            max_workers (Optional[int]): the size of the thread pool. Defaults to
+                the :class:`~concurrent.futures.ThreadPoolExecutor` default.
+        """
+        queues = defaultdict(deque)
+        for id, view in self.instances:
+            queues[getattr(view, "datasource", None)].append((id, view))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+
+            def submit(datasource):
+                id, view = queues[datasource].popleft()
+                pending[pool.submit(view.prefetch)] = (id, datasource)
+
+            for datasource, queue in queues.items():
+                if datasource is None:
+                    limit = len(queue)
+                else:
+                    limit = self.datasource_manager.max_concurrency(datasource)
+                for _ in range(min(limit, len(queue))):
+                    submit(datasource)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    id, datasource = pending.pop(future)
+                    exc = future.exception()
+                    if exc:
+                        self.log.warning(
+                            f"Error prefetching {self.type_noun} {id}: {exc}"
+                        )
+                    if queues[datasource]:
+                        submit(datasource)
 
     def render(
         self, env: Environment, fmt: str, output_driver: OutputDriver
     ) -> "List[Block]":
-        if not output_driver.can_render(fmt):
-            return []
-
-        blocks = []
+        """Render all Views for a single format and output driver.
+
+        When rendering for multiple output drivers, use a shared
+        :class:`RenderPlan` instead, so Views are not rendered again for each
+        output driver.
+        """
+        return RenderPlan(self, env).render(fmt, output_driver)
+
+    def render_unresolved(
+        self, env: Environment, fmt: str
+    ) -> "List[Tuple[Block, List[Blob]]]":
+        """Render all Views for a format, independent of any output driver.
+
+        Any blobs rendered inline are left as placeholders in the Block output;
+        the list of blobs rendered inline is returned alongside each Block.
+        """
+        rendered = []
         for id, view in self.instances:
             block = Block(
                 id=id,
@@ -191,9 +386,10 @@ class ViewManager(PluginManager[View]):
                 output=None,
                 tags=[],
             )
+            recorder = InlineBlobRecorder()
 
             try:
-                output = view.render(make_render_env(env, view, output_driver, fmt))
+                output = view.render(make_render_env(env, view, recorder, fmt))
                 if not isinstance(output, str):
                     raise ViewException(("The view did not render a valid string"))
 
@@ -205,10 +401,11 @@ class ViewManager(PluginManager[View]):
                 self.log.debug(traceback.format_exc())
                 block.output = f"Error rendering {id}"
                 block.tags = ["error"]
+                recorder.blobs = []
 
-            blocks.append(block)
+            rendered.append((block, recorder.blobs))
 
-        return blocks
+        return rendered
 
     @property
     def blobs(self) -> "List[Blob]":
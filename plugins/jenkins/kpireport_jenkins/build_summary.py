@@ -1,8 +1,13 @@
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import re
 
+from kpireport.utils import cached_method
 from kpireport.view import View
 
+# Build columns of the job list are prefixed, e.g., "build.number".
+BUILD_PREFIX = "build."
+BUILD_PREFIX_LEN = len(BUILD_PREFIX)
+
 
 class JenkinsBuildFilter:
     """Filters a list of Jenkins jobs/builds by a general criteria
@@ -54,6 +59,19 @@ class JenkinsBuildFilter:
 
         return allow
 
+    def filter_jobs(self, jobs):
+        """Filters a table of jobs by the current filters
+
+        :type jobs: pandas.DataFrame
+        :param jobs: the Jenkins jobs, as returned by
+                     :meth:`~kpireport_jenkins.JenkinsDatasource.get_all_jobs`
+        :rtype: pandas.DataFrame
+        :returns: the jobs that pass the filters
+        """
+        if jobs.empty:
+            return jobs
+        return jobs[jobs.apply(self.filter_job, axis=1).astype(bool)]
+
 
 class JenkinsBuildSummary(View):
     """Display a list of jobs with their latest build statuses, and health.
@@ -66,23 +84,42 @@ class JenkinsBuildSummary(View):
     :param filters: optional filters to limit which jobs are rendered in
                     the view. These filters are directly passed to
                     :class:`JenkinsBuildFilter`.
+    :type bulk: bool
+    :param bulk: whether to fetch the builds of all jobs with a single request
+                 (see :meth:`~kpireport_jenkins.JenkinsDatasource.get_all_builds`.)
+                 This is much faster on servers with many jobs, though only
+                 summary information about each build is available.
+                 (default ``False``)
+    :type folder: str
+    :param folder: the folder to list jobs in, if ``bulk`` is enabled
+                   (default all jobs on the server)
+
+    Otherwise, builds for each job are fetched in parallel, up to the
+    Datasource's ``max_concurrency`` setting at a time.
     """
 
-    def init(self, datasource="jenkins", filters={}):
+    def init(self, datasource="jenkins", filters={}, bulk=False, folder=None):
         self.datasource = datasource
         self.filters = JenkinsBuildFilter(**filters)
+        self.bulk = bulk
+        self.folder = folder
 
-    @lru_cache(maxsize=1)
+    @cached_method
     def _template_vars(self):
+        if self.bulk:
+            return self._template_vars_bulk()
+
         jobs = self.datasources.query(self.datasource, "get_all_jobs")
+        # Filter before fetching builds, so that only the jobs of interest are
+        # requested.
+        jobs = self.filters.filter_jobs(jobs)
+        job_names = jobs["fullname"].tolist() if not jobs.empty else []
+        job_urls = jobs["url"].tolist() if not jobs.empty else []
 
         summary = []
-        for _, row in jobs.iterrows():
-            if not self.filters.filter_job(row):
-                continue
-            job_name = row["fullname"]
-            job_url = row["url"]
-            builds = self.datasources.query(self.datasource, "get_job_info", job_name)
+        for job_name, job_url, builds in zip(
+            job_names, job_urls, self._fetch_job_infos(job_names)
+        ):
             score = builds["score"].iloc[0]
             # Reverse order of builds, Jenkins returns most recent ones first
             build_list = builds.iloc[::-1].T.to_dict().values()
@@ -97,6 +134,45 @@ class JenkinsBuildSummary(View):
 
         return dict(summary=summary, theme=self.report.theme)
 
+    def _template_vars_bulk(self):
+        builds = self.datasources.query(
+            self.datasource, "get_all_builds", folder=self.folder
+        )
+        builds = self.filters.filter_jobs(builds)
+
+        summary = []
+        for (job_name, job_url), job_builds in builds.groupby(
+            ["fullname", "url"], sort=False
+        ):
+            build_list = (
+                job_builds.dropna(subset=[f"{BUILD_PREFIX}number"])
+                .filter(like=BUILD_PREFIX)
+                .rename(columns=lambda col: col[BUILD_PREFIX_LEN:])
+            )
+            summary.append(
+                dict(
+                    name=job_name,
+                    url=job_url,
+                    score=job_builds["score"].iloc[0],
+                    # Reverse order of builds, Jenkins returns most recent first
+                    builds=build_list.iloc[::-1].to_dict("records"),
+                )
+            )
+
+        return dict(summary=summary, theme=self.report.theme)
+
+    def _fetch_job_infos(self, job_names):
+        max_workers = self.datasources.max_concurrency(self.datasource)
+
+        def _get_job_info(job_name):
+            return self.datasources.query(self.datasource, "get_job_info", job_name)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_get_job_info, job_names))
+
+    def prefetch(self):
+        self._template_vars()
+
     def _render(self, j2, fmt):
         template = j2.get_template(f"jenkins_build_summary.{fmt}")
         return template.render(**self._template_vars())
@@ -1,11 +1,24 @@
 import logging
+import time
 
 import jenkins
 import pandas as pd
+import requests
 from kpireport.datasource import Datasource
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_FOLDER_DEPTH = 10
+NUM_BUILDS = 10
+
+JOB_TREE = (
+    "fullName,url,healthReport[score],"
+    f"builds[number,url,fullDisplayName,result,timestamp,duration]{{0,{NUM_BUILDS}}}"
+)
+BUILD_COLUMNS = ["number", "url", "fullDisplayName", "result", "timestamp", "duration"]
+
 
 class JenkinsDatasource(Datasource):
     """Provides accessors for listing all jobs and builds from a Jenkins host.
@@ -19,15 +32,29 @@ class JenkinsDatasource(Datasource):
         host (str): Jenkins host, e.g. https://jenkins.example.com.
         user (str): Jenkins user to authenticate as.
         api_token (str): Jenkins user API token to authenticate with.
+        retries (int): how many times to retry a request that failed due to a
+            connection error or timeout. (Default ``3``)
+        retry_backoff (float): how long to wait before the first retry, in
+            seconds. The wait doubles on each subsequent retry.
+            (Default ``0.5``)
     """
 
-    def init(self, host=None, user=None, api_token=None):
+    def init(
+        self,
+        host=None,
+        user=None,
+        api_token=None,
+        retries=DEFAULT_RETRIES,
+        retry_backoff=DEFAULT_RETRY_BACKOFF,
+    ):
         if not host:
             raise ValueError("Missing required paramter: 'host'")
         if not host.startswith("http"):
             host = f"http://{host}"
 
         self.client = jenkins.Jenkins(host, username=user, password=api_token)
+        self.retries = int(retries)
+        self.retry_backoff = float(retry_backoff)
 
     def query(self, fn_name, *args, **kwargs):
         """Query the Datsource for job or build data.
@@ -41,6 +68,8 @@ class JenkinsDatasource(Datasource):
             datasources.query("jenkins", "get_all_jobs")
             # Get detailed information about 'some-job'
             datasources.query("jenkins", "get_job_info", "some-job")
+            # Get the latest builds of all jobs in the 'some-folder' folder
+            datasources.query("jenkins", "get_all_builds", "some-folder")
 
         Args:
             fn_name (str): the RPC operation to invoke.
@@ -63,7 +92,7 @@ class JenkinsDatasource(Datasource):
             :fullname: the full job name (will include folder path components)
             :url: a URL that resolves to the job on the Jenkins server
         """
-        df = pd.DataFrame.from_records(self.client.get_all_jobs())
+        df = pd.DataFrame.from_records(self._call(self.client.get_all_jobs))
         # Filter by jobs that don't have child jobs
         if "jobs" in df.columns:
             return df[df.jobs.isna()]
@@ -81,7 +110,7 @@ class JenkinsDatasource(Datasource):
 
             :status: the build status, e.g. "SUCCESS" or "FAILURE"
         """
-        job_info = self.client.get_job_info(job_name, depth=1)
+        job_info = self._call(self.client.get_job_info, job_name, depth=1)
         builds = job_info.get("builds", [])[:10]
         df = pd.json_normalize(builds)
         # Transpose the health report information into our result table--
@@ -89,3 +118,89 @@ class JenkinsDatasource(Datasource):
         # and this avoids having to create another RPC method just for this.
         health_report = next(iter(job_info.get("healthReport", [])), {})
         return df.assign(**health_report)
+
+    def get_all_builds(self, folder=None, folder_depth=DEFAULT_FOLDER_DEPTH):
+        """List the latest builds of all jobs, using a single request.
+
+        Only the fields needed to summarize each job are requested, via the
+        Jenkins API's ``tree`` filter, so this is much cheaper than calling
+        :meth:`get_job_info` for each job.
+
+        Args:
+            folder (str): the full name of the folder to list jobs in. (Default
+                all jobs on the server)
+            folder_depth (int): how many levels of nested folders to include.
+                (Default ``10``)
+
+        Returns:
+            pandas.DataFrame: a DataFrame with one row for each of the latest
+            10 builds of each job, with columns:
+
+            :fullname: the full job name (will include folder path components)
+            :url: a URL that resolves to the job on the Jenkins server
+            :score: the job's health score
+            :build.number: the build number
+            :build.url: a URL that resolves to the build on the Jenkins server
+            :build.fullDisplayName: the display name of the build
+            :build.result: the build status, e.g. "SUCCESS" or "FAILURE"
+            :build.timestamp: when the build started
+            :build.duration: how long the build took, in milliseconds
+
+            Jobs without any builds have a single row, with empty ``build.*``
+            columns.
+        """
+        tree = "jobs"
+        for _ in range(folder_depth + 1):
+            tree = f"jobs[{JOB_TREE},{tree}]"
+        item = "/".join(f"job/{name}" for name in folder.split("/")) if folder else ""
+        info = self._call(self.client.get_info, item=item, query=f"?tree={tree}")
+
+        records = []
+        for job in _walk_jobs(info.get("jobs", [])):
+            health_report = next(iter(job.get("healthReport", [])), {})
+            job_record = dict(
+                fullname=job.get("fullName"),
+                url=job.get("url"),
+                score=health_report.get("score"),
+            )
+            builds = job.get("builds") or [{}]
+            for build in builds[:NUM_BUILDS]:
+                records.append(
+                    dict(
+                        job_record,
+                        **{f"build.{col}": build.get(col) for col in BUILD_COLUMNS},
+                    )
+                )
+
+        df = pd.DataFrame.from_records(
+            records,
+            columns=["fullname", "url", "score"]
+            + [f"build.{col}" for col in BUILD_COLUMNS],
+        )
+        # Jobs without builds have no timestamp
+        timestamps = df["build.timestamp"].astype("Int64")
+        df["build.timestamp"] = pd.to_datetime(timestamps, unit="ms")
+        return df
+
+    def _call(self, fn, *args, **kwargs):
+        """Call a Jenkins client function, retrying transient failures."""
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except (requests.RequestException, jenkins.TimeoutException) as exc:
+                if attempt == self.retries:
+                    raise
+                backoff = self.retry_backoff * 2**attempt
+                LOG.warning(
+                    f"Jenkins request failed, retrying in {backoff:.1f}s: {exc}"
+                )
+                time.sleep(backoff)
+
+
+def _walk_jobs(jobs):
+    """Yield all jobs that are not folders, depth-first."""
+    for job in jobs:
+        if "jobs" in job:
+            yield from _walk_jobs(job["jobs"])
+        elif "fullName" in job:
+            yield job
@@ -1,4 +1,6 @@
 import os
+import threading
+from unittest import mock
 from unittest.mock import Mock
 
 import pandas as pd
@@ -6,7 +8,10 @@ import pytest
 from kpireport.datasource import DatasourceManager
 from kpireport.report import Report
 from kpireport.tests.fixtures import FakeOutputDriver
-from kpireport.tests.utils import make_datasource_manager
+from kpireport.tests.utils import (
+    make_datasource_manager,
+    make_fake_extension_manager,
+)
 from kpireport.view import make_render_env
 from kpireport_jenkins import JenkinsBuildSummary
 
@@ -66,3 +71,67 @@ def test_render(report: "Report", ds_mgr: "DatasourceManager", jinja_env, fmt: s
     view = JenkinsBuildSummary(report, ds_mgr)
     j2 = make_render_env(jinja_env, view, FakeOutputDriver(report), fmt)
     _assert_matches_fixture(view.render(j2), f"expected_build_summary.{fmt}")
+
+
+def test_filter_before_fetch(report: "Report", ds_mgr: "DatasourceManager"):
+    view = JenkinsBuildSummary(report, ds_mgr, filters={"name": "^job2"})
+    summary = view._template_vars()["summary"]
+    assert [job["name"] for job in summary] == ["job2/main"]
+    query = ds_mgr.get_instance("jenkins").query
+    assert mock.call("get_job_info", "job1/main") not in query.call_args_list
+
+
+def test_fetch_concurrently(report: "Report"):
+    num_jobs = 8
+    barrier = threading.Barrier(4, timeout=5)
+
+    def _query(query_fn, *args, **kwargs):
+        if query_fn == "get_all_jobs":
+            return pd.DataFrame(
+                [{"fullname": f"job{i}", "url": f"url{i}"} for i in range(num_jobs)]
+            )
+        # Only returns once 4 jobs are being fetched at the same time
+        barrier.wait()
+        return pd.DataFrame([{"result": "SUCCESS", "score": 100}])
+
+    plugins = [("jenkins_plugin", Mock(**{"return_value.query.side_effect": _query}))]
+    ds_mgr = DatasourceManager(
+        Mock(),
+        {"jenkins": {"plugin": "jenkins_plugin", "max_concurrency": 4}},
+        extension_manager=make_fake_extension_manager(plugins),
+    )
+    view = JenkinsBuildSummary(report, ds_mgr)
+    summary = view._template_vars()["summary"]
+    assert [job["name"] for job in summary] == [f"job{i}" for i in range(num_jobs)]
+
+
+@pytest.mark.parametrize("fmt", ["md", "slack"])
+def test_render_bulk(report: "Report", jinja_env, fmt: str):
+    records = [
+        {
+            "fullname": job["fullname"],
+            "url": job["url"],
+            "score": build["score"],
+            "build.number": i,
+            "build.url": f"{job['url']}/{i}",
+            "build.result": build["result"],
+        }
+        for job in FAKE_JOBS
+        for i, build in enumerate(FAKE_JOB_INFOS[job["fullname"]])
+    ]
+    records.append({"fullname": "job3/main", "url": "url", "score": 0})
+    ds_mgr = make_datasource_manager({"jenkins": Mock()})
+    ds_mgr.get_instance("jenkins").query.return_value = pd.DataFrame(records)
+    view = JenkinsBuildSummary(
+        report, ds_mgr, bulk=True, folder="folder", filters={"name": "^job[12]"}
+    )
+    j2 = make_render_env(jinja_env, view, FakeOutputDriver(report), fmt)
+    _assert_matches_fixture(view.render(j2), f"expected_build_summary.{fmt}")
+    ds_mgr.get_instance("jenkins").query.assert_called_once_with(
+        "get_all_builds", folder="folder"
+    )
+    builds = view._template_vars()["summary"][0]["builds"]
+    assert [build["url"] for build in builds] == [
+        "https://jenkins.example.com/job1/main/1",
+        "https://jenkins.example.com/job1/main/0",
+    ]
@@ -1,6 +1,9 @@
 from unittest import mock
 
+import jenkins
+import pandas as pd
 import pytest
+import requests
 from kpireport.report import Report
 from kpireport_jenkins import JenkinsDatasource
 
@@ -78,3 +81,81 @@ def test_get_job_info(report: "Report", mocker: "mock"):
     assert list(df.columns) == ["id", "url", "result", "score"]
     # Check that the healthReport.score value is in all rows
     assert all(x == 100 for x in df.score)
+
+
+def test_retry(report: "Report", mocker: "mock"):
+    sleep = mocker.patch("time.sleep")
+    ds = JenkinsDatasource(report, host="http://localhost", retry_backoff=1)
+    client = mocker.patch.object(ds, "client")
+    client.get_job_info.side_effect = [
+        requests.ConnectionError(),
+        jenkins.TimeoutException(),
+        JOB_INFO_RESPONSE,
+    ]
+    df = ds.query("get_job_info", "v2-app")
+    assert df.shape == (4, 4)
+    assert sleep.call_args_list == [mock.call(1), mock.call(2)]
+
+
+def test_retry_exhausted(report: "Report", mocker: "mock"):
+    mocker.patch("time.sleep")
+    ds = JenkinsDatasource(report, host="http://localhost", retries=2)
+    client = mocker.patch.object(ds, "client")
+    client.get_job_info.side_effect = requests.ConnectionError()
+    with pytest.raises(requests.ConnectionError):
+        ds.query("get_job_info", "v2-app")
+    assert client.get_job_info.call_count == 3
+
+
+def test_no_retry_not_found(report: "Report", mocker: "mock"):
+    ds = JenkinsDatasource(report, host="http://localhost")
+    client = mocker.patch.object(ds, "client")
+    client.get_job_info.side_effect = jenkins.NotFoundException()
+    with pytest.raises(jenkins.NotFoundException):
+        ds.query("get_job_info", "v2-app")
+    assert client.get_job_info.call_count == 1
+
+
+def test_get_all_builds(report: "Report", mocker: "mock"):
+    ds = JenkinsDatasource(report, host="http://localhost")
+    client = mocker.patch.object(ds, "client")
+    client.get_info.return_value = {
+        "jobs": [
+            {
+                "fullName": "folder/v2-app",
+                "jobs": [
+                    {
+                        "fullName": "folder/v2-app/master",
+                        "url": "https://jenkins.example.com/job/v2-app/job/master",
+                        "healthReport": [{"score": 100}],
+                        "builds": [
+                            {"number": 57, "result": "SUCCESS", "timestamp": 0},
+                            {"number": 56, "result": "FAILURE", "timestamp": 0},
+                        ],
+                    },
+                    {
+                        "fullName": "folder/v2-app/devel",
+                        "url": "https://jenkins.example.com/job/v2-app/job/devel",
+                        "healthReport": [],
+                        "builds": [],
+                    },
+                ],
+            },
+            # Beyond the requested folder depth
+            {"_class": "hudson.model.FreeStyleProject"},
+        ]
+    }
+    df = ds.query("get_all_builds", folder="folder", folder_depth=1)
+
+    _, kwargs = client.get_info.call_args
+    assert kwargs["item"] == "job/folder"
+    assert kwargs["query"].startswith(
+        "?tree=jobs[fullName,url,healthReport[score],builds[number,url,"
+        "fullDisplayName,result,timestamp,duration]{0,10},jobs["
+    )
+    assert list(df["fullname"]) == ["folder/v2-app/master"] * 2 + [
+        "folder/v2-app/devel"
+    ]
+    assert list(df["build.number"][:2]) == [57, 56]
+    assert df["build.number"].isna().tolist() == [False, False, True]
+    assert df["build.timestamp"][0] == pd.Timestamp(0)
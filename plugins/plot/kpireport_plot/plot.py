@@ -1,10 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
 from cycler import cycler
 from functools import lru_cache
 import io
+import matplotlib
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import multiprocessing
+import numpy as np
 import pandas as pd
+from PIL import Image
+import threading
 
+from kpireport.utils import cached_method
 from kpireport.view import View
 
 import logging
@@ -14,10 +21,222 @@ LOG = logging.getLogger(__name__)
 DATE_FORMAT = "%b %-d\n(%a)"
 FIGURE_PPI = 72  # Default PPI in matplotlib, not customizable
 DEFAULT_FONT_SIZE = 10
+IMAGE_MIME_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+}
+
+try:
+    QUANTIZE_METHOD = Image.Quantize.FASTOCTREE
+    QUANTIZE_DITHER = Image.Dither.NONE
+except AttributeError:
+    # Pillow < 9.1
+    QUANTIZE_METHOD = Image.FASTOCTREE
+    QUANTIZE_DITHER = Image.NONE
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Get the process pool shared by all Plots rendering in a separate process.
+
+    Processes are spawned rather than forked, as the pool is typically created
+    while other threads are running (see :meth:`kpireport.view.ViewManager.prefetch`.)
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def _lttb(x, y, n):
+    """Select ``n`` points of a series with the Largest-Triangle-Three-Buckets
+    algorithm.
+
+    The first and last points are always kept. The points in between are split
+    into ``n - 2`` buckets of equal size, and from each bucket the point
+    forming the largest triangle with the point selected from the previous
+    bucket and the average of the next bucket is kept. Each bucket depends on
+    the selection from the previous one, so buckets are visited in order, but
+    all points in a bucket are compared at once.
+
+    Args:
+        x (numpy.ndarray): the x values, in ascending order.
+        y (numpy.ndarray): the y values.
+        n (int): the number of points to select.
+
+    Returns:
+        numpy.ndarray: the positions of the selected points, in ascending order.
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    # Bucket i spans positions edges[i] (inclusive) to edges[i + 1] (exclusive);
+    # as n < size, every bucket has at least one point.
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    # The third point of each triangle is the average of the next bucket, or the
+    # last point for the last bucket.
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the area; only the relative size matters.
+        areas = np.abs(
+            (x[a] - next_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (next_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def _minmax(x, y, n):
+    """Select up to ``n`` points of a series by keeping the minimum and maximum
+    points of each of ``(n - 2) / 2`` buckets of equal width along the x axis.
+
+    Unlike :func:`_lttb`, this keeps every peak and trough of the series, at
+    the cost of a less faithful shape between them. The first and last points
+    are also kept, so the series spans the same range.
+
+    Args:
+        x (numpy.ndarray): the x values, in ascending order.
+        y (numpy.ndarray): the y values.
+        n (int): the maximum number of points to select.
+
+    Returns:
+        numpy.ndarray: the positions of the selected points, in ascending order.
+    """
+    size = len(x)
+    span = x[-1] - x[0] if size else 0
+    if n >= size or span <= 0:
+        return np.arange(size)
+
+    num_buckets = (n - 2) // 2
+    if num_buckets < 1:
+        return np.array([0, size - 1])
+    buckets = np.minimum(
+        ((x - x[0]) / span * num_buckets).astype(np.int64), num_buckets - 1
+    )
+    # Order by bucket, then by value; the first and last point of each bucket
+    # are then its minimum and maximum.
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    ends = np.r_[starts[1:], size] - 1
+    return np.union1d(np.r_[order[starts], order[ends]], [0, size - 1])
+
+
+DOWNSAMPLE_METHODS = {"lttb": _lttb, "minmax": _minmax}
+
+
+def _numeric_index(index):
+    """Get the x values of an index as floats, for downsampling."""
+    if isinstance(index, pd.DatetimeIndex):
+        return index.asi8.astype(np.float64)
+    if pd.api.types.is_numeric_dtype(index):
+        return index.to_numpy(dtype=np.float64)
+    # Categorical indexes (e.g., strings) are evenly spaced.
+    return np.arange(len(index), dtype=np.float64)
+
+
+def _localize(index, timezone):
+    """Convert the times of an index to a timezone; naive times are in UTC.
+
+    matplotlib shows times in the timezone of the plotted data. The timezone is
+    not set via the "timezone" rc parameter, which only accepts timezone names,
+    while the report timezone is a :class:`datetime.tzinfo`.
+    """
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return index.tz_convert(timezone)
+
+
+@lru_cache(maxsize=None)
+def _default_rc(text_color, axis_color, plot_colors):
+    """Get the default :class:`matplotlib.RcParams` for a theme.
+
+    These are shared by all Plots with the same theme, so must not be modified.
+    """
+    return {
+        "lines.linewidth": 3,
+        "text.color": text_color,
+        "font.size": DEFAULT_FONT_SIZE,
+        "axes.edgecolor": axis_color,
+        "axes.titlecolor": text_color,
+        "axes.labelcolor": text_color,
+        "axes.prop_cycle": cycler(color=list(plot_colors)),
+        "axes.spines.top": False,
+        "axes.spines.right": False,
+        "xtick.labelsize": DEFAULT_FONT_SIZE,
+        "xtick.color": text_color,
+        "xtick.direction": "in",
+        "ytick.labelsize": DEFAULT_FONT_SIZE,
+        "ytick.color": text_color,
+        "ytick.direction": "in",
+        "legend.loc": "lower left",
+        "legend.frameon": False,
+        "legend.fancybox": False,
+        "legend.borderpad": 0,
+        "date.autoformatter.day": DATE_FORMAT,
+        "figure.dpi": FIGURE_PPI * 2,
+        "savefig.bbox": "tight",
+        "savefig.pad_inches": 10 / FIGURE_PPI,
+    }
+
+
+def _encode_figure(fig, image_format, options):
+    """Save a figure as an image.
+
+    Args:
+        fig (matplotlib.figure.Figure): the figure.
+        image_format (str): the image format, one of :data:`IMAGE_MIME_TYPES`.
+        options (dict): options for encoding raster images, which are passed to
+            Pillow, except for ``colors``, which is the number of colors to
+            reduce the image to, if given. Ignored for SVG images.
+
+    Returns:
+        bytes: the image.
+    """
+    figbytes = io.BytesIO()
+    if image_format == "svg":
+        fig.savefig(figbytes, format="svg")
+        return figbytes.getvalue()
+
+    options = dict(options)
+    colors = options.pop("colors", None)
+    if image_format == "png" and not colors:
+        fig.savefig(figbytes, format="png", pil_kwargs=options)
+        return figbytes.getvalue()
+
+    # Otherwise, encode the image with Pillow from the (uncompressed) pixels
+    # matplotlib would output.
+    pixels = io.BytesIO()
+    fig.savefig(pixels, format="png", pil_kwargs=dict(compress_level=0))
+    with Image.open(pixels) as im:
+        if colors:
+            # Dithering would add noise to the solid areas and lines of a plot.
+            im = im.quantize(
+                colors=int(colors), method=QUANTIZE_METHOD, dither=QUANTIZE_DITHER
+            )
+        im.save(figbytes, format=image_format.upper(), **options)
+    return figbytes.getvalue()
 
 
 class Plot(View):
-    """Render a graph as a PNG file inline.
+    """Render a graph as an image inline.
 
     The :mod:`matplotlib` module handles rendering the plot. The Plot view
     sets a few default styles that make sense for plotting timeseries data,
@@ -96,6 +315,45 @@ class Plot(View):
         plot_rc (dict): properties to set as :class:`matplotlib.RcParams`. This
             can be used to customize the display of the output chart beyond
             the defaults provided by the Theme.
+        process_pool (bool): whether to render the figure in a separate process.
+            Figures are otherwise rendered one at a time, as matplotlib's global
+            state prevents rendering them concurrently in threads. When enabled,
+            the figures of all Plots using this option are rendered in parallel
+            in a shared process pool, while the report data is being fetched.
+            The Plot (including any :meth:`post_plot` hook) must be picklable.
+            (Default ``False``)
+        incremental (bool): whether to fetch the query result incrementally,
+            if the query cache is enabled and the Datasource supports it (see
+            :class:`~kpireport.datasource.DatasourceManager`): the part of the
+            report window already fetched by a previous report is reused, and
+            only the rest is queried. Only enable this for time series, where
+            each row describes a single point in time. This has no effect if
+            the Datasource is asked to downsample the result. (Default ``False``)
+        downsample (str): reduce the number of points drawn for each series to
+            about the plot's width in pixels, which makes rendering much faster
+            for large results, with little visible difference.
+            Either "lttb", to keep the points that best preserve the shape of
+            the series (`Largest-Triangle-Three-Buckets
+            <https://skemman.is/handle/1946/15343>`_), or "minmax", to keep the
+            minimum and maximum of each pixel-wide bucket, which guarantees all
+            peaks are shown. Missing values are skipped. Only line and scatter
+            plots are downsampled; stacked line plots are downsampled according
+            to the total of all series. Datasources supporting the
+            ``target_points`` hint (e.g., Prometheus) are also asked for data at
+            about this resolution. (Default ``None``, no downsampling)
+        image_format (str): the format of the figure image, either "png",
+            "webp" or "svg". WebP images are typically much smaller, but are not
+            supported by all email clients. SVG images are only suitable for
+            the static output driver. (Default from the Theme, "png")
+        image_options (dict): options for encoding PNG and WebP images. These
+            are passed to `Pillow
+            <https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html>`_,
+            e.g., ``compress_level`` (0-9) for PNG, or ``quality`` (0-100) and
+            ``lossless`` for WebP. Additionally, ``colors`` reduces the image
+            to a palette of at most that many colors, which greatly reduces the
+            size of PNG images; plots only use a handful of colors, though some
+            more are needed for smooth edges. Options are merged over those of
+            the Theme. (Default ``{}``)
     """
 
     def init(
@@ -113,6 +371,11 @@ class Plot(View):
         bar_labels=False,
         xtick_rotation=0,
         plot_rc={},
+        process_pool=False,
+        incremental=False,
+        downsample=None,
+        image_format=None,
+        image_options=None,
     ):
         self.datasource = datasource
         self.query = query
@@ -127,47 +390,38 @@ class Plot(View):
         self.xtick_rotation = xtick_rotation
         self.legend = legend
         self.plot_rc = plot_rc
+        self.process_pool = process_pool
+        self.incremental = incremental
+        self.downsample = downsample
 
         theme = self.report.theme
         self.text_color = theme.text_color
         self.axis_color = theme.text_offset()
         self.plot_colors = theme.series_colors
+        self.image_format = (image_format or theme.image_format).lower()
+        self.image_options = {**theme.image_options, **(image_options or {})}
 
         if not (self.datasource and self.query):
             raise ValueError(("Both a 'datasource' and 'query' parameter are required"))
+        if self.downsample and self.downsample not in DOWNSAMPLE_METHODS:
+            raise ValueError(
+                f"Unsupported downsample method '{self.downsample}', must be one of "
+                f"{list(DOWNSAMPLE_METHODS)}"
+            )
+        if self.image_format not in IMAGE_MIME_TYPES:
+            raise ValueError(
+                f"Unsupported image format '{self.image_format}', must be one of "
+                f"{list(IMAGE_MIME_TYPES)}"
+            )
 
     @property
     def matplotlib_rc(self):
-        rc_params = self.plot_rc.copy()
-        rc_defaults = {
-            "lines.linewidth": 3,
-            "text.color": self.text_color,
-            "font.size": DEFAULT_FONT_SIZE,
-            "axes.edgecolor": self.axis_color,
-            "axes.titlecolor": self.text_color,
-            "axes.labelcolor": self.text_color,
-            "axes.prop_cycle": cycler(color=self.plot_colors),
-            "axes.spines.top": False,
-            "axes.spines.right": False,
-            "xtick.labelsize": DEFAULT_FONT_SIZE,
-            "xtick.color": self.text_color,
-            "xtick.direction": "in",
-            "ytick.labelsize": DEFAULT_FONT_SIZE,
-            "ytick.color": self.text_color,
-            "ytick.direction": "in",
-            "legend.loc": "lower left",
-            "legend.frameon": False,
-            "legend.fancybox": False,
-            "legend.borderpad": 0,
-            "date.autoformatter.day": DATE_FORMAT,
-            "figure.dpi": FIGURE_PPI * 2,
-            "savefig.bbox": "tight",
-            "savefig.pad_inches": 10 / FIGURE_PPI,
-            "timezone": self.report.timezone,
-        }
-        for k, v in rc_defaults.items():
-            rc_params.setdefault(k, v)
-        return rc_params
+        rc_defaults = _default_rc(
+            self.text_color,
+            self.axis_color,
+            tuple(self.plot_colors),
+        )
+        return {**rc_defaults, **self.plot_rc}
 
     def _make_plot(self, ax, index_data, series_data):
         """Render a bar chart with the current DataFrame."""
@@ -190,17 +444,18 @@ class Plot(View):
 
         if isinstance(index_data, pd.DatetimeIndex):
             ax.xaxis.set_major_formatter(mdates.DateFormatter(DATE_FORMAT))
-            plt.xlim([self.report.start_date, self.report.end_date])
+            ax.set_xlim([self.report.start_date, self.report.end_date])
 
         if self.kind == "line":
             if self.stacked:
                 ax.stackplot(index_data, *[s for s in series_data])
             else:
+                # Each series may have been downsampled to different points.
                 for s in series_data:
-                    ax.plot(index_data, s)
+                    ax.plot(s.index, s)
         elif self.kind == "scatter":
             for s in series_data:
-                ax.plot(index_data, s, "o")
+                ax.plot(s.index, s, "o")
         elif self.kind == "bar":
             # FIXME: currently rendering multiple bar series will just render them
             # all on top of one another, which is not helpful. However, ensuring the
@@ -216,7 +471,7 @@ class Plot(View):
                 if self.stacked:
                     bar_kwargs["bottom"] = bottom
                 with_labels(ax.bar(index_data, s, **bar_kwargs))
-                bottom += s
+                bottom = bottom + s
         else:
             raise ValueError(f"Plot function {self.kind} does not exist")
 
@@ -235,39 +490,82 @@ class Plot(View):
             )
         return df
 
-    @lru_cache(maxsize=1)
-    def render_figure(self):
-        df = self.datasources.query(self.datasource, self.query, **self.query_args)
+    def _query_hints(self):
+        # Only reduce the resolution of the data if asked to downsample; the
+        # full result is plotted otherwise. Other kinds of plots show every row
+        # (e.g., as a bar), and grouped rows would be reduced unevenly across
+        # groups, so they need the full result.
+        if self.downsample and self.kind in ("line", "scatter") and not self.groupby:
+            return dict(target_points=self.cols * self.report.theme.column_width)
+        return None
+
+    def _downsample(self, index_data, series_data):
+        select = DOWNSAMPLE_METHODS[self.downsample]
+        target_points = self.cols * self.report.theme.column_width
+
+        if self.kind == "line" and self.stacked:
+            # Stacked series must share their x values; keep the points that
+            # best represent the top of the stack.
+            total = sum(s.to_numpy(dtype=np.float64) for s in series_data)
+            valid = np.flatnonzero(~np.isnan(total))
+            x = _numeric_index(index_data)
+            pos = valid[select(x[valid], total[valid], target_points)]
+            return index_data[pos], [s.iloc[pos] for s in series_data]
+
+        downsampled = []
+        for s in series_data:
+            s = s.dropna()
+            y = s.to_numpy(dtype=np.float64)
+            downsampled.append(
+                s.iloc[select(_numeric_index(s.index), y, target_points)]
+            )
+        return index_data, downsampled
+
+    def _pivot_groups(self, df, index_data):
+        # The grouping column is redundant in each series (all rows in a group
+        # have the same value.)
+        values_df = self._prune_nonnumeric_columns(df.drop(self.groupby, axis=1))
+        if not len(values_df.columns):
+            return [], []
+        if len(values_df.columns) > 1:
+            LOG.warn(
+                (
+                    "After grouping data, there are still multiple columns. "
+                    f"Taking just the first column '{values_df.columns[0]}'."
+                )
+            )
+        values = values_df[values_df.columns[0]]
+        keys = df[self.groupby]
+        # Rows without a group are not part of any series.
+        has_group = keys.notna().to_numpy()
+        values = values[has_group]
+        values.index = pd.MultiIndex.from_arrays([values.index, keys[has_group]])
+        # Align all groups on the full index at once, with one column per group.
+        matrix = values.unstack(fill_value=0).reindex(index_data, fill_value=0)
+        return matrix.columns, [matrix[g] for g in matrix.columns]
+
+    @cached_method
+    def _figure_data(self):
+        df = self.datasources.query(
+            self.datasource,
+            self.query,
+            hints=self._query_hints(),
+            incremental=self.incremental,
+            **self.query_args,
+        )
         if self.time_column in df:
             df = df.set_index(self.time_column)
 
         # Ensure data is sorted along index; if it is not, matplotlib can
         # fail to properly graph it.
         df = df.sort_index()
+        if isinstance(df.index, pd.DatetimeIndex) and self.report.timezone:
+            df.index = _localize(df.index, self.report.timezone)
 
         if self.groupby:
             index_data = df.index.unique()
+            series_labels, series_data = self._pivot_groups(df, index_data)
             df = df.groupby(self.groupby)
-            series_labels = df.groups
-
-            def _flatten_group(group_df):
-                # When extracting a group as a Dataframe, the grouping column is once
-                # again present. Remove it, as it is redundant (all rows will have the
-                # same value)
-                df = group_df.drop(self.groupby, axis=1)
-                df = self._prune_nonnumeric_columns(df)
-                # Ensure all groups are of the same size
-                df = df.reindex(index_data, fill_value=0)
-                if len(df.columns) > 1:
-                    LOG.warn(
-                        (
-                            "After grouping data, there are still multiple columns. "
-                            f"Taking just the first column '{df.columns[0]}'."
-                        )
-                    )
-                return df[df.columns[0]]
-
-            series_data = [_flatten_group(df.get_group(g)) for g in df.groups]
         else:
             index_data = df.index
             pruned_df = self._prune_nonnumeric_columns(df)
@@ -277,13 +575,72 @@ class Plot(View):
         if not series_data:
             raise ValueError("The query returned no plottable results.")
 
+        if self.downsample and self.kind in ("line", "scatter"):
+            index_data, series_data = self._downsample(index_data, series_data)
+
         if self.label_map:
             # Attempt to lookup name mapping from `label_map`
             series_labels = [self.label_map.get(lbl, lbl) for lbl in series_labels]
 
-        with plt.rc_context(self.matplotlib_rc):
+        return df, index_data, series_labels, series_data
+
+    def prefetch(self):
+        if self.process_pool:
+            # Rendering happens outside of this process, so can be done
+            # concurrently with the other Views.
+            self.render_figure()
+        else:
+            self._figure_data()
+
+    def __getstate__(self):
+        # Only the Plot configuration is needed to draw the figure in another
+        # process; the Datasources, blobs and cached results are left behind.
+        return {
+            k: v
+            for k, v in self.__dict__.items()
+            if k not in ("datasources", "blob_store", "_blobs")
+            and not k.startswith("_cached_")
+        }
+
+    @cached_method
+    def render_figure(self):
+        df, index_data, series_labels, series_data = self._figure_data()
+        args = (self.matplotlib_rc, df, index_data, series_labels, series_data)
+
+        if self.process_pool:
+            image = _get_process_pool().submit(self.draw_figure, *args).result()
+        else:
+            image = self.draw_figure(*args)
+
+        figname = f"figure.{self.image_format}"
+        self.add_blob(
+            figname,
+            image,
+            mime_type=IMAGE_MIME_TYPES[self.image_format],
+            title="Figure",
+        )
+        return figname
+
+    def draw_figure(self, rc, df, index_data, series_labels, series_data) -> bytes:
+        """Draw the figure and encode it as an image in the configured format.
+
+        Only the object-oriented matplotlib API is used, so no global figure
+        state is kept between calls, and this can be invoked in another process.
+
+        Args:
+            rc (dict): the :class:`matplotlib.RcParams` to draw with.
+            df (pandas.DataFrame): the queried data.
+            index_data (pandas.Index): the x-axis data.
+            series_labels (List[str]): the label of each series.
+            series_data (List[pandas.Series]): the y-axis data of each series.
+
+        Returns:
+            bytes: the image.
+        """
+        with matplotlib.rc_context(rc):
             figsize = [((self.cols * self.report.theme.column_width) / FIGURE_PPI), 2]
-            fig, ax = plt.subplots(figsize=figsize, constrained_layout=True)
+            fig = Figure(figsize=figsize, constrained_layout=True)
+            ax = fig.subplots()
 
             self._make_plot(ax, index_data, series_data)
 
@@ -296,20 +653,12 @@ class Plot(View):
                 ax.legend(series_labels, **l_kwargs)
 
             ax.set_xlabel("")
-            plt.xticks(rotation=self.xtick_rotation)
-            plt.tick_params(length=0)
+            ax.tick_params(axis="x", labelrotation=self.xtick_rotation)
+            ax.tick_params(length=0)
 
             self.post_plot(ax, df=df, index_data=index_data, series_data=series_data)
 
-            fig = ax.get_figure()
-            figbytes = io.BytesIO()
-            fig.savefig(figbytes)
-            figname = "figure.png"
-            self.add_blob(figname, figbytes, mime_type="image/png", title="Figure")
-
-            plt.close(fig)
-
-            return figname
+            return _encode_figure(fig, self.image_format, self.image_options)
 
     def post_plot(self, ax, df=None, index_data=None, series_data=None):
         """A post-render hook that can be used to process the plot before outputting.
@@ -1,5 +1,4 @@
-from functools import lru_cache
-
+from kpireport.utils import cached_method
 from kpireport.view import View
 
 
@@ -76,7 +75,7 @@ class SingleStat(View):
         if not (self.datasource and self.query):
             raise ValueError(("Both a 'datasource' and 'query' parameter are required"))
 
-    @lru_cache(maxsize=1)
+    @cached_method
     def template_args(self):
         df = self.datasources.query(self.datasource, self.query, **self.query_args)
         stat_value = _summarize(df)
@@ -108,6 +107,9 @@ class SingleStat(View):
             theme=self.report.theme,
         )
 
+    def prefetch(self):
+        self.template_args()
+
     def render_html(self, j2):
         template = j2.get_template("single_stat.html")
         return template.render(**self.template_args())
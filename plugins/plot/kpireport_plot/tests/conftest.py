@@ -0,0 +1 @@
+from kpireport.tests.fixtures import content, jinja_env, report
@@ -0,0 +1,290 @@
+import io
+import pickle
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+from dateutil.tz import gettz, tzlocal
+from kpireport.report import Report
+from kpireport_plot import Plot
+from kpireport_plot.plot import IMAGE_MIME_TYPES, _encode_figure, _lttb, _minmax
+from matplotlib.figure import Figure
+from PIL import Image
+
+
+def make_plot(report, df, **kwargs):
+    datasources = MagicMock()
+    datasources.query.return_value = df
+    return Plot(report, datasources, datasource="fake", query="fake", **kwargs)
+
+
+class AnnotatedPlot(Plot):
+    # Defined at the module level, so it can be rendered in another process.
+    def post_plot(self, ax, df=None, index_data=None, series_data=None):
+        ax.annotate("peak", xy=(index_data[-1], series_data[0].iloc[-1]))
+
+
+def make_df(num_samples=48, **columns):
+    times = pd.date_range("2020-05-01", periods=num_samples, freq="1h")
+    columns.setdefault("value", np.arange(num_samples, dtype=np.float64))
+    return pd.DataFrame({"time": times, **columns})
+
+
+@pytest.mark.parametrize("timezone", [tzlocal(), gettz("America/New_York")])
+def test_render_figure_timezone(timezone):
+    # Reports are created with dateutil timezones, which are not hashable.
+    report = Report(
+        title="Fake report",
+        interval_days=7,
+        start_date=datetime(2020, 5, 1, tzinfo=timezone),
+        end_date=datetime(2020, 5, 7, tzinfo=timezone),
+        timezone=timezone,
+    )
+    plot = make_plot(report, make_df())
+    assert plot.render_figure() == "figure.png"
+    # Times are shown in the report timezone.
+    _, index_data, _, _ = plot._figure_data()
+    assert index_data.tz is timezone
+    assert index_data[0] == pd.Timestamp("2020-05-01", tz="UTC")
+
+
+def test_pickle(report: "Report"):
+    plot = make_plot(report, make_df())
+    plot.render_figure()
+    state = plot.__getstate__()
+    # Only the configuration is sent to the process pool.
+    assert not {"datasources", "blob_store", "_blobs"} & set(state)
+    assert not any(k.startswith("_cached_") for k in state)
+    copy = pickle.loads(pickle.dumps(plot))
+    assert copy.query == plot.query
+    assert copy.image_format == plot.image_format
+
+
+@pytest.mark.parametrize("plot_class", [Plot, AnnotatedPlot])
+def test_render_figure_process_pool(report: "Report", plot_class):
+    def render(**kwargs):
+        datasources = MagicMock()
+        datasources.query.return_value = make_df()
+        plot = plot_class(
+            report, datasources, datasource="fake", query="fake", **kwargs
+        )
+        figname = plot.render_figure()
+        (blob,) = plot.blobs
+        return plot, figname, blob
+
+    plot, figname, blob = render(process_pool=True)
+    _, expected_figname, expected_blob = render()
+    assert figname == expected_figname
+    # The figure is returned to the Plot's own blob store.
+    assert plot.blob_store.get(blob.content.digest) is blob.content
+    assert blob.content.getvalue() == expected_blob.content.getvalue()
+
+
+@pytest.mark.parametrize(
+    "kwargs,hinted",
+    [
+        (dict(), False),
+        (dict(downsample="lttb"), True),
+        (dict(downsample="minmax", kind="scatter"), True),
+        (dict(downsample="lttb", groupby="group"), False),
+        (dict(downsample="lttb", kind="bar"), False),
+    ],
+)
+def test_query_hints(report: "Report", kwargs, hinted):
+    plot = make_plot(report, make_df(), **kwargs)
+    hints = plot._query_hints()
+    if hinted:
+        assert hints == dict(target_points=plot.cols * report.theme.column_width)
+    else:
+        assert not hints
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_query_incremental(report: "Report", incremental):
+    plot = make_plot(report, make_df(), incremental=incremental)
+    plot.render_figure()
+    _, kwargs = plot.datasources.query.call_args
+    assert kwargs["incremental"] is incremental
+
+
+@pytest.mark.parametrize("select", [_lttb, _minmax])
+@pytest.mark.parametrize("n", [3, 10, 100])
+def test_select_keeps_endpoints(select, n):
+    rng = np.random.default_rng(0)
+    x = np.arange(1000, dtype=np.float64)
+    y = rng.random(1000)
+    selected = select(x, y, n)
+    assert selected[0] == 0 and selected[-1] == len(x) - 1
+    assert len(selected) <= n
+    assert np.all(np.diff(selected) > 0)
+
+
+@pytest.mark.parametrize("select", [_lttb, _minmax])
+def test_select_passthrough(select):
+    x = np.arange(10, dtype=np.float64)
+    y = x**2
+    assert list(select(x, y, 10)) == list(range(10))
+    assert list(select(x, y, 50)) == list(range(10))
+
+
+def test_lttb_keeps_spike():
+    y = np.zeros(1000)
+    y[500] = 100
+    assert 500 in _lttb(np.arange(1000, dtype=np.float64), y, 20)
+
+
+def test_minmax_keeps_extremes():
+    rng = np.random.default_rng(0)
+    y = rng.random(1000)
+    y[123], y[877] = 10, -10
+    selected = _minmax(np.arange(1000, dtype=np.float64), y, 20)
+    assert {123, 877} <= set(selected)
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_downsample(report: "Report", method):
+    num_samples = 5000
+    df = make_df(num_samples, other=np.ones(num_samples))
+    df.loc[100:199, "value"] = np.nan
+    plot = make_plot(report, df, downsample=method)
+    _, index_data, _, series_data = plot._figure_data()
+
+    target_points = plot.cols * report.theme.column_width
+    for s in series_data:
+        assert len(s) <= target_points
+        # Missing values are skipped.
+        assert not s.isna().any()
+        assert s.index[0] == index_data[0]
+        assert s.index[-1] == index_data[-1]
+
+
+def test_downsample_stacked(report: "Report"):
+    num_samples = 5000
+    df = make_df(num_samples, other=np.ones(num_samples))
+    df.loc[100:199, "other"] = np.nan
+    plot = make_plot(report, df, downsample="lttb", stacked=True)
+    _, index_data, _, series_data = plot._figure_data()
+
+    # Stacked series share their x values.
+    assert len(index_data) <= plot.cols * report.theme.column_width
+    assert all(s.index.equals(index_data) for s in series_data)
+    # Points where the total is missing are skipped.
+    assert not series_data[1].isna().any()
+
+
+def test_downsample_passthrough(report: "Report"):
+    df = make_df(48)
+    plot = make_plot(report, df, downsample="lttb")
+    _, index_data, _, series_data = plot._figure_data()
+    assert len(index_data) == 48
+    assert list(series_data[0]) == list(df["value"])
+
+
+def test_invalid_downsample(report: "Report"):
+    with pytest.raises(ValueError):
+        make_plot(report, make_df(), downsample="random")
+
+
+def _per_group_reindex(plot, df, index_data):
+    # The implementation _pivot_groups replaced, which aligned each group
+    # separately.
+    grouped = df.groupby(plot.groupby)
+    series_data = []
+    for g in grouped.groups:
+        group_df = grouped.get_group(g).drop(plot.groupby, axis=1)
+        group_df = plot._prune_nonnumeric_columns(group_df)
+        group_df = group_df.reindex(index_data, fill_value=0)
+        series_data.append(group_df[group_df.columns[0]])
+    return list(grouped.groups), series_data
+
+
+def test_pivot_groups(report: "Report"):
+    times = pd.date_range("2020-05-01", periods=24, freq="1h")
+    rng = np.random.default_rng(0)
+    # Groups of uneven sizes, with gaps at different times.
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "time": times[rng.permutation(24)[:size]],
+                    "value": rng.random(size),
+                    "host": f"host{i}",
+                }
+            )
+            for i, size in enumerate([24, 10, 3, 1])
+        ]
+    )
+    df = df.set_index("time").sort_index()
+    plot = make_plot(report, df, groupby="host")
+    index_data = df.index.unique()
+
+    labels, series_data = plot._pivot_groups(df, index_data)
+    expected_labels, expected_data = _per_group_reindex(plot, df, index_data)
+    assert list(labels) == expected_labels
+    assert len(series_data) == len(expected_data)
+    for s, expected in zip(series_data, expected_data):
+        assert s.index.equals(index_data)
+        np.testing.assert_array_equal(s.to_numpy(), expected.to_numpy())
+
+
+def test_pivot_groups_without_group(report: "Report"):
+    df = make_df(4, host=["a", None, "b", "a"]).set_index("time")
+    plot = make_plot(report, df, groupby="host")
+    labels, series_data = plot._pivot_groups(df, df.index.unique())
+    # Rows without a group are not part of any series.
+    assert list(labels) == ["a", "b"]
+    assert list(series_data[0]) == [0, 0, 0, 3]
+    assert list(series_data[1]) == [0, 0, 2, 0]
+
+
+def make_figure():
+    fig = Figure(figsize=(4, 2))
+    ax = fig.subplots()
+    ax.plot(np.arange(10), np.arange(10) ** 2)
+    return fig
+
+
+@pytest.mark.parametrize(
+    "image_format,options,magic",
+    [
+        ("png", {}, b"\x89PNG"),
+        ("png", dict(colors=16), b"\x89PNG"),
+        ("webp", {}, b"RIFF"),
+        ("webp", dict(colors=16, lossless=True), b"RIFF"),
+        ("svg", {}, b"<?xml"),
+    ],
+)
+def test_encode_figure(image_format, options, magic):
+    image = _encode_figure(make_figure(), image_format, options)
+    assert image.startswith(magic)
+    if image_format == "svg":
+        assert b"<svg" in image
+        return
+    with Image.open(io.BytesIO(image)) as im:
+        assert im.format == image_format.upper()
+        assert im.size[0] > 0 and im.size[1] > 0
+        if options.get("colors"):
+            assert len(im.convert("RGBA").getcolors(maxcolors=256)) <= 16
+
+
+def test_encode_figure_options():
+    # Options are passed to the encoder.
+    fast = _encode_figure(make_figure(), "png", dict(compress_level=0))
+    small = _encode_figure(make_figure(), "png", dict(compress_level=9))
+    assert len(small) < len(fast)
+
+
+@pytest.mark.parametrize("image_format", ["png", "webp", "svg"])
+def test_render_figure_image_format(report: "Report", image_format):
+    plot = make_plot(report, make_df(), image_format=image_format)
+    figname = plot.render_figure()
+    assert figname == f"figure.{image_format}"
+    (blob,) = plot.blobs
+    assert blob.mime_type == IMAGE_MIME_TYPES[image_format]
+
+
+def test_invalid_image_format(report: "Report"):
+    with pytest.raises(ValueError):
+        make_plot(report, make_df(), image_format="gif")
@@ -8,7 +8,7 @@ setup(
     url="https://kpireporter.com",
     license="Prosperity Public License",
     packages=["kpireport_plot"],
-    install_requires=["kpireport", "matplotlib~=3.4"],
+    install_requires=["kpireport", "matplotlib~=3.4", "Pillow"],
     package_data={"kpireport_plot": ["templates/*"]},
     entry_points={
         "kpireport.view": [
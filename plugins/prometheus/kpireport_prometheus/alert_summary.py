@@ -1,16 +1,18 @@
 from datetime import timedelta
 import io
-from itertools import chain
-from functools import lru_cache, reduce
 from operator import itemgetter
+import numpy as np
 import pandas as pd
 from PIL import Image, ImageDraw
 import re
 
+from kpireport.utils import cached_method
 from kpireport.view import View
 
 DEFAULT_TIMELINE_HEIGHT = 15
 
+EMPTY_WINDOWS = np.empty((0, 2), dtype="datetime64[ns]")
+
 
 class PrometheusAlertSummary(View):
     """Display a list of alerts that fired recently.
@@ -31,9 +33,11 @@ class PrometheusAlertSummary(View):
             the label values will not be printed.
             (default ``["instance", "job"]``)
         labels (Dict[str,str]): a set of labels that the alert must contain in
-            order to be displayed (default ``None``)
+            order to be displayed. Values are regular expressions, which must
+            match part of the label value. (default ``None``)
         ignore_labels (Dict[str,str]): a set of labels that the alert must _not_
-            contain in order to be displayed (default ``None``)
+            contain in order to be displayed. Values are regular expressions,
+            as with ``labels``. (default ``None``)
         show_timeline (bool): whether to show a visual timeline of when alerts
             were firing (default ``True``)
         timeline_height (int): rendered height of the timeline in pixels
@@ -79,66 +83,91 @@ class PrometheusAlertSummary(View):
         return timedelta(**timedelta_kwargs)
 
     def _compute_time_windows(self, df_ts):
-        list_ts = df_ts.tolist()
-        if not list_ts:
-            return []
+        """Find the windows during which an alert fired.
+
+        Each time starts a window one resolution step long; windows are joined
+        while each time is at most one step after the previous time.
+
+        Returns:
+            numpy.ndarray: the (start, end) of each window, as an array of UTC
+                datetimes with one row per window.
+        """
+        ns = pd.DatetimeIndex(df_ts).asi8
+        if not len(ns):
+            return EMPTY_WINDOWS
+
+        resolution = pd.Timedelta(self.resolution).value
+        # Indices of the times which start a new window
+        starts = np.flatnonzero(np.diff(ns) > resolution) + 1
+        ends = np.append(starts - 1, len(ns) - 1)
+        starts = np.insert(starts, 0, 0)
+
+        return np.column_stack((ns[starts], ns[ends] + resolution)).view(
+            EMPTY_WINDOWS.dtype
+        )
 
-        windows = [[list_ts[0], list_ts[0] + self.resolution]]
-        for ts in list_ts:
-            if ts > windows[-1][1]:
-                # If we have over-run the last window, start a new one.
-                windows.append([ts, ts + self.resolution])
-            else:
-                # Expand last window to include time.
-                windows[-1][1] = ts + self.resolution
+    def _compress_time_windows(self, windows):
+        """Merge overlapping windows, returning the merged windows sorted by
+        their start time.
+        """
+        if not len(windows):
+            return EMPTY_WINDOWS
 
-        return windows
+        windows = windows[np.argsort(windows[:, 0], kind="stable")]
+        starts, ends = windows[:, 0], windows[:, 1]
+        # A window starts a new merged window if it starts after every window
+        # before it has ended.
+        latest_end = np.maximum.accumulate(ends)
+        merged = np.flatnonzero(np.append(True, starts[1:] >= latest_end[:-1]))
 
-    def _compress_time_windows(self, windows):
-        sorted_windows = sorted(windows, key=itemgetter(0))
-        compressed = sorted_windows[:1]
-        for start, end in sorted_windows[1:]:
-            if start < compressed[-1][1]:
-                compressed[-1][1] = max(compressed[-1][1], end)
-            else:
-                compressed.append([start, end])
-        return compressed
+        return np.column_stack((starts[merged], np.maximum.reduceat(ends, merged)))
 
     def _total_time(self, windows):
-        return reduce(lambda agg, x: agg + (x[1] - x[0]), windows, timedelta(0))
+        if not len(windows):
+            return timedelta(0)
+        return pd.Timedelta(np.sum(windows[:, 1] - windows[:, 0]))
 
     def _normalize_time_windows(self, windows):
         """Normalize time windows to a single [0,1] scale."""
-        td = self.report.timedelta
-        return [
-            (
-                max(0, (w[0] - self.report.start_date) / td),
-                (w[1] - w[0]) / td,
+        start = pd.Timestamp(self.report.start_date).value
+        td = pd.Timedelta(self.report.timedelta).value
+        ns = windows.astype(np.int64)
+        return list(
+            zip(
+                np.maximum(0, (ns[:, 0] - start) / td).tolist(),
+                ((ns[:, 1] - ns[:, 0]) / td).tolist(),
             )
-            for w in windows
-        ]
+        )
 
-    @lru_cache(maxsize=1)
+    def _alerts_query(self):
+        """Build the selector for the alerts to display, so they are filtered
+        by Prometheus rather than after fetching every alert.
+        """
+        # Filter out pending alerts that never fired
+        matchers = ['alertstate="firing"']
+        # Prometheus anchors regular expressions, so allow matching any part of
+        # the label value.
+        for key, value in (self.labels or {}).items():
+            matchers.append(f"{key}=~{_promql_string(f'.*(?:{value}).*')}")
+        for key, value in (self.ignore_labels or {}).items():
+            matchers.append(f"{key}!~{_promql_string(f'.*(?:{value}).*')}")
+        return f"ALERTS{{{','.join(matchers)}}}"
+
+    @cached_method
     def _template_vars(self):
         df = self.datasources.query(
-            self.datasource, "ALERTS", step=self.resolution.total_seconds()
+            self.datasource,
+            self._alerts_query(),
+            step=self.resolution.total_seconds(),
         )
 
-        # Filter out pending alerts that never fired
-        df = df[df["alertstate"] == "firing"]
-
-        if self.labels:
-            for key, value in self.labels.items():
-                df = df[df[key].str.contains(value)]
-        if self.ignore_labels:
-            for key, value in self.ignore_labels.items():
-                df = df[~df[key].str.contains(value)]
-
         hide_labels = ["__name__", "alertstate"] + self.hide_labels
         df = df.drop(labels=hide_labels, axis="columns", errors="ignore")
 
         summary = []
-        for alertname in df["alertname"].unique():
+        # If no alerts fired, there are no series and thus no columns.
+        alertnames = df["alertname"].unique() if not df.empty else []
+        for alertname in alertnames:
             df_a = df[df["alertname"] == alertname]
             df_a = df_a.drop(labels="alertname", axis="columns")
 
@@ -152,17 +181,20 @@ class PrometheusAlertSummary(View):
 
             # Find common label sets and which times those alerts fired
             labels = list(df_a.columns[2:])
-            df_ag = df_a.groupby(labels)["time"]
+            # Labels are categorical; only consider label sets that actually occur.
+            df_ag = df_a.groupby(labels, observed=True)["time"]
             firings = [
                 dict(
                     labels=dict(zip(labels, labelvalues)),
-                    windows=self._compute_time_windows(df_times),
+                    windows=self._compute_time_windows(df_times.sort_values()),
                 )
                 for labelvalues, df_times in df_ag
             ]
 
             # Find times during which any alert of this type fired
-            all_firings = list(chain(*[f["windows"] for f in firings]))
+            all_firings = np.concatenate(
+                [EMPTY_WINDOWS] + [f["windows"] for f in firings]
+            )
             windows = self._compress_time_windows(all_firings)
             total_time = self._total_time(windows)
 
@@ -186,7 +218,7 @@ class PrometheusAlertSummary(View):
 
     def _render_timeline(self, summary):
         timeline_data = self._normalize_time_windows(
-            list(chain(*[a["windows"] for a in summary]))
+            np.concatenate([EMPTY_WINDOWS] + [a["windows"] for a in summary])
         )
         theme = self.report.theme
         twidth = self.cols * theme.column_width
@@ -206,6 +238,9 @@ class PrometheusAlertSummary(View):
             )
         return figname
 
+    def prefetch(self):
+        self._template_vars()
+
     def _render(self, j2, fmt):
         template = j2.get_template(f"prometheus_alert_summary.{fmt}")
         return template.render(**self._template_vars())
@@ -218,3 +253,8 @@ class PrometheusAlertSummary(View):
 
     def render_slack(self, j2):
         return self._render(j2, "slack")
+
+
+def _promql_string(value):
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
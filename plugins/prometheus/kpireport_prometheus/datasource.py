@@ -1,12 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import math
+import re
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
 import pandas as pd
 import requests
 
 from kpireport.datasource import Datasource
 
+if TYPE_CHECKING:
+    from datetime import datetime
+    from typing import Dict, List, Optional, Tuple, Union
+
+LOG = logging.getLogger(__name__)
+
+# Prometheus rejects range queries returning more than 11,000 points per series.
+DEFAULT_MAX_POINTS = 11000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_POOL_SIZE = 10
+
+DURATION_REGEX = r"([0-9]+(?:\.[0-9]+)?)(ms|s|m|h|d|w|y)"
+DURATION_SECONDS = {
+    "ms": 0.001,
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+    "y": 365 * 24 * 60 * 60,
+}
+
+
+@dataclass
+class RequestTiming:
+    """The timing of a single request to the Prometheus server.
+
+    Attributes:
+        query (str): the PromQL query.
+        start (float): the start of the queried range, as a UNIX timestamp.
+        end (float): the end of the queried range, as a UNIX timestamp.
+        elapsed (float): the time taken to send the request and receive and
+            parse the full response, in seconds.
+        size (Optional[int]): the size of the response body as sent over the
+            network (i.e., compressed, if the server compressed it), in bytes,
+            if the server reported it.
+    """
+
+    query: str
+    start: float
+    end: float
+    elapsed: float
+    size: "Optional[int]"
+
 
 class PrometheusDatasource(Datasource):
     """Datasource that executes PromQL queries against a Prometheus server.
 
+    The Datasource supports incremental fetching (see
+    :class:`~kpireport.datasource.DatasourceManager`.)
+
     Attributes:
         host (str): the hostname of the Prometheus server (may include port),
             e.g., :samp:`https://prometheus.example.com:9090`. If no protocol
@@ -14,17 +70,66 @@ class PrometheusDatasource(Datasource):
         basic_auth (dict): HTTP Basic Auth credentials to use when
             authenticating to the server. Must be a dictionary with ``username``
             and ``password`` keys.
+        max_points (int): the maximum number of points per series to request
+            in a single range query. Range queries spanning more steps than
+            this are split into several requests over consecutive parts of
+            the window, which are then merged. (Default ``11000``, the most
+            Prometheus allows)
+        max_workers (int): the maximum number of requests to make in parallel
+            when a range query is split. (Default ``4``)
+        pool_size (int): the maximum number of connections to the server to
+            keep open for reuse. Connections are shared by all queries against
+            the Datasource. (Default ``10``, or ``max_workers`` if larger)
+        gzip (bool): whether to ask the server to compress responses. JSON
+            query results compress well, so this is typically much faster,
+            unless the server is on the same host. (Default ``True``)
+        timings (List[RequestTiming]): the timing of each request made to the
+            server, in the order the requests completed.
     """
 
-    def init(self, host=None, basic_auth=None):
+    supported_hints = ("target_points",)
+
+    def init(
+        self,
+        host=None,
+        basic_auth=None,
+        max_points=DEFAULT_MAX_POINTS,
+        max_workers=DEFAULT_MAX_WORKERS,
+        pool_size=None,
+        gzip=True,
+    ):
         if not host:
             raise ValueError("Missing required parameter: 'host'")
         if not host.startswith("http"):
             host = f"http://{host}"
         self.basic_auth = self._validate_basic_auth(basic_auth)
         self.host = host
+        self.max_points = int(max_points)
+        if self.max_points < 1:
+            raise ValueError("'max_points' must be at least 1")
+        self.max_workers = max(1, int(max_workers))
+        self.pool_size = int(pool_size or max(DEFAULT_POOL_SIZE, self.max_workers))
+        self.gzip = gzip
+        self.timings: "List[RequestTiming]" = []
+        self.session = self._make_session()
+
+    def _make_session(self) -> requests.Session:
+        # Keep connections alive across all queries, including the parts of a
+        # split range query, which are fetched in parallel.
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = "gzip" if self.gzip else "identity"
+        if self.basic_auth:
+            session.auth = requests.auth.HTTPBasicAuth(
+                self.basic_auth["username"], self.basic_auth["password"]
+            )
+        return session
 
-    def query(self, query: str, step="1h") -> pd.DataFrame:
+    def query(self, query: str, step="1h", target_points=None) -> pd.DataFrame:
         """Execute a PromQL query against the Prometheus server.
 
         Args:
@@ -37,7 +142,12 @@ class PrometheusDatasource(Datasource):
                 query resolution. A lower value provides more granularity
                 but at the cost of a more expensive query and more data
                 points to analyze. If your report window is significantly
-                short, it may make sense to reduce this.
+                short, it may make sense to reduce this. Queries with more
+                than ``max_points`` steps are split into several requests.
+            target_points (int): the number of points per series needed. If the
+                step would result in more points over the report window, a
+                larger step is used. This is typically passed as a hint by the
+                view (see :class:`~kpireport.datasource.Datasource`.)
 
         Returns:
             pandas.DataFrame: a table of time series results.
@@ -45,41 +155,92 @@ class PrometheusDatasource(Datasource):
                 The timeseries value will be in a ``time`` column; any labels
                 associated with the metric will be added as additional columns.
         """
-        if self.basic_auth:
-            auth = requests.auth.HTTPBasicAuth(
-                self.basic_auth["username"], self.basic_auth["password"]
-            )
+        return self.query_window(
+            self.report.start_date,
+            self.report.end_date,
+            query,
+            step=step,
+            target_points=target_points,
+        )
+
+    def query_window(
+        self,
+        start_date: "datetime",
+        end_date: "datetime",
+        query: str,
+        step="1h",
+        target_points=None,
+    ) -> pd.DataFrame:
+        """Execute a PromQL range query over a custom time window.
+
+        Args:
+            start_date (datetime): the start of the range query.
+            end_date (datetime): the end of the range query.
+            query (str): the PromQL query
+            step (str): the step size for the range query.
+            target_points (int): the number of points per series needed.
+
+        Returns:
+            pandas.DataFrame: a table of time series results, as with
+                :meth:`query`.
+        """
+        start, end = start_date.timestamp(), end_date.timestamp()
+        step_seconds = _step_seconds(step)
+        if target_points:
+            # Prometheus steps are at most millisecond precision
+            min_step = math.ceil((end - start) / int(target_points) * 1000) / 1000
+            if min_step > step_seconds:
+                step = step_seconds = min_step
+        chunks = _split_range(start, end, step_seconds, self.max_points)
+        if len(chunks) == 1:
+            result = self._query_range(query, *chunks[0], step)
         else:
-            auth = None
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(chunks))
+            ) as executor:
+                results = executor.map(
+                    lambda chunk: self._query_range(query, *chunk, step), chunks
+                )
+                result = _merge_matrices(list(results))
+
+        return _decode_matrix(result)
 
-        res = requests.get(
+    def _query_range(
+        self, query: str, start: float, end: float, step: "Union[str,float]"
+    ) -> "List[Dict]":
+        started_at = time.perf_counter()
+        res = self.session.get(
             f"{self.host}/api/v1/query_range",
             params=dict(
-                start=self.report.start_date.timestamp(),
-                end=self.report.end_date.timestamp(),
+                start=start,
+                end=end,
                 step=step,
                 query=query.strip(),
             ),
-            auth=auth,
         )
         res.raise_for_status()
         json = res.json()
+        timing = RequestTiming(
+            query=query,
+            start=start,
+            end=end,
+            elapsed=time.perf_counter() - started_at,
+            size=_content_length(res),
+        )
+        self.timings.append(timing)
+        LOG.debug(f"Prometheus query took {timing.elapsed:.3f}s: {query.strip()}")
 
         if json.get("status") != "success":
             raise ValueError("Got error response from Prometheus server")
 
-        result = json.get("data", {}).get("result", [])
+        return json.get("data", {}).get("result", [])
 
-        df = pd.DataFrame()
-
-        for metric in result:
-            mdf = pd.DataFrame(metric["values"], columns=["time", "value"])
-            mdf["time"] = pd.to_datetime(mdf["time"], unit="s")
-            mdf = mdf.assign(**metric["metric"])
-            mdf = mdf.astype({"value": "float"})
-            df = df.append(mdf)
-
-        return df
+    def time_index(self, df: "pd.DataFrame") -> "pd.DatetimeIndex":
+        """Get the time of each row in a query result."""
+        if df.empty:
+            return pd.DatetimeIndex([], tz="UTC")
+        # Prometheus timestamps are in UTC.
+        return pd.DatetimeIndex(df["time"]).tz_localize("UTC")
 
     def _validate_basic_auth(self, basic_auth):
         if not basic_auth:
@@ -92,3 +253,121 @@ class PrometheusDatasource(Datasource):
                 "Basic auth must be dict with 'username' and 'password' keys"
             )
         return basic_auth
+
+
+def _content_length(res: "requests.Response") -> "Optional[int]":
+    try:
+        return int(res.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _step_seconds(step: "Union[str,float]") -> float:
+    """Parse a range query step, given either as a Prometheus duration string
+    (e.g., "1h" or "1m30s") or a number of seconds.
+    """
+    try:
+        return float(step)
+    except ValueError:
+        pass
+    parts = re.findall(DURATION_REGEX, step)
+    if not parts or "".join(n + unit for n, unit in parts) != step:
+        raise ValueError(f"Invalid step format: '{step}'")
+    return sum(float(n) * DURATION_SECONDS[unit] for n, unit in parts)
+
+
+def _split_range(
+    start: float, end: float, step: float, max_points: int
+) -> "List[Tuple[float,float]]":
+    """Split a range query into consecutive ranges of at most ``max_points``
+    steps each.
+
+    Prometheus evaluates a range query at ``start``, ``start + step``, and so on
+    up to ``end``. Each range starts on one of these evaluation times and ends
+    on the last evaluation time before the next range starts, so the ranges
+    together are evaluated at exactly the same times as the full range, and no
+    sample is returned twice.
+    """
+    if step <= 0 or end - start <= (max_points - 1) * step:
+        return [(start, end)]
+    chunks = []
+    chunk_start = start
+    i = 0
+    while chunk_start <= end:
+        chunks.append((chunk_start, min(chunk_start + (max_points - 1) * step, end)))
+        i += 1
+        # Compute each start from the original start to avoid accumulating
+        # floating point error.
+        chunk_start = start + i * max_points * step
+    return chunks
+
+
+def _merge_matrices(results: "List[List[Dict]]") -> "List[Dict]":
+    """Merge the results of consecutive range queries, joining the values of
+    series with the same label set.
+    """
+    merged: "Dict[Tuple, Dict]" = {}
+    for result in results:
+        for metric in result:
+            key = tuple(sorted(metric["metric"].items()))
+            if key not in merged:
+                merged[key] = dict(metric=metric["metric"], values=[])
+            values = merged[key]["values"]
+            new_values = metric["values"]
+            # Guard against overlapping ranges: only keep samples newer than
+            # those already seen for the series.
+            skip = 0
+            if values:
+                while skip < len(new_values) and new_values[skip][0] <= values[-1][0]:
+                    skip += 1
+            values.extend(new_values[skip:])
+    return list(merged.values())
+
+
+def _decode_matrix(result: "List[Dict]") -> pd.DataFrame:
+    """Decode the result of a range query into a single DataFrame.
+
+    All samples are read directly into preallocated NumPy columns, and the
+    DataFrame is only built once at the end. Labels are stored as categorical
+    columns, with one code per series repeated for each of its samples.
+    """
+    if not result:
+        return pd.DataFrame()
+
+    lengths = np.array([len(metric["values"]) for metric in result], dtype=np.int64)
+    total = int(lengths.sum())
+    timestamps = np.empty(total, dtype=np.float64)
+    values = np.empty(total, dtype=np.float64)
+    # Per label: the code of each series' label value, and the label values
+    labels: "Dict[str, np.ndarray]" = {}
+    categories: "Dict[str, Dict[str, int]]" = {}
+
+    offset = 0
+    for i, metric in enumerate(result):
+        n = lengths[i]
+        if n:
+            series_timestamps, series_values = zip(*metric["values"])
+            end = offset + n
+            timestamps[offset:end] = series_timestamps
+            # Prometheus encodes values as strings; NumPy parses these, including
+            # special values like "NaN" and "+Inf".
+            values[offset:end] = series_values
+            offset = end
+        for key, value in metric["metric"].items():
+            if key not in labels:
+                labels[key] = np.full(len(result), -1, dtype=np.int32)
+                categories[key] = {}
+            labels[key][i] = categories[key].setdefault(value, len(categories[key]))
+
+    # Prometheus timestamps have millisecond precision.
+    times = np.round(timestamps * 1000).astype(np.int64)
+    columns = {
+        "time": pd.to_datetime(times, unit="ms"),
+        "value": values,
+    }
+    for key, codes in labels.items():
+        columns[key] = pd.Categorical.from_codes(
+            np.repeat(codes, lengths), categories=list(categories[key])
+        )
+
+    return pd.DataFrame(columns)
@@ -1,9 +1,14 @@
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from operator import itemgetter
 from unittest.mock import Mock
 
+import numpy as np
 import pandas as pd
 import pytest
+from hypothesis import HealthCheck, given, settings
+from hypothesis import strategies as st
 from kpireport.datasource import DatasourceManager
 from kpireport.report import Report
 from kpireport.tests.fixtures import FakeOutputDriver
@@ -14,7 +19,7 @@ from kpireport_prometheus import PrometheusAlertSummary
 
 def _mock_prometheus_response(ds_mgr: "DatasourceManager"):
     def _query(query_fn, *args, **kwargs):
-        if query_fn == "ALERTS":
+        if query_fn.startswith("ALERTS"):
             return pd.DataFrame(
                 [
                     {
@@ -51,3 +56,122 @@ def test_render(report: "Report", ds_mgr: "DatasourceManager", jinja_env, fmt: s
     j2 = make_render_env(jinja_env, view, FakeOutputDriver(report), fmt)
     _assert_matches_fixture(view.render(j2), f"expected_alert_summary.{fmt}")
     assert len(view.blobs) == 1
+
+
+def test_alerts_query(report: "Report", ds_mgr: "DatasourceManager"):
+    view = PrometheusAlertSummary(
+        report,
+        ds_mgr,
+        labels={"severity": "critical|page"},
+        ignore_labels={"job": 'node"s'},
+    )
+    assert view._alerts_query() == (
+        'ALERTS{alertstate="firing",severity=~".*(?:critical|page).*",'
+        'job!~".*(?:node\\"s).*"}'
+    )
+    view._template_vars()
+    ds_mgr.get_instance("prometheus").query.assert_called_once_with(
+        view._alerts_query(), step=900.0
+    )
+
+
+def test_no_alerts(report: "Report", ds_mgr: "DatasourceManager"):
+    ds_mgr.get_instance("prometheus").query.side_effect = None
+    ds_mgr.get_instance("prometheus").query.return_value = pd.DataFrame()
+    view = PrometheusAlertSummary(report, ds_mgr)
+    assert view._template_vars()["summary"] == []
+
+
+# Reference implementations of the time window calculations, which the
+# vectorized implementations must agree with.
+
+
+def _compute_time_windows_ref(df_ts, resolution):
+    list_ts = df_ts.tolist()
+    if not list_ts:
+        return []
+    windows = [[list_ts[0], list_ts[0] + resolution]]
+    for ts in list_ts:
+        if ts > windows[-1][1]:
+            windows.append([ts, ts + resolution])
+        else:
+            windows[-1][1] = ts + resolution
+    return windows
+
+
+def _compress_time_windows_ref(windows):
+    sorted_windows = sorted(windows, key=itemgetter(0))
+    compressed = [list(w) for w in sorted_windows[:1]]
+    for start, end in sorted_windows[1:]:
+        if start < compressed[-1][1]:
+            compressed[-1][1] = max(compressed[-1][1], end)
+        else:
+            compressed.append([start, end])
+    return compressed
+
+
+def _total_time_ref(windows):
+    return reduce(lambda agg, x: agg + (x[1] - x[0]), windows, timedelta(0))
+
+
+EPOCH = datetime(2020, 5, 1, tzinfo=timezone.utc)
+resolutions = st.sampled_from(["1m", "5m", "15m", "1h"])
+times = st.lists(
+    st.integers(min_value=0, max_value=60 * 24 * 7).map(
+        lambda m: pd.Timestamp(EPOCH + timedelta(minutes=m))
+    ),
+    max_size=200,
+)
+windows = st.lists(
+    st.tuples(
+        st.integers(min_value=0, max_value=60 * 24 * 7),
+        st.integers(min_value=1, max_value=600),
+    ).map(
+        lambda w: [
+            pd.Timestamp(EPOCH + timedelta(minutes=w[0])),
+            pd.Timestamp(EPOCH + timedelta(minutes=w[0] + w[1])),
+        ]
+    ),
+    max_size=100,
+)
+# The report fixture is only read, so it is safe to share between examples.
+shared_fixtures = settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
+
+
+def _to_array(windows):
+    return np.array(
+        [[start.value, end.value] for start, end in windows], dtype=np.int64
+    ).reshape(-1, 2)
+
+
+@shared_fixtures
+@given(resolution=resolutions, times=times, sort=st.booleans())
+def test_compute_time_windows(report: "Report", resolution, times, sort):
+    view = PrometheusAlertSummary(report, Mock(), resolution=resolution)
+    df_ts = pd.Series(sorted(times) if sort else times, dtype="datetime64[ns, UTC]")
+    np.testing.assert_array_equal(
+        view._compute_time_windows(df_ts).astype(np.int64),
+        _to_array(_compute_time_windows_ref(df_ts, view.resolution)),
+    )
+
+
+@shared_fixtures
+@given(windows=windows)
+def test_compress_time_windows(report: "Report", windows):
+    view = PrometheusAlertSummary(report, Mock())
+    np.testing.assert_array_equal(
+        view._compress_time_windows(_to_array(windows).view("datetime64[ns]")).astype(
+            np.int64
+        ),
+        _to_array(_compress_time_windows_ref(windows)),
+    )
+
+
+@shared_fixtures
+@given(windows=windows)
+def test_total_time(report: "Report", windows):
+    view = PrometheusAlertSummary(report, Mock())
+    total_time = view._total_time(_to_array(windows).view("datetime64[ns]"))
+    expected = _total_time_ref(windows)
+    assert total_time == expected
+    assert str(total_time) == str(expected)
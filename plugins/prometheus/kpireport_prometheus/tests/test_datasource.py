@@ -1,15 +1,18 @@
 from typing import Dict
 from unittest import mock
 
+import numpy as np
+import pandas as pd
 import pytest
 import requests
 from kpireport.report import Report
 from kpireport.tests.fixtures import FakeResponse
 from kpireport_prometheus import PrometheusDatasource
+from kpireport_prometheus.datasource import _split_range, _step_seconds
 
 
 def _mock_response(mocker: "mock", status_code: int, body: "Dict" = None):
-    request = mocker.patch("requests.get")
+    request = mocker.patch("requests.Session.get")
     request.return_value = FakeResponse(status_code, body)
     return request
 
@@ -47,3 +50,144 @@ def test_query_error_body(report: "Report", mocker: "mock"):
     ds = PrometheusDatasource(report, host="http://localhost:9090")
     with pytest.raises(ValueError):
         ds.query("up")
+
+
+def test_query_decode(report: "Report", mocker: "mock"):
+    _mock_response(
+        mocker,
+        200,
+        {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    {
+                        "metric": {"app": "fake-app1"},
+                        "values": [[1600000000.123, "1"], [1600000060.123, "NaN"]],
+                    },
+                    {"metric": {"app": "fake-app1", "env": "prod"}, "values": []},
+                    {
+                        "metric": {"app": "fake-app2", "env": "prod"},
+                        "values": [[1600000000.123, "+Inf"]],
+                    },
+                ],
+            },
+        },
+    )
+    ds = PrometheusDatasource(report, host="http://localhost:9090")
+    df = ds.query("up")
+    assert list(df.columns) == ["time", "value", "app", "env"]
+    assert list(df.index) == [0, 1, 2]
+    assert list(df["time"]) == [
+        pd.Timestamp("2020-09-13 12:26:40.123"),
+        pd.Timestamp("2020-09-13 12:27:40.123"),
+        pd.Timestamp("2020-09-13 12:26:40.123"),
+    ]
+    assert df["value"].iloc[0] == 1.0
+    assert np.isnan(df["value"].iloc[1])
+    assert np.isinf(df["value"].iloc[2])
+    assert list(df["app"]) == ["fake-app1", "fake-app1", "fake-app2"]
+    assert df["env"].isna().tolist() == [True, True, False]
+
+
+def test_query_empty(report: "Report", mocker: "mock"):
+    _mock_response(
+        mocker,
+        200,
+        {"status": "success", "data": {"resultType": "matrix", "result": []}},
+    )
+    ds = PrometheusDatasource(report, host="http://localhost:9090")
+    assert ds.query("up").empty
+
+
+@pytest.mark.parametrize(
+    "step,expected",
+    [("1h", 3600), ("1m30s", 90), ("500ms", 0.5), ("60", 60), (900.0, 900)],
+)
+def test_step_seconds(step, expected):
+    assert _step_seconds(step) == expected
+
+
+def test_step_seconds_invalid():
+    with pytest.raises(ValueError):
+        _step_seconds("1hour")
+
+
+def test_split_range():
+    assert _split_range(0, 100, 10, 11) == [(0, 100)]
+    # 0, 10, ... 100 is 11 points; split into ranges of at most 4 points
+    assert _split_range(0, 100, 10, 4) == [(0, 30), (40, 70), (80, 100)]
+
+
+def test_query_split(report: "Report", mocker: "mock"):
+    step = 24 * 60 * 60
+    start = report.start_date.timestamp()
+
+    def _query_range(url, params=None, **kwargs):
+        # Return a sample for each evaluation time in the range, for one series
+        # that exists throughout and one that only exists in the first range.
+        times = np.arange(params["start"], params["end"] + 1, step).tolist()
+        result = [{"metric": {"app": "app1"}, "values": [[t, "1"] for t in times]}]
+        if params["start"] == start:
+            result.append({"metric": {"app": "app2"}, "values": [[start, "2"]]})
+        return FakeResponse(
+            200,
+            {"status": "success", "data": {"resultType": "matrix", "result": result}},
+        )
+
+    request = mocker.patch("requests.Session.get", side_effect=_query_range)
+    ds = PrometheusDatasource(report, host="http://localhost:9090", max_points=3)
+    df = ds.query("up", step="1d")
+
+    # The 7 days of the report window are fetched 3 days at a time.
+    assert request.call_count == 3
+    assert list(df["app"]) == ["app1"] * 7 + ["app2"]
+    assert list(df["time"][:7]) == list(
+        pd.date_range(report.start_date.replace(tzinfo=None), periods=7, freq="1d")
+    )
+
+
+def test_session(report: "Report"):
+    ds = PrometheusDatasource(
+        report,
+        host="http://localhost:9090",
+        basic_auth={"username": "user", "password": "pass"},
+        pool_size=20,
+    )
+    assert ds.session.headers["Accept-Encoding"] == "gzip"
+    assert ds.session.auth.username == "user"
+    assert ds.session.get_adapter(ds.host)._pool_maxsize == 20
+
+    ds = PrometheusDatasource(report, host="http://localhost:9090", gzip=False)
+    assert ds.session.headers["Accept-Encoding"] == "identity"
+    assert ds.session.auth is None
+
+
+def test_query_timings(report: "Report", mocker: "mock"):
+    request = _mock_response(
+        mocker,
+        200,
+        {"status": "success", "data": {"resultType": "matrix", "result": []}},
+    )
+    request.return_value.headers["Content-Length"] = "42"
+    ds = PrometheusDatasource(report, host="http://localhost:9090")
+    ds.query("up")
+    ds.query("down")
+    assert [t.query for t in ds.timings] == ["up", "down"]
+    assert ds.timings[0].size == 42
+    assert ds.timings[0].start == report.start_date.timestamp()
+    assert all(t.elapsed >= 0 for t in ds.timings)
+
+
+def test_query_target_points(report: "Report", mocker: "mock"):
+    request = _mock_response(
+        mocker,
+        200,
+        {"status": "success", "data": {"resultType": "matrix", "result": []}},
+    )
+    ds = PrometheusDatasource(report, host="http://localhost:9090")
+    # The 6 day window has 144 hourly steps
+    ds.query("up", step="1h", target_points=200)
+    assert request.call_args[1]["params"]["step"] == "1h"
+    ds.query("up", step="1h", target_points=100)
+    assert request.call_args[1]["params"]["step"] == 6 * 24 * 60 * 60 / 100
@@ -1,18 +1,51 @@
+import json
 import logging
-import os
-import tempfile
+from io import BytesIO
+from typing import TYPE_CHECKING
 
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import ClientError
 from kpireport_static import StaticOutputDriver
 
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List, Optional
+
+    from kpireport_static import OutputFile
+    from s3transfer.futures import TransferFuture
+
 LOG = logging.getLogger(__name__)
 
+SYNC_MODES = ("etag", "manifest")
+MANIFEST_SUFFIX = ".manifest.json"
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_LATEST_CACHE_CONTROL = "no-cache"
+
 
 class S3OutputDriver(StaticOutputDriver):
     """
     Attributes:
         bucket (str): the S3 bucket to upload to.
         prefix (str): the key prefix.
+        sync (str): how to find the files that have not changed since they were
+            last uploaded, which are skipped. Either "etag", to compare the MD5
+            hash of each file with the ETag of the existing object, or
+            "manifest", to compare the SHA-256 hash of each file with a manifest
+            object uploaded along with the report (named after the report, with
+            a ``.manifest.json`` suffix.) ETags are only MD5 hashes for objects
+            uploaded in a single part and not encrypted with KMS; use
+            "manifest" if this is not the case. If ``False``, all files are
+            uploaded. (Default "etag")
+        max_concurrency (int): the maximum number of concurrent transfers,
+            including the parts of large files. (Default 10)
+        cache_control (str): the ``Cache-Control`` header to set on the objects
+            of the report. (Default none)
+        latest_cache_control (str): the ``Cache-Control`` header to set on the
+            objects of the "latest" alias, which change with every report.
+            (Default "no-cache")
+        output_dir (str): if set, the report is also written to this local
+            directory, as with :class:`~kpireport_static.StaticOutputDriver`.
+            Otherwise, the report is uploaded directly from memory.
         kwargs: any additional keyword arguments are passed in to the
             :class:`boto3.client` constructor.
     """
@@ -20,23 +53,158 @@ class S3OutputDriver(StaticOutputDriver):
     def init(self, **kwargs):
         self.bucket = kwargs.pop("bucket", None)
         self.prefix = kwargs.pop("prefix", None)
+        self.sync = kwargs.pop("sync", "etag")
+        self.max_concurrency = int(
+            kwargs.pop("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        )
+        self.cache_control = kwargs.pop("cache_control", None)
+        self.latest_cache_control = kwargs.pop(
+            "latest_cache_control", DEFAULT_LATEST_CACHE_CONTROL
+        )
+        output_dir = kwargs.pop("output_dir", None)
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/core/session.html#boto3.session.Session.client
         self.s3 = boto3.client("s3", **kwargs)
 
         if not self.bucket:
             raise ValueError("'bucket' is required")
+        if self.sync and self.sync not in SYNC_MODES:
+            raise ValueError(
+                f"Unsupported sync mode '{self.sync}', must be one of {SYNC_MODES}"
+            )
 
-        self._s3_tmp_dir = tempfile.TemporaryDirectory()
+        self.transfer_config = TransferConfig(max_concurrency=self.max_concurrency)
 
-        super(S3OutputDriver, self).init(output_dir=self._s3_tmp_dir.name)
+        super(S3OutputDriver, self).init(output_dir=output_dir)
+
+    def _key(self, path: str) -> str:
+        return f"{self.prefix or ''}{path}"
 
     def render_output(self, content, blobs):
-        super(S3OutputDriver, self).render_output(content, blobs)
-
-        with self._s3_tmp_dir as tmp_dir:
-            for root, _, files in os.walk(tmp_dir):
-                path = root.replace(tmp_dir, "").lstrip("/")
-                prefix = self.prefix or ""
-                for f in files:
-                    key = f"{prefix}{path}/{f}"
-                    self.s3.upload_file(f"{root}/{f}", self.bucket, key)
+        files = {f.path: f for f in self.render_files(content, blobs)}
+        if self.output_dir:
+            self.write_files(list(files.values()))
+
+        name, alias = self._output_names()
+        # The "latest" alias is not uploaded; its objects are instead copied from
+        # the report within S3.
+        aliases = {self._alias(path): f for path, f in files.items()}
+
+        with create_transfer_manager(self.s3, self.transfer_config) as manager:
+            uploaded = self._sync(
+                name,
+                {path: self._hash(f) for path, f in files.items()},
+                lambda path: manager.upload(
+                    # This does not copy the content.
+                    BytesIO(files[path].content.getvalue()),
+                    self.bucket,
+                    self._key(path),
+                    extra_args=self._extra_args(files[path], self.cache_control),
+                ),
+            )
+            LOG.info(f"Uploaded {len(uploaded)} of {len(files)} files to S3")
+            # Only copy once the report is fully uploaded.
+            self._sync(
+                alias,
+                {path: self._hash(f) for path, f in aliases.items()},
+                lambda path: manager.copy(
+                    {"Bucket": self.bucket, "Key": self._key(aliases[path].path)},
+                    self.bucket,
+                    self._key(path),
+                    extra_args={
+                        # Replace the metadata of the source object, so the alias
+                        # gets its own cache headers.
+                        "MetadataDirective": "REPLACE",
+                        **self._extra_args(aliases[path], self.latest_cache_control),
+                    },
+                ),
+            )
+
+    def _extra_args(
+        self, file: "OutputFile", cache_control: "Optional[str]"
+    ) -> "Dict[str, str]":
+        extra_args = {}
+        if file.mime_type:
+            extra_args["ContentType"] = file.mime_type
+        if cache_control:
+            extra_args["CacheControl"] = cache_control
+        return extra_args
+
+    def _sync(
+        self,
+        name: str,
+        hashes: "Dict[str, Optional[str]]",
+        transfer: "Callable[[str], TransferFuture]",
+    ) -> "List[str]":
+        """Transfer the files of an output that differ from the objects in S3.
+
+        Args:
+            name (str): the name of the output.
+            hashes (Dict[str, Optional[str]]): the hash of each file of the
+                output, by path.
+            transfer (Callable[[str], TransferFuture]): starts the transfer of
+                a file to S3, given its path.
+
+        Returns:
+            List[str]: the paths of the transferred files.
+        """
+        published = self._published(name) if self.sync else {}
+        changed = [
+            path
+            for path, hash in hashes.items()
+            if not self.sync or published.get(self._key(path)) != hash
+        ]
+        _wait([transfer(path) for path in changed])
+
+        if self.sync == "manifest":
+            manifest = {self._key(path): hash for path, hash in hashes.items()}
+            if manifest != published:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self._key(f"{name}{MANIFEST_SUFFIX}"),
+                    Body=json.dumps(manifest, sort_keys=True).encode("utf-8"),
+                    ContentType="application/json",
+                )
+        return changed
+
+    def _hash(self, file: "OutputFile") -> "Optional[str]":
+        if not self.sync:
+            return None
+        if self.sync == "etag":
+            return file.content.etag()
+        return file.content.digest
+
+    def _published(self, name: str) -> "Dict[str, str]":
+        """Get the hash of each object in S3 belonging to an output, by key."""
+        if self.sync == "manifest":
+            return self._read_manifest(name)
+
+        etags = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(name)):
+            for obj in page.get("Contents", []):
+                etags[obj["Key"]] = obj["ETag"]
+        return etags
+
+    def _read_manifest(self, name: str) -> "Dict[str, str]":
+        try:
+            res = self.s3.get_object(
+                Bucket=self.bucket, Key=self._key(f"{name}{MANIFEST_SUFFIX}")
+            )
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return {}
+            raise
+        return json.loads(res["Body"].read())
+
+
+def _wait(futures: "List[TransferFuture]"):
+    # Wait for all transfers to finish before raising the first error, so none
+    # are left running.
+    errors = []
+    for future in futures:
+        try:
+            future.result()
+        except Exception as exc:
+            errors.append(exc)
+    if errors:
+        raise errors[0]
@@ -1,26 +1,171 @@
-from unittest import mock
+import hashlib
+import os
+import threading
+from collections import Counter
+from io import BytesIO
+from unittest.mock import MagicMock
 
 import pytest
+from botocore.exceptions import ClientError
+from kpireport.blob import BlobStore
 from kpireport.report import Content, Report
+from kpireport.view import Blob
 from kpireport_s3 import S3OutputDriver
 
 
-def test_render_output(report: "Report", content: "Content", mocker: "mock"):
-    out = S3OutputDriver(report, bucket="fake-bucket")
-    s3 = mocker.patch.object(out, "s3")
-    out.render_output(content, [])
-    s3.upload_file.assert_called_with(
-        f"{out.output_dir}/{report.id}/index.html",
-        "fake-bucket",
-        f"{report.id}/index.html",
+class FakeS3:
+    """An in-memory S3 bucket, implementing the client calls used for uploads."""
+
+    def __init__(self):
+        self.objects = {}
+        self.headers = {}
+        self.calls = Counter()
+        self.meta = MagicMock()
+        self._lock = threading.Lock()
+
+    def _record(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._record("put_object")
+        body = Body if isinstance(Body, bytes) else Body.read()
+        self.objects[Key] = body
+        self.headers[Key] = _headers(kwargs)
+        return dict(ETag=_etag(body))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return dict(ContentLength=len(self.objects[Key]))
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._record("copy_object")
+        self.objects[Key] = self.objects[CopySource["Key"]]
+        if kwargs.get("MetadataDirective") == "REPLACE":
+            self.headers[Key] = _headers(kwargs)
+        else:
+            self.headers[Key] = self.headers[CopySource["Key"]]
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return dict(Body=BytesIO(self.objects[Key]))
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        paginator = MagicMock()
+        paginator.paginate.side_effect = lambda Bucket, Prefix: [
+            dict(
+                Contents=[
+                    dict(Key=key, ETag=_etag(body))
+                    for key, body in self.objects.items()
+                    if key.startswith(Prefix)
+                ]
+            )
+        ]
+        return paginator
+
+
+def _headers(kwargs):
+    return {k: v for k, v in kwargs.items() if k in ("ContentType", "CacheControl")}
+
+
+def _etag(body):
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def make_driver(report, s3, **kwargs):
+    out = S3OutputDriver(report, bucket="fake-bucket", **kwargs)
+    out.s3 = s3
+    return out
+
+
+def make_blobs():
+    content = BlobStore().add(b"fake-image")
+    return [Blob("view/figure.png", content, "image/png", None)]
+
+
+def test_render_output(report: "Report", content: "Content"):
+    s3 = FakeS3()
+    make_driver(report, s3, prefix="reports/").render_output(content, make_blobs())
+    latest = f"latest-{report.title_slug}"
+    assert set(s3.objects) == {
+        f"reports/{report.id}/index.html",
+        f"reports/{report.id}/view/figure.png",
+        f"reports/{latest}/index.html",
+        f"reports/{latest}/view/figure.png",
+    }
+    assert s3.objects[f"reports/{report.id}/view/figure.png"] == b"fake-image"
+    # The "latest" alias is copied, not uploaded again.
+    assert s3.calls == Counter(put_object=2, copy_object=2)
+
+
+@pytest.mark.parametrize("sync", ["etag", "manifest"])
+def test_render_output_skips_unchanged(report: "Report", content: "Content", sync: str):
+    s3 = FakeS3()
+    make_driver(report, s3, sync=sync).render_output(content, make_blobs())
+    first_run = Counter(s3.calls)
+    if sync == "manifest":
+        assert f"{report.id}.manifest.json" in s3.objects
+
+    s3.calls.clear()
+    make_driver(report, s3, sync=sync).render_output(content, make_blobs())
+    assert s3.calls == Counter()
+
+    # Only the changed blob is uploaded and copied to the alias.
+    blobs = make_blobs()
+    blobs[0].content = BlobStore().add(b"other-image")
+    make_driver(report, s3, sync=sync).render_output(content, blobs)
+    manifests = 2 if sync == "manifest" else 0
+    assert s3.calls == Counter(put_object=1 + manifests, copy_object=1)
+    assert first_run == Counter(put_object=2 + manifests, copy_object=2)
+
+
+def test_render_output_without_sync(report: "Report", content: "Content"):
+    s3 = FakeS3()
+    for _ in range(2):
+        make_driver(report, s3, sync=False).render_output(content, make_blobs())
+    assert s3.calls == Counter(put_object=4, copy_object=4)
+
+
+def test_render_output_headers(report: "Report", content: "Content"):
+    s3 = FakeS3()
+    make_driver(report, s3, cache_control="max-age=3600").render_output(
+        content, make_blobs()
+    )
+    latest = f"latest-{report.title_slug}"
+    assert s3.headers[f"{report.id}/index.html"] == dict(
+        ContentType="text/html; charset=utf-8", CacheControl="max-age=3600"
     )
-    s3.upload_file.assert_called_with(
-        f"{out.output_dir}/{report.id}/index.html",
-        "fake-bucket",
-        f"{report.id}/index.html",
+    assert s3.headers[f"{report.id}/view/figure.png"] == dict(
+        ContentType="image/png", CacheControl="max-age=3600"
     )
+    assert s3.headers[f"{latest}/view/figure.png"] == dict(
+        ContentType="image/png", CacheControl="no-cache"
+    )
+
+
+def test_render_output_dir(report: "Report", content: "Content", tmp_path, monkeypatch):
+    # Nothing is written to disk unless an output directory is configured.
+    monkeypatch.chdir(tmp_path)
+    s3 = FakeS3()
+    make_driver(report, s3).render_output(content, make_blobs())
+    assert not os.listdir(tmp_path)
+
+    make_driver(report, s3, output_dir=str(tmp_path)).render_output(
+        content, make_blobs()
+    )
+    latest = f"latest-{report.title_slug}"
+    for name in [report.id, latest]:
+        with open(tmp_path / name / "view" / "figure.png", "rb") as f:
+            assert f.read() == b"fake-image"
 
 
 def test_missing_bucket(report: "Report"):
     with pytest.raises(ValueError):
         S3OutputDriver(report)
+
+
+def test_invalid_sync(report: "Report"):
+    with pytest.raises(ValueError):
+        S3OutputDriver(report, bucket="fake-bucket", sync="mtime")
@@ -1,21 +1,81 @@
 import logging
+import os
 import shlex
 import tarfile
-import tempfile
+import time
+import uuid
+from io import BytesIO
+from typing import TYPE_CHECKING
 
 import fabric
 from kpireport_static import StaticOutputDriver
 
+if TYPE_CHECKING:
+    from typing import Callable, Dict, List
+
+    from kpireport.blob import BlobContent
+
 LOG = logging.getLogger(__name__)
 
+DEFAULT_REMOTE_TMP_DIR = "/tmp"
+# The index of the hash of each file deployed by delta mode, in the remote path.
+INDEX_NAME = ".kpireport.sha256"
+
+# Lines of sha256sum output are the 64-character hex digest, two spaces and the
+# path, which starts at character 67.
+AWK_SELECT_DIGESTS = """
+BEGIN { while ((getline line < need) > 0) needed[substr(line, 1, 64)] }
+substr($0, 1, 64) in needed
+"""
+AWK_SELECT_PATHS = """
+BEGIN { while ((getline line < ok) > 0) verified[line] }
+substr($0, 67) in verified
+"""
+AWK_MERGE_INDEX = """
+BEGIN { while ((getline line < new) > 0) { print line; seen[substr(line, 67)] } }
+!(substr($0, 67) in seen)
+"""
+
 
 class SCPOutputDriver(StaticOutputDriver):
+    """
+    Attributes:
+        host (str): the remote host to copy the report to.
+        remote_path (str): the directory on the remote host to copy the report
+            contents to.
+        remote_path_owner (str): if set, the owner (user) to set on the report
+            contents on the remote host.
+        remote_path_group (str): if set, the group to set on the report
+            contents on the remote host.
+        sudo (bool): whether to run commands on the remote host with ``sudo``.
+            (Default ``False``)
+        sudo_password (str): the password to use with ``sudo``, if required.
+        delta (bool): whether to only copy the contents the remote host does not
+            already have. A manifest of the SHA-256 hash of each file is copied
+            first; the remote host looks the hashes up in an index of the files
+            it has (``.kpireport.sha256`` in the remote path), checks those files
+            did not change (which requires ``sha256sum``), and copies them into
+            place, so only the contents it lacks are copied. Otherwise, all
+            files are copied in a single tarball. (Default ``False``)
+        remote_tmp_dir (str): the directory on the remote host to copy files to
+            before they are moved into place. Each report uses its own unique
+            paths in this directory, and removes them when done.
+            (Default "/tmp")
+        output_dir (str): if set, the report is also written to this local
+            directory, as with :class:`~kpireport_static.StaticOutputDriver`.
+        kwargs: any additional keyword arguments are passed in to the
+            :class:`fabric.Connection` constructor.
+    """
+
     def init(self, **kwargs):
         self.remote_path = kwargs.pop("remote_path", None)
         self.remote_path_owner = kwargs.pop("remote_path_owner", None)
         self.remote_path_group = kwargs.pop("remote_path_group", None)
         self.sudo = kwargs.pop("sudo", False)
         self.sudo_password = kwargs.pop("sudo_password", None)
+        self.delta = kwargs.pop("delta", False)
+        self.remote_tmp_dir = kwargs.pop("remote_tmp_dir", DEFAULT_REMOTE_TMP_DIR)
+        output_dir = kwargs.pop("output_dir", None)
 
         host = kwargs.pop("host", None)
 
@@ -29,38 +89,204 @@ class SCPOutputDriver(StaticOutputDriver):
             )
 
         self.connection = fabric.Connection(host=host, **kwargs)
-        self._scp_tmp_dir = tempfile.TemporaryDirectory()
 
-        super(SCPOutputDriver, self).init(output_dir=self._scp_tmp_dir.name)
+        super(SCPOutputDriver, self).init(output_dir=output_dir)
+
+    def _run(self, script: str, **kwargs):
+        """Run a shell script on the remote host, in a single command."""
+        c = self.connection
+        run = c.sudo if self.sudo is True else c.run
+        # Wrap the script in a shell, so the whole script (and not only its first
+        # command) runs with sudo.
+        return run(f"sh -c {shlex.quote(script)}", **kwargs)
 
     def render_output(self, content, blobs):
-        super(SCPOutputDriver, self).render_output(content, blobs)
+        files = self.render_files(content, blobs)
+        if self.output_dir:
+            self.write_files(files)
 
-        c = self.connection
+        # Both the report and its "latest" alias are copied.
+        contents = {}
+        for file in files:
+            contents[file.path] = file.content
+            contents[self._alias(file.path)] = file.content
 
-        if self.sudo is True:
-            run = getattr(c, "sudo")
-        else:
-            run = getattr(c, "run")
+        # Unique paths on the remote host, so concurrent reports do not clobber
+        # each other's files.
+        self._tmp_prefix = os.path.join(
+            self.remote_tmp_dir, f"kpireport-{uuid.uuid4().hex}"
+        )
+        self._tmp_files = []
+
+        def put(data: bytes, suffix: str) -> str:
+            remote = self._tmp_path(suffix)
+            self.connection.put(BytesIO(data), remote=remote)
+            return remote
+
+        try:
+            if self.delta:
+                script = self._sync(contents, put)
+            else:
+                script = self._extract(contents, put)
+        except Exception:
+            if self._tmp_files:
+                self._run(_remove(self._tmp_files), warn=True, hide=True)
+            raise
+
+        self._run(
+            "\n".join(
+                [
+                    "set -e",
+                    f"trap {shlex.quote(_remove(self._tmp_files))} EXIT",
+                    script,
+                    self._chown(),
+                ]
+            )
+        )
+
+    def _tmp_path(self, suffix: str) -> str:
+        """Get a unique temporary path on the remote host, which is removed once
+        the report is deployed.
+        """
+        path = f"{self._tmp_prefix}{suffix}"
+        self._tmp_files.append(path)
+        return path
+
+    def _extract(
+        self,
+        contents: "Dict[str, BlobContent]",
+        put: "Callable[[bytes, str], str]",
+    ) -> str:
+        """Copy all files to the remote host in a tarball.
+
+        Returns:
+            str: the script to extract the files into the remote path.
+        """
+        tarball = BytesIO()
+        mtime = time.time()
+        with tarfile.open(fileobj=tarball, mode="w:gz") as tar:
+            for path, content in contents.items():
+                info = tarfile.TarInfo(path)
+                info.size = content.size
+                info.mtime = mtime
+                tar.addfile(info, BytesIO(content.getvalue()))
+        remote_tarball = put(tarball.getvalue(), ".tar.gz")
+
+        safe_path = shlex.quote(self.remote_path)
+        return "\n".join(
+            [
+                f"mkdir -p {safe_path}",
+                f"tar -xzf {shlex.quote(remote_tarball)} -C {safe_path}",
+            ]
+        )
+
+    def _sync(
+        self,
+        contents: "Dict[str, BlobContent]",
+        put: "Callable[[bytes, str], str]",
+    ) -> str:
+        """Copy the contents the remote host does not already have.
 
-        tarball = f"{self._scp_tmp_dir.name}/{self.report.id}.tar.gz"
-        with tarfile.open(tarball, "w:gz") as tar:
-            tar.add(self.output_dir, arcname="static")
-        remote_tarball = "/tmp/kpireport.tar.gz"
-        c.put(tarball, remote=remote_tarball)
+        The remote path has an index of the hash of each file deployed there.
+        Contents already on the remote host, e.g., those of the previous report,
+        are copied from an existing file with the same hash, after checking the
+        file did not change since it was indexed.
+
+        Returns:
+            str: the script to move the changed files into the remote path.
+        """
+        manifest = "".join(
+            f"{content.digest}  {path}\n" for path, content in contents.items()
+        )
+        remote_manifest = put(manifest.encode("utf-8"), ".sha256")
+        candidates = self._tmp_path(".candidates")
+        verified = self._tmp_path(".verified")
 
         safe_path = shlex.quote(self.remote_path)
+        safe_index = shlex.quote(INDEX_NAME)
+        res = self._run(
+            "\n".join(
+                [
+                    f"mkdir -p {safe_path}",
+                    f"cd {safe_path}",
+                    # The indexed files with any of the needed hashes...
+                    f"{{ cat {safe_index} 2>/dev/null || true; }}"
+                    f" | awk -v need={shlex.quote(remote_manifest)}"
+                    f" {shlex.quote(AWK_SELECT_DIGESTS)} > {shlex.quote(candidates)}",
+                    # ...which still have that content.
+                    f"{{ LC_ALL=C sha256sum -c {shlex.quote(candidates)} 2>/dev/null"
+                    " || true; }"
+                    f" | sed -n 's/: OK$//p' > {shlex.quote(verified)}",
+                    f"awk -v ok={shlex.quote(verified)} {shlex.quote(AWK_SELECT_PATHS)}"
+                    f" {shlex.quote(candidates)}",
+                ]
+            ),
+            hide=True,
+        )
+
+        # The remote files with each content, by hash.
+        present = set()
+        sources = {}
+        for line in res.stdout.splitlines():
+            digest, sep, path = line.partition("  ")
+            if sep:
+                present.add((digest, path))
+                sources.setdefault(digest, path)
 
-        run(f"mkdir -p {safe_path}")
-        run(f"tar -xf {remote_tarball} -C {safe_path} --strip-components=1")
-        run(f"rm -f {remote_tarball}")
+        changed = [
+            path
+            for path, content in contents.items()
+            if (content.digest, path) not in present
+        ]
 
-        if self.remote_path_owner:
-            safe_owner = shlex.quote(self.remote_path_owner)
-            if self.remote_path_group:
-                safe_group = shlex.quote(self.remote_path_group)
+        # Each content is only copied once, e.g., for the report and its alias.
+        # Existing contents are first copied aside, as their files may be among
+        # those replaced.
+        script = [f"cd {safe_path}"]
+        remote_files = {}
+        for path in changed:
+            content = contents[path]
+            if content.digest in remote_files:
+                continue
+            if content.digest in sources:
+                remote_files[content.digest] = self._tmp_path(f"-{content.digest}")
+                script.append(
+                    f"cp {shlex.quote(sources[content.digest])} "
+                    f"{shlex.quote(remote_files[content.digest])}"
+                )
             else:
-                safe_group = ""
-            run(f"chown -R {safe_owner}:{safe_group} {safe_path}")
+                remote_files[content.digest] = put(
+                    content.getvalue(), f"-{content.digest}"
+                )
+        num_copied = len(set(remote_files) - set(sources))
+        LOG.info(f"Copying {num_copied} of {len(contents)} files to the remote host")
+
+        dirs = sorted({os.path.dirname(path) for path in changed} - {""})
+        if dirs:
+            script.append(f"mkdir -p {' '.join(shlex.quote(d) for d in dirs)}")
+        for path in changed:
+            src = remote_files[contents[path].digest]
+            script.append(f"cp {shlex.quote(src)} {shlex.quote(path)}")
+        # Index the new files, replacing the entries of any files overwritten.
+        script.append(
+            f"{{ cat {safe_index} 2>/dev/null || true; }}"
+            f" | awk -v new={shlex.quote(remote_manifest)}"
+            f" {shlex.quote(AWK_MERGE_INDEX)} > {safe_index}.tmp"
+        )
+        script.append(f"mv {safe_index}.tmp {safe_index}")
+        return "\n".join(script)
+
+    def _chown(self) -> str:
+        if not self.remote_path_owner:
+            return ""
+        safe_path = shlex.quote(self.remote_path)
+        safe_owner = shlex.quote(self.remote_path_owner)
+        if self.remote_path_group:
+            safe_group = shlex.quote(self.remote_path_group)
+        else:
+            safe_group = ""
+        return f"chown -R {safe_owner}:{safe_group} {safe_path}"
+
 
-        self._scp_tmp_dir.cleanup()
+def _remove(paths: "List[str]") -> str:
+    return f"rm -f {' '.join(shlex.quote(p) for p in paths)}" if paths else "true"
@@ -1,10 +1,63 @@
+import os
+import subprocess
+from datetime import timedelta
 from unittest import mock
 
 import pytest
+from kpireport.blob import BlobStore
 from kpireport.report import Content, Report
+from kpireport.view import Blob
 from kpireport_scp import SCPOutputDriver
 
 
+class LocalConnection:
+    """A stand-in for an SSH connection, which runs commands on the local host."""
+
+    def __init__(self):
+        self.puts = []
+        self.commands = []
+
+    def put(self, local, remote):
+        self.puts.append(remote)
+        with open(remote, "wb") as f:
+            f.write(local.read())
+
+    def run(self, command, warn=False, hide=None):
+        self.commands.append(command)
+        res = subprocess.run(command, shell=True, capture_output=True, text=True)
+        if res.returncode and not warn:
+            raise RuntimeError(f"Command failed: {res.stderr}")
+        return res
+
+
+@pytest.fixture
+def remote(tmp_path):
+    os.makedirs(tmp_path / "tmp")
+    return tmp_path
+
+
+def make_driver(report, remote, **kwargs):
+    scp = SCPOutputDriver(
+        report,
+        host="localhost",
+        remote_path=str(remote / "www"),
+        remote_tmp_dir=str(remote / "tmp"),
+        **kwargs,
+    )
+    scp.connection = LocalConnection()
+    return scp
+
+
+def make_blobs(image=b"fake-image"):
+    content = BlobStore().add(image)
+    return [Blob("view/figure.png", content, "image/png", None)]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
 def test_missing_remote_path(report: "Report", content: "Content"):
     with pytest.raises(ValueError):
         SCPOutputDriver(report, host="fake-host", remote_path=None)
@@ -12,13 +65,105 @@ def test_missing_remote_path(report: "Report", content: "Content"):
         SCPOutputDriver(report, host=None, remote_path="/fake-remote-path")
 
 
-def test_render_output(report: "Report", content: "Content", mocker: "mock"):
-    scp = SCPOutputDriver(report, host="localhost", remote_path="/fake-remote-path")
-    conn = mocker.patch.object(scp, "connection")
-    scp.render_output(content, [])
-    conn.put.assert_called_with(
-        f"{scp._scp_tmp_dir.name}/{report.id}.tar.gz", remote="/tmp/kpireport.tar.gz"
+@pytest.mark.parametrize("delta", [False, True])
+def test_render_output(report: "Report", content: "Content", remote, delta: bool):
+    scp = make_driver(report, remote, delta=delta)
+    scp.render_output(content, make_blobs())
+    for name in [report.id, f"latest-{report.title_slug}"]:
+        assert read(remote / "www" / name / "view" / "figure.png") == b"fake-image"
+        assert os.path.exists(remote / "www" / name / "index.html")
+    # Temporary files are removed.
+    assert not os.listdir(remote / "tmp")
+    # Each report uses unique temporary paths.
+    assert all(
+        os.path.basename(path).startswith("kpireport-") for path in scp.connection.puts
     )
-    conn.run.assert_any_call(
-        f"tar -xf /tmp/kpireport.tar.gz -C /fake-remote-path --strip-components=1"
+
+
+def test_render_output_tarball(report: "Report", content: "Content", remote):
+    scp = make_driver(report, remote)
+    scp.render_output(content, make_blobs())
+    (tarball,) = scp.connection.puts
+    assert tarball.endswith(".tar.gz")
+    # All remote commands are batched.
+    assert len(scp.connection.commands) == 1
+
+
+def test_render_output_delta(report: "Report", content: "Content", remote):
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_blobs())
+    # The manifest, the HTML and the image; the alias reuses the same contents.
+    assert len(scp.connection.puts) == 3
+    assert len(scp.connection.commands) == 2
+
+    # Only the manifest is copied if nothing changed.
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_blobs())
+    assert [p.endswith(".sha256") for p in scp.connection.puts] == [True]
+
+    # Files that differ on the remote host are copied again.
+    latest = remote / "www" / f"latest-{report.title_slug}" / "view" / "figure.png"
+    with open(latest, "wb") as f:
+        f.write(b"stale")
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_blobs(b"other-image"))
+    assert len(scp.connection.puts) == 2
+    assert read(latest) == b"other-image"
+    assert read(remote / "www" / report.id / "view" / "figure.png") == b"other-image"
+    assert not os.listdir(remote / "tmp")
+
+
+def test_render_output_delta_new_window(report: "Report", content: "Content", remote):
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_blobs())
+
+    # The next report has a new ID, but the same image.
+    next_report = Report(
+        title=report.title,
+        interval_days=report.interval_days,
+        start_date=report.start_date + timedelta(days=1),
+        end_date=report.end_date + timedelta(days=1),
+        timezone=report.timezone,
     )
+    scp = make_driver(next_report, remote, delta=True)
+    scp.render_output(content, make_blobs())
+    image_digest = make_blobs()[0].content.digest
+    assert not any(p.endswith(image_digest) for p in scp.connection.puts)
+    for name in [report.id, next_report.id, f"latest-{report.title_slug}"]:
+        assert read(remote / "www" / name / "view" / "figure.png") == b"fake-image"
+    assert not os.listdir(remote / "tmp")
+
+
+def test_render_output_delta_swap(report: "Report", content: "Content", remote):
+    def make_swap_blobs(first, second):
+        store = BlobStore()
+        return [
+            Blob("view/first.png", store.add(first), "image/png", None),
+            Blob("view/second.png", store.add(second), "image/png", None),
+        ]
+
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_swap_blobs(b"one", b"two"))
+    # Contents moved between files are copied from the remote host itself.
+    scp = make_driver(report, remote, delta=True)
+    scp.render_output(content, make_swap_blobs(b"two", b"one"))
+    assert [p.endswith(".sha256") for p in scp.connection.puts] == [True]
+    assert read(remote / "www" / report.id / "view" / "first.png") == b"two"
+    assert read(remote / "www" / report.id / "view" / "second.png") == b"one"
+
+
+def test_render_output_sudo(report: "Report", content: "Content", mocker: "mock"):
+    scp = SCPOutputDriver(
+        report,
+        host="localhost",
+        remote_path="/fake-remote-path",
+        remote_path_owner="www-data",
+        sudo=True,
+    )
+    conn = mocker.patch.object(scp, "connection")
+    scp.render_output(content, [])
+    conn.run.assert_not_called()
+    (command,), _ = conn.sudo.call_args
+    # The whole script runs with sudo.
+    assert command.startswith("sh -c ")
+    assert "chown -R www-data: /fake-remote-path" in command
@@ -1,7 +1,6 @@
 import json
 import logging
 import os
-from base64 import b64encode
 
 from jinja2.utils import markupsafe
 from kpireport.output import OutputDriver
@@ -83,7 +82,7 @@ class SendGridOutputDriver(OutputDriver):
 
         attachment = []
         for blob in blobs:
-            encoded_content = b64encode(blob.content.getvalue()).decode()
+            encoded_content = blob.content.base64()
             attachment.append(
                 Attachment(
                     file_content=encoded_content,
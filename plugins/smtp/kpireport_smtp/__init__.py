@@ -1,3 +1,4 @@
 from .output import SMTPOutputDriver
+from .pool import SMTPConnectionPool
 
-__all__ = ["SMTPOutputDriver"]
+__all__ = ["SMTPConnectionPool", "SMTPOutputDriver"]
@@ -1,12 +1,25 @@
+import logging
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email import policy
 from email.headerregistry import Address
 from email.message import EmailMessage
+from typing import TYPE_CHECKING
 
 from jinja2.utils import markupsafe
 from kpireport.output import OutputDriver
 from premailer import transform
 
+from .pool import DEFAULT_MAX_CONNECTIONS, get_pool
+
+if TYPE_CHECKING:
+    from typing import Dict, List
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
 
 class SMTPOutputDriver(OutputDriver):
     """Email a report's contents via SMTP to one or more recipients.
@@ -17,6 +30,22 @@ class SMTPOutputDriver(OutputDriver):
         smtp_host (str): SMTP server to relay mail through. Defaults to
             "localhost".
         smtp_port (int): SMTP port to use. Defaults to 25.
+        smtp_starttls (bool): Whether to upgrade the connection with STARTTLS.
+            Defaults to ``False``.
+        smtp_username (str): Username to log in to the SMTP server with, if
+            required.
+        smtp_password (str): Password to log in to the SMTP server with.
+        personalize (bool): Whether to send each recipient their own message,
+            addressed only to them. Otherwise, a single message is sent to all
+            recipients. Defaults to ``False``.
+        max_workers (int): The maximum number of messages to send in parallel
+            when personalizing messages. Defaults to 4.
+        max_connections (int): The maximum number of connections to the SMTP
+            server to keep open. Connections are reused by all reports sent
+            from the same process to the same server. Defaults to 4.
+        failures (Dict[str, str]): The error for each recipient the report could
+            not be sent to. If the report could not be sent to any recipient,
+            :class:`smtplib.SMTPException` is raised instead.
         image_strategy (str): Strategy to use for including images in the mail
             contents. Two options are available:
 
@@ -51,6 +80,12 @@ class SMTPOutputDriver(OutputDriver):
         email_to=None,
         smtp_host="localhost",
         smtp_port=25,
+        smtp_starttls=False,
+        smtp_username=None,
+        smtp_password=None,
+        personalize=False,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
         image_strategy="embed",
         image_remote_base_url=None,
     ):
@@ -63,6 +98,17 @@ class SMTPOutputDriver(OutputDriver):
         self.email_to = [self._parse_address(to) for to in email_to]
         self.smtp_host = smtp_host
         self.smtp_port = smtp_port
+        self.personalize = personalize
+        self.max_workers = max(1, int(max_workers))
+        self.pool = get_pool(
+            smtp_host,
+            smtp_port,
+            starttls=smtp_starttls,
+            username=smtp_username,
+            password=smtp_password,
+            max_size=max_connections,
+        )
+        self.failures: "Dict[str, str]" = {}
         self.image_strategy = image_strategy
         if image_remote_base_url:
             self.image_remote_base_url = image_remote_base_url.format(
@@ -89,7 +135,6 @@ class SMTPOutputDriver(OutputDriver):
         msg = EmailMessage()
         msg["Subject"] = self.report.title
         msg["From"] = self.email_from
-        msg["To"] = self.email_to
 
         msg.set_content(content.get_format("md"))
         html = transform(content.get_format("html"))
@@ -106,6 +151,61 @@ class SMTPOutputDriver(OutputDriver):
                     blob.content.getvalue(), maintype, subtype, cid=blob.id
                 )
 
-        # Send the message via local SMTP server.
-        with smtplib.SMTP(self.smtp_host, port=self.smtp_port) as s:
-            s.send_message(msg)
+        # The message is only encoded once; each send only adds its own "To"
+        # header.
+        data = msg.as_bytes(policy=policy.SMTP)
+        if self.personalize:
+            batches = [[to] for to in self.email_to]
+        else:
+            batches = [self.email_to]
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(batches))
+        ) as executor:
+            results = list(executor.map(lambda to: self._send(data, to), batches))
+
+        self.failures = {}
+        for failures in results:
+            self.failures.update(failures)
+        for recipient, error in self.failures.items():
+            LOG.warning(f"Failed to send report to {recipient}: {error}")
+        if len(self.failures) == len(self.email_to):
+            raise smtplib.SMTPException("Failed to send report to any recipient")
+
+    def _send(self, data: bytes, to: "List[Address]") -> "Dict[str, str]":
+        """Send a message to a batch of recipients.
+
+        Returns:
+            Dict[str, str]: the error for each recipient the message could not
+                be sent to.
+        """
+        recipients = [addr.addr_spec for addr in to]
+        data = policy.SMTP.fold_binary("To", ", ".join(map(str, to))) + data
+        # A pooled connection may have been closed by the server since it was
+        # last used; in that case, retry once with a new connection.
+        for retry in (True, False):
+            try:
+                with self.pool.connection() as conn:
+                    try:
+                        refused = conn.sendmail(
+                            self.email_from.addr_spec, recipients, data
+                        )
+                    except smtplib.SMTPRecipientsRefused as exc:
+                        refused = exc.recipients
+                    except smtplib.SMTPResponseException as exc:
+                        # The transaction was reset, so the connection can be
+                        # reused.
+                        return {
+                            r: _smtp_error(exc.smtp_code, exc.smtp_error)
+                            for r in recipients
+                        }
+                return {r: _smtp_error(*error) for r, error in refused.items()}
+            except smtplib.SMTPServerDisconnected as exc:
+                if not retry:
+                    return {r: str(exc) for r in recipients}
+            except (smtplib.SMTPException, OSError) as exc:
+                return {r: str(exc) for r in recipients}
+
+
+def _smtp_error(code: int, message: bytes) -> str:
+    return f"{code} {message.decode('utf-8', 'replace')}"
@@ -0,0 +1,149 @@
+import atexit
+import logging
+import smtplib
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterator, List, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_TIMEOUT = 30
+
+
+class SMTPConnectionPool:
+    """A pool of open connections to an SMTP server.
+
+    Connecting to a server (including the STARTTLS and login handshakes) is
+    relatively slow, so connections are kept open and reused for later
+    messages, including those of other reports sent from the same process (see
+    :func:`get_pool`.)
+
+    Attributes:
+        host (str): the SMTP server.
+        port (int): the SMTP port.
+        starttls (bool): whether to upgrade connections with STARTTLS.
+        username (Optional[str]): the username to log in with, if any.
+        password (Optional[str]): the password to log in with.
+        max_size (int): the maximum number of connections open at once.
+            Callers wait for a connection if all are in use.
+        timeout (float): the timeout of socket operations, in seconds.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        starttls=False,
+        username: "Optional[str]" = None,
+        password: "Optional[str]" = None,
+        max_size=DEFAULT_MAX_CONNECTIONS,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = int(port)
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self._idle: "List[smtplib.SMTP]" = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, port=self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password)
+        except BaseException:
+            _close(conn)
+            raise
+        return conn
+
+    @contextmanager
+    def connection(self) -> "Iterator[smtplib.SMTP]":
+        """Get an open connection to the server.
+
+        The connection is returned to the pool when done, unless an error was
+        raised while using it, in which case it is closed.
+
+        .. note::
+
+           Idle connections may have been closed by the server in the meantime;
+           these raise :class:`smtplib.SMTPServerDisconnected` when next used.
+        """
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                _close(conn)
+                raise
+            with self._lock:
+                self._idle.append(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            _close(conn)
+
+
+_pools: "Dict[Tuple, SMTPConnectionPool]" = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(
+    host: str,
+    port: int,
+    starttls=False,
+    username: "Optional[str]" = None,
+    password: "Optional[str]" = None,
+    max_size=DEFAULT_MAX_CONNECTIONS,
+) -> SMTPConnectionPool:
+    """Get the connection pool shared by all senders in this process for an SMTP
+    server and set of credentials.
+
+    Returns:
+        SMTPConnectionPool: the pool. It is created on first use, with the given
+            maximum size.
+    """
+    key = (host, int(port), bool(starttls), username, password)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SMTPConnectionPool(
+                host,
+                port,
+                starttls=starttls,
+                username=username,
+                password=password,
+                max_size=max_size,
+            )
+        return _pools[key]
+
+
+@atexit.register
+def close_pools():
+    """Close all idle connections of the shared connection pools."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _close(conn: smtplib.SMTP):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
@@ -1,28 +1,129 @@
-from email.message import EmailMessage
-from unittest import mock
+import email
+import smtplib
+import socket
+from email import policy
 
+import pytest
 from kpireport.report import Content, Report
 from kpireport_smtp import SMTPOutputDriver
+from kpireport_smtp.pool import close_pools
 
+pytest.importorskip("aiosmtpd")
 
-def test_report_output(report: "Report", content: "Content", mocker: "mock"):
-    def send_message(msg: "EmailMessage"):
-        assert msg["Subject"] == report.title
-        assert msg["To"] == "to@example.com"
-        assert msg["From"] == "from@example.com"
-        payload = msg.get_payload()
-        assert len(payload) == 2
-        assert payload[0].get_payload() == content.get_format("md")
+from aiosmtpd.controller import Controller  # noqa: E402
 
-    fake_smtp = mocker.patch("kpireport_smtp.output.smtplib.SMTP")()
-    # Need to also tell the __enter__ context mgr function to return the same mock,
-    # by default it wants to create a new mock as the return value.
-    fake_smtp.__enter__.return_value = fake_smtp
-    fake_smtp.send_message.side_effect = send_message
 
-    smtp = SMTPOutputDriver(
-        report, email_from="from@example.com", email_to="to@example.com"
+class Handler:
+    """Records the messages delivered to a local SMTP server."""
+
+    def __init__(self, refuse=()):
+        self.refuse = refuse
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        msg = email.message_from_bytes(envelope.content, policy=policy.SMTP)
+        self.messages.append((envelope.rcpt_tos, msg))
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    def start(**kwargs):
+        handler = Handler(**kwargs)
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        controllers.append(controller)
+        return handler, controller.port
+
+    controllers = []
+    yield start
+    close_pools()
+    for controller in controllers:
+        controller.stop()
+
+
+def make_driver(report, port, **kwargs):
+    return SMTPOutputDriver(
+        report,
+        email_from="from@example.com",
+        smtp_host="127.0.0.1",
+        smtp_port=port,
+        **kwargs,
     )
+
+
+def test_report_output(report: "Report", content: "Content", smtp_server):
+    handler, port = smtp_server()
+    smtp = make_driver(report, port, email_to=["to@example.com", "cc@example.com"])
     smtp.render_output(content, [])
 
-    fake_smtp.send_message.assert_called_once()
+    ((rcpt_tos, msg),) = handler.messages
+    assert rcpt_tos == ["to@example.com", "cc@example.com"]
+    assert msg["Subject"] == report.title
+    assert msg["To"] == "to@example.com, cc@example.com"
+    assert msg["From"] == "from@example.com"
+    payload = msg.get_payload()
+    assert len(payload) == 2
+    # Line endings are converted to CRLF for transport.
+    text = payload[0].get_content()
+    assert text.splitlines() == content.get_format("md").splitlines()
+    assert smtp.failures == {}
+
+
+def test_report_output_personalize(report: "Report", content: "Content", smtp_server):
+    handler, port = smtp_server()
+    email_to = [f"to{i}@example.com" for i in range(10)]
+    smtp = make_driver(report, port, email_to=email_to, personalize=True)
+    smtp.render_output(content, [])
+
+    assert sorted(msg["To"] for _, msg in handler.messages) == sorted(email_to)
+    assert all(rcpt_tos == [msg["To"]] for rcpt_tos, msg in handler.messages)
+    # Connections are reused, up to one per worker.
+    assert len(handler.sessions) <= smtp.max_workers
+
+    # Connections are also reused by later reports.
+    sessions = set(handler.sessions)
+    make_driver(report, port, email_to=email_to[0]).render_output(content, [])
+    assert handler.sessions == sessions
+
+
+def test_report_output_failures(report: "Report", content: "Content", smtp_server):
+    handler, port = smtp_server(refuse=["bad@example.com"])
+    smtp = make_driver(
+        report, port, email_to=["to@example.com", "bad@example.com"], personalize=True
+    )
+    smtp.render_output(content, [])
+
+    ((rcpt_tos, _),) = handler.messages
+    assert rcpt_tos == ["to@example.com"]
+    assert smtp.failures == {"bad@example.com": "550 No such user"}
+
+    smtp = make_driver(report, port, email_to="bad@example.com")
+    with pytest.raises(smtplib.SMTPException):
+        smtp.render_output(content, [])
+
+
+def test_report_output_reconnects(report: "Report", content: "Content", smtp_server):
+    handler, port = smtp_server()
+    smtp = make_driver(report, port, email_to="to@example.com")
+    smtp.render_output(content, [])
+    # Simulate the server closing the idle connection.
+    for conn in smtp.pool._idle:
+        conn.sock.close()
+    smtp.render_output(content, [])
+    assert len(handler.messages) == 2
+    assert smtp.failures == {}
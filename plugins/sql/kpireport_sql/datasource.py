@@ -1,36 +1,70 @@
+from contextlib import contextmanager
 import logging
+import queue
 import re
 import sqlite3
+import threading
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
 import pymysql
 from kpireport.datasource import Datasource
 
 if TYPE_CHECKING:
-    from typing import Any, List, Tuple
+    from datetime import datetime
+    from typing import Any, Callable, Iterator, List, Optional, Tuple
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_CHUNKSIZE = 1000
+DEFAULT_POOL_SIZE = 4
+
 
 class SQLDatasource(Datasource):
     """Provides an interface for running queries agains a SQL database.
 
+    The Datasource supports incremental fetching (see
+    :class:`~kpireport.datasource.DatasourceManager`) for queries whose results are
+    indexed by time, i.e., where the first selected column is a date parsed via
+    ``parse_dates``.
+
+    Of the query hints (see :class:`~kpireport.datasource.Datasource`), only
+    ``limit`` is supported. Arbitrary queries cannot be reduced to a given
+    resolution by the database, so ``target_points`` is ignored; results can be
+    sampled with the ``downsample`` query argument instead, though the database
+    still sends every row.
+
     Attributes:
         driver (str): which DB driver to use. Possible values are "mysql" and "sqlite".
+        pool_size (int): the maximum number of connections to open to the
+            database. Connections are opened as needed, so that several views
+            can query the database in parallel (see the Datasource's
+            ``max_concurrency`` setting), and are checked before each query,
+            reconnecting if the connection was lost. In-memory SQLite
+            databases always use a single connection. (Default ``4``)
         kwargs: any keyword arguments are passed through to
             :meth:`pymysql.connect` (in the case of the MySQL driver) or
             :meth:`sqlite3.connect` (for the SQLite driver.)
     """
 
-    def init(self, driver="mysql", **kwargs):
+    supported_hints = ("limit",)
+
+    def init(self, driver="mysql", pool_size=DEFAULT_POOL_SIZE, **kwargs):
         if driver == "mysql":
-            db = pymysql.connect(**kwargs)
+            connect, check = pymysql.connect, _check_mysql
         elif driver == "sqlite":
-            db = sqlite3.connect(**kwargs)
+            connect, check = sqlite3.connect, _check_sqlite
+            # Connections may be used by different threads, though the pool only
+            # ever gives a connection to one thread at a time.
+            kwargs.setdefault("check_same_thread", False)
+            if kwargs.get("database") == ":memory:":
+                # Each connection would otherwise have its own database.
+                pool_size = 1
         else:
             raise ValueError(f"unsupported DB driver: '{driver}'")
-        self.db = db
+        self.driver = driver
+        self.pool = _ConnectionPool(lambda: connect(**kwargs), pool_size, check)
 
     def query(self, sql: str, **kwargs) -> pd.DataFrame:
         """Execute a query SQL string.
@@ -61,9 +95,37 @@ class SQLDatasource(Datasource):
               self.datasources.query('my_db', 'select time, value from table',
                 parse_dates=['time'])
 
+        .. NOTE::
+
+           Large results can be streamed from the database in chunks, rather
+           than all rows being loaded into memory at once, by passing
+           ``chunksize``. Streaming is also used when only part of the result
+           is needed, via the ``max_rows`` or ``downsample`` arguments, in
+           which case the full result is never held in memory. For MySQL,
+           streaming uses an unbuffered server-side cursor.
+
+           With SQLite, reading stops once ``max_rows`` rows are read. The MySQL
+           client however reads (and discards) the rest of the result when the
+           cursor is closed, so the server still executes the whole query and
+           sends every row. To reduce the work done by the server, add a
+           ``LIMIT`` clause to the query.
+
 
         Args:
             sql (str): the SQL query to execute
+            max_rows (int): only return the first ``max_rows`` rows.
+            downsample (int): return at most this many rows, evenly spaced
+                over the rows of the result. This is intended for results with
+                a row per point in time, e.g., when plotting. Rows are sampled
+                as they are read, which bounds the memory used, but every row
+                is still sent by the database; to reduce the data transferred,
+                aggregate the rows in the query, e.g., with ``GROUP BY``.
+            chunksize (int): how many rows to read from the database at a
+                time when streaming. (Default ``1000`` if ``max_rows`` or
+                ``downsample`` are set, otherwise the result is not streamed)
+            limit (int): only return the first ``limit`` rows, as with
+                ``max_rows``. This is typically passed as a hint by the view
+                (see :class:`~kpireport.datasource.Datasource`.)
             kwargs: keyword arguments passed to :meth:`pandas.read_sql`
 
         Returns:
@@ -72,31 +134,135 @@ class SQLDatasource(Datasource):
                 Columns selected in the query will be columns in the output
                 table.
         """
-        sql, params = self._format_sql(sql)
+        return self.query_window(
+            self.report.start_date, self.report.end_date, sql, **kwargs
+        )
+
+    def query_window(
+        self,
+        start_date: "datetime",
+        end_date: "datetime",
+        sql: str,
+        max_rows: "Optional[int]" = None,
+        downsample: "Optional[int]" = None,
+        chunksize: "Optional[int]" = None,
+        limit: "Optional[int]" = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Execute a query SQL string over a custom time window.
+
+        This behaves like :meth:`query`, except that the ``{from}`` and ``{to}``
+        tokens are replaced with the given start and end date.
+
+        Args:
+            start_date (datetime): the value of the ``{from}`` token.
+            end_date (datetime): the value of the ``{to}`` token.
+            sql (str): the SQL query to execute
+            max_rows (int): only return the first ``max_rows`` rows.
+            downsample (int): return at most this many rows.
+            chunksize (int): how many rows to read from the database at a
+                time when streaming.
+            limit (int): only return the first ``limit`` rows.
+            kwargs: keyword arguments passed to :meth:`pandas.read_sql`
+
+        Returns:
+            pandas.DataFrame: a table with any rows returned by the query.
+        """
+        sql, params = self._format_sql(sql, start_date, end_date)
+        if limit is not None:
+            # The query is not rewritten with a LIMIT clause, which would not work
+            # for every query; instead, reading the result stops early.
+            max_rows = limit if max_rows is None else min(max_rows, limit)
         kwargs.setdefault("params", params)
         LOG.debug(f"Query: {sql} {params}")
-        df: "pd.DataFrame" = pd.read_sql(sql, self.db, **kwargs)
+        with self.pool.connection() as db:
+            if chunksize or max_rows is not None or downsample is not None:
+                df = self._read_sql_streaming(
+                    db,
+                    sql,
+                    chunksize=chunksize or DEFAULT_CHUNKSIZE,
+                    max_rows=max_rows,
+                    downsample=downsample,
+                    **kwargs,
+                )
+            else:
+                df = pd.read_sql(sql, db, **kwargs)
         df = df.set_index(df.columns[0])
         LOG.debug(f"Query result: {df}")
         return df
 
-    def _format_sql(self, sql: str) -> "Tuple[str, List[Any]]":
+    def _read_sql_streaming(
+        self,
+        db,
+        sql: str,
+        chunksize: int,
+        max_rows: "Optional[int]" = None,
+        downsample: "Optional[int]" = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        # SQLite cursors already read rows as they are fetched.
+        con = _UnbufferedConnection(db) if self.driver == "mysql" else db
+        try:
+            chunks = pd.read_sql(sql, con, chunksize=chunksize, **kwargs)
+            if max_rows is not None:
+                chunks = _head(chunks, max_rows)
+            if downsample is not None:
+                return _downsample(chunks, downsample)
+            return pd.concat(chunks, ignore_index=True)
+        finally:
+            if isinstance(con, _UnbufferedConnection):
+                # The rest of the result must be read before the connection can
+                # be reused, even if not all rows were needed.
+                con.close_cursors()
+
+    def time_index(self, df: "pd.DataFrame") -> "pd.DatetimeIndex":
+        """Get the time of each row in a query result.
+
+        Naive times are assumed to be in the report timezone.
+
+        Raises:
+            ValueError: if the query result is not indexed by time.
+        """
+        index = df.index
+        if not isinstance(index, pd.DatetimeIndex):
+            raise ValueError(
+                "query result is not indexed by time; ensure the first selected "
+                "column is a date listed in 'parse_dates'"
+            )
+        if index.tz is None:
+            index = index.tz_localize(self.report.timezone)
+        return index
+
+    def _format_sql(
+        self,
+        sql: str,
+        start_date: "Optional[datetime]" = None,
+        end_date: "Optional[datetime]" = None,
+    ) -> "Tuple[str, List[Any]]":
         """Replace special tokens in the SQL query.
 
         :type sql: str
         :param sql: the SQL query
+        :type start_date: Optional[datetime]
+        :param start_date: the value of the ``{from}`` token; defaults to the
+                           report start date.
+        :type end_date: Optional[datetime]
+        :param end_date: the value of the ``{to}`` token; defaults to the
+                         report end date.
         :rtype: Tuple[str, List[Any]]
         :returns: a tuple of the replaced SQL query and a list of parameters
                   to be passed to the MySQL client for secure substition.
         """
         params = []
+        start_date = start_date or self.report.start_date
+        end_date = end_date or self.report.end_date
 
         def collect_params(match):
             token = match.group(1)
             if token == "from":
-                params.append(self.report.start_date)
+                params.append(start_date)
             elif token == "to":
-                params.append(self.report.end_date)
+                params.append(end_date)
             elif token == "interval":
                 return f"interval {int(self.report.interval_days)} day"
             else:
@@ -106,3 +272,156 @@ class SQLDatasource(Datasource):
         replaced = re.sub(r"\{(interval|from|to)\}", collect_params, sql)
 
         return replaced, params
+
+
+class _ConnectionPool:
+    """A thread-safe pool of database connections.
+
+    Connections are opened as needed, up to ``size``; when all are in use,
+    callers wait for one to be returned. Idle connections are checked before
+    they are handed out, and replaced if the check fails, e.g., because the
+    server closed the connection while it was idle.
+    """
+
+    def __init__(
+        self,
+        connect: "Callable[[], Any]",
+        size: int = DEFAULT_POOL_SIZE,
+        check: "Optional[Callable[[Any], None]]" = None,
+    ):
+        self.size = max(1, int(size))
+        self._connect = connect
+        self._check = check
+        self._idle = queue.LifoQueue()
+        self._num_connections = 0
+        self._lock = threading.Lock()
+        # Connect immediately, so that configuration errors are raised early.
+        self._num_connections += 1
+        self._idle.put(self._open())
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the context."""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def _checkout(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_connect = self._num_connections < self.size
+                if can_connect:
+                    self._num_connections += 1
+            if can_connect:
+                return self._open()
+            conn = self._idle.get()
+
+        if self._check:
+            try:
+                self._check(conn)
+            except Exception as exc:
+                LOG.warning(f"Reconnecting to database: {exc}")
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                return self._open()
+        return conn
+
+    def _open(self):
+        """Open a connection, for which a slot in the pool has been reserved."""
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._num_connections -= 1
+            raise
+
+
+def _check_mysql(conn: "pymysql.connections.Connection"):
+    # Reconnects if the server closed the connection
+    conn.ping(reconnect=True)
+
+
+def _check_sqlite(conn: "sqlite3.Connection"):
+    conn.execute("select 1").close()
+
+
+class _UnbufferedConnection:
+    """Wraps a MySQL connection to read results with unbuffered cursors.
+
+    By default, the MySQL client reads the entire result into memory when a
+    query is executed; unbuffered cursors instead read rows as they are fetched.
+    Cursors are tracked so that they can be closed once the result is no longer
+    needed; closing a cursor reads and discards any remaining rows.
+    """
+
+    def __init__(self, db: "pymysql.connections.Connection"):
+        self.db = db
+        self.cursors = []
+
+    def cursor(self):
+        cursor = self.db.cursor(pymysql.cursors.SSCursor)
+        self.cursors.append(cursor)
+        return cursor
+
+    def close_cursors(self):
+        for cursor in self.cursors:
+            cursor.close()
+        self.cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def _head(chunks: "Iterator[pd.DataFrame]", n: int) -> "Iterator[pd.DataFrame]":
+    """Yield chunks up to a total of ``n`` rows.
+
+    No further chunks are requested, so SQLite stops executing the query; MySQL
+    still reads the rest of the result when the cursor is closed.
+    """
+    remaining = n
+    for chunk in chunks:
+        yield chunk.iloc[:remaining]
+        remaining -= len(chunk)
+        if remaining <= 0:
+            break
+
+
+def _downsample(chunks: "Iterator[pd.DataFrame]", n: int) -> pd.DataFrame:
+    """Select at most ``n`` evenly spaced rows from a stream of chunks.
+
+    Rows are sampled at a fixed stride, which is doubled (discarding every other
+    sampled row) whenever more than ``2n`` rows have been sampled, so at most
+    ``2n`` rows plus one chunk are held in memory. Finally, ``n`` evenly spaced
+    rows are selected from the sample.
+    """
+    n = max(int(n), 1)
+    stride = 1
+    num_rows = 0
+    sample = []
+    sample_positions = np.empty(0, dtype=np.int64)
+    for chunk in chunks:
+        positions = np.arange(num_rows, num_rows + len(chunk))
+        num_rows += len(chunk)
+        mask = positions % stride == 0
+        sample.append(chunk[mask])
+        sample_positions = np.append(sample_positions, positions[mask])
+        if len(sample_positions) > 2 * n:
+            df = pd.concat(sample)
+            while len(sample_positions) > 2 * n:
+                stride *= 2
+                mask = sample_positions % stride == 0
+                df, sample_positions = df[mask], sample_positions[mask]
+            sample = [df]
+
+    if not sample:
+        return pd.DataFrame()
+    df = pd.concat(sample, ignore_index=True)
+    if len(df) > n:
+        df = df.iloc[np.unique(np.linspace(0, len(df) - 1, n).round().astype(int))]
+    return df.reset_index(drop=True)
@@ -1,6 +1,11 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from unittest import mock
 
+import numpy as np
 import pandas as pd
+import pymysql
 import pytest
 from kpireport.report import Report
 from kpireport_sql import SQLDatasource
@@ -79,3 +84,136 @@ def test_query_param_invalid_replacement(report: "Report", mysql_cursor):
             "select * from users where join_date > date_sub(current_timestamp(), "
             "{interval})"
         )
+
+
+def test_query_window(report: "Report", mysql_cursor):
+    _mock_query_response(mysql_cursor, ["id"], [])
+    ds = SQLDatasource(report)
+    start_date = report.end_date - timedelta(days=1)
+    ds.query_window(
+        start_date, report.end_date, "select * from users where join_date > {from}"
+    )
+    mysql_cursor.execute.assert_called_with(
+        "select * from users where join_date > %s", [start_date]
+    )
+
+
+def test_time_index(report: "Report"):
+    ds = SQLDatasource(report, driver="sqlite", database=":memory:")
+    df = pd.DataFrame({"value": [1]}, index=pd.DatetimeIndex(["2020-05-01"]))
+    assert ds.time_index(df).tz is not None
+    with pytest.raises(ValueError):
+        ds.time_index(pd.DataFrame({"value": [1]}))
+
+
+@pytest.fixture
+def sqlite_ds(report: "Report"):
+    ds = SQLDatasource(report, driver="sqlite", database=":memory:")
+    with ds.pool.connection() as db:
+        db.execute("create table points (id integer, value integer)")
+        db.executemany(
+            "insert into points values (?, ?)", [(i, i * 10) for i in range(1000)]
+        )
+    return ds
+
+
+def test_query_chunksize(sqlite_ds: "SQLDatasource"):
+    df = sqlite_ds.query("select * from points", chunksize=64)
+    assert df.equals(sqlite_ds.query("select * from points"))
+
+
+def test_query_max_rows(sqlite_ds: "SQLDatasource"):
+    df = sqlite_ds.query("select * from points", max_rows=150, chunksize=64)
+    assert list(df.index) == list(range(150))
+
+
+def test_query_max_rows_stops_sqlite(sqlite_ds: "SQLDatasource"):
+    # SQLite stops executing the query once enough rows were read, so even an
+    # endless query returns.
+    sql = (
+        "with recursive ids(id) as (select 0 union all select id + 1 from ids) "
+        "select id from ids"
+    )
+    df = sqlite_ds.query(sql, max_rows=150, chunksize=64)
+    assert list(df.index) == list(range(150))
+
+
+@pytest.mark.parametrize("downsample", [1, 10, 99, 500, 1000, 5000])
+def test_query_downsample(sqlite_ds: "SQLDatasource", downsample):
+    df = sqlite_ds.query("select * from points", downsample=downsample, chunksize=64)
+    assert 0 < len(df) <= downsample
+    assert df.index[0] == 0
+    assert df.index.is_monotonic_increasing
+    if downsample >= 1000:
+        assert len(df) == 1000
+    elif downsample > 1:
+        # Rows are spread over the whole result
+        assert df.index[-1] > 900
+        gaps = np.diff(df.index)
+        assert gaps.max() <= 2 * gaps.min() + 1
+
+
+def test_query_max_rows_mysql(report: "Report", mysql_cursor):
+    cols, rows = ["id", "name"], [(1, "Anna"), (2, "Bob"), (3, "Carol")]
+    mysql_cursor.description = [[col] for col in cols]
+    mysql_cursor.fetchmany.side_effect = [rows[:2], rows[2:], []]
+    ds = SQLDatasource(report)
+    df = ds.query("select * from users", max_rows=2, chunksize=2)
+    _verify_dataframe(df, cols, rows[:2])
+    pymysql.connect().cursor.assert_called_with(pymysql.cursors.SSCursor)
+    # No more rows are fetched once enough were read; the client reads and
+    # discards the rest of the result when the cursor is closed.
+    assert mysql_cursor.fetchmany.call_count == 1
+    mysql_cursor.close.assert_called()
+
+
+def test_pool_concurrent(report: "Report", tmp_path):
+    ds = SQLDatasource(
+        report, driver="sqlite", database=str(tmp_path / "db.sqlite"), pool_size=2
+    )
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _query(_):
+        with ds.pool.connection():
+            # Both threads must hold a connection at the same time
+            barrier.wait()
+        return ds.query("select 1 as id, 2 as value")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_query, range(4)))
+    assert all(df["value"].iloc[0] == 2 for df in results)
+    assert ds.pool._num_connections == 2
+
+
+def test_pool_reconnect(report: "Report", mysql_cursor, mocker: "mock"):
+    _mock_query_response(mysql_cursor, ["id"], [])
+    ds = SQLDatasource(report)
+    db = pymysql.connect()
+    db.ping.side_effect = pymysql.err.OperationalError()
+    num_connects = pymysql.connect.call_count
+    ds.query("select * from users")
+    db.close.assert_called_once()
+    assert pymysql.connect.call_count == num_connects + 1
+    assert ds.pool._num_connections == 1
+
+
+def test_query_limit(sqlite_ds: "SQLDatasource"):
+    df = sqlite_ds.query("select * from points order by id desc;\n", limit=5)
+    assert list(df.index) == [999, 998, 997, 996, 995]
+    df = sqlite_ds.query("select * from points -- all points", limit=5, max_rows=3)
+    assert list(df.index) == [0, 1, 2]
+
+
+def test_query_limit_duplicate_columns(sqlite_ds: "SQLDatasource"):
+    # Queries are not wrapped in a subquery, in which duplicate column names
+    # would be rejected by MySQL.
+    df = sqlite_ds.query(
+        "select a.id, a.value, b.value from points a join points b on a.id = b.id",
+        limit=2,
+    )
+    assert df.shape == (2, 2)
+
+
+def test_query_ignores_target_points(sqlite_ds: "SQLDatasource"):
+    # Sampling rows blindly would drop peaks, so the hint is not supported.
+    assert "target_points" not in sqlite_ds.supported_hints
@@ -12,7 +12,7 @@ setup(
     entry_points={
         "kpireport.datasource": [
             "mysql = kpireport_sql:SQLDatasource",
-            "sql = kpireport_sql:SQLDatasource"
+            "sql = kpireport_sql:SQLDatasource",
         ],
     },
 )
@@ -1,3 +1,3 @@
-from .output import StaticOutputDriver
+from .output import OutputFile, StaticOutputDriver
 
-__all__ = ["StaticOutputDriver"]
+__all__ = ["OutputFile", "StaticOutputDriver"]
@@ -3,18 +3,46 @@ import os
 import shutil
 import tempfile
 
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
 import imgkit
 from jinja2.utils import markupsafe
+from kpireport.blob import BlobStore
 from kpireport.output import OutputDriver
 
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+    from kpireport.blob import BlobContent
+
 LOG = logging.getLogger(__name__)
 
+HTML_MIME_TYPE = "text/html; charset=utf-8"
+
+
+@dataclass
+class OutputFile:
+    """A file of a report's output.
+
+    Attributes:
+        path (str): the path of the file, relative to the output directory.
+        content (BlobContent): the content of the file.
+        mime_type (Optional[str]): the MIME type of the file, if known.
+    """
+
+    path: str
+    content: "BlobContent"
+    mime_type: "Optional[str]"
+
 
 class StaticOutputDriver(OutputDriver):
     """Export a report's contents to disk.
 
     Attributes:
-        output_dir (str): the directory to output the report contents to.
+        output_dir (str): the directory to output the report contents to. If
+            empty, nothing is written to disk; this is useful for subclasses
+            publishing the output elsewhere (see :meth:`render_files`.)
             (Default "./_build")
         output_format (str): The output format, which can be one of "html" or "png".
             (Default "html".) Depending on the format, the output will have a few
@@ -34,9 +62,11 @@ class StaticOutputDriver(OutputDriver):
     """
 
     def init(self, output_dir="_build", output_format="html"):
-        self.output_dir = os.path.abspath(output_dir)
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
         self.output_format = output_format
-        self.tmp_dir = tempfile.TemporaryDirectory()
+        # Rendering to PNG requires the report contents on disk; HTML reports are
+        # rendered in memory.
+        self.tmp_dir = tempfile.TemporaryDirectory() if output_format == "png" else None
 
         self._has_xvfb = shutil.which("Xvfb") is not None
 
@@ -45,7 +75,8 @@ class StaticOutputDriver(OutputDriver):
         return self.tmp_dir.name
 
     def _cleanup(self):
-        self.tmp_dir.cleanup()
+        if self.tmp_dir:
+            self.tmp_dir.cleanup()
 
     def render_blob_inline(self, blob, fmt=None):
         prefix = self._render_dir if self.output_format == "png" else "."
@@ -54,93 +85,112 @@ class StaticOutputDriver(OutputDriver):
         else:
             return markupsafe.Markup(f"""<img src="{prefix}/{blob.id}" />""")
 
-    def render_output(self, content, blobs):
-        content = content.get_format("html")
+    def _output_names(self):
+        """Get the name of the report output in the output directory, and the
+        name of its "latest" alias.
+        """
+        if self.output_format == "png":
+            return f"{self.report.id}.png", f"latest-{self.report.title_slug}.png"
+        return self.report.id, f"latest-{self.report.title_slug}"
+
+    def _alias(self, path: str) -> str:
+        """Get the path of an output file in the "latest" alias."""
+        name, alias = self._output_names()
+        # Paths of output files always start with the output name.
+        name_len = len(name)
+        return alias + path[name_len:]
+
+    def render_files(self, content, blobs) -> "List[OutputFile]":
+        """Render the files of the report output in memory.
+
+        Args:
+            content (Content): the report content.
+            blobs (List[Blob]): the report blobs.
+
+        Returns:
+            List[OutputFile]: the output files, at paths relative to the output
+                directory, under the name of the report (not its "latest" alias.)
+        """
+        html = content.get_format("html")
+        store = BlobStore()
+
+        if self.output_format == "html":
+            name, _ = self._output_names()
+            files = [OutputFile(f"{name}/index.html", store.add(html), HTML_MIME_TYPE)]
+            files.extend(
+                OutputFile(f"{name}/{blob.id}", blob.content, blob.mime_type)
+                for blob in blobs
+            )
+            return files
+        elif self.output_format == "png":
+            png = self._render_png(html, blobs)
+            name, _ = self._output_names()
+            return [OutputFile(name, store.add(png), "image/png")]
+        raise ValueError(f"Unsupported output format '{self.output_format}'")
 
+    def _render_png(self, html: str, blobs) -> bytes:
         os.makedirs(self._render_dir, exist_ok=True)
 
         report_file = os.path.join(self._render_dir, "index.html")
         with open(report_file, "w") as f:
-            f.write(content)
+            f.write(html)
 
         for blob in blobs:
             blob_path = os.path.join(self._render_dir, blob.id)
             os.makedirs(os.path.dirname(blob_path), exist_ok=True)
             with open(blob_path, "wb") as f:
-                f.write(blob.content.getvalue())
-
-        if self.output_format == "html":
-            output_paths = [
-                os.path.join(self.output_dir, self.report.id),
-                # Also write to "latest" alias
-                os.path.join(self.output_dir, f"latest-{self.report.title_slug}"),
-            ]
-            for path in output_paths:
-                _copy(self._render_dir, path)
-        elif self.output_format == "png":
-            output_file = os.path.join(self._render_dir, f"{self.report.id}.png")
-            theme = self.report.theme
-            # It works better to render at a larger width and then
-            # crop down, don't ask me why. The fonts render at strange
-            # sizes otherwise.
-            width = 1024
-            crop_width = (theme.num_columns * theme.column_width) + (
-                theme.padding_width * 2
-            )
-            imgkit_options = {
-                "width": width,
-                # Crop center portion of rendered image
-                "crop-x": int((width - crop_width) / 2),
-                "crop-w": int(crop_width),
-                "crop-y": int(theme.padding_width),
-                "format": "png",
-            }
-            if self._has_xvfb:
-                imgkit_options["xvfb"] = ""
-
+                f.write(blob.content.data)
+
+        output_file = os.path.join(self._render_dir, f"{self.report.id}.png")
+        theme = self.report.theme
+        # It works better to render at a larger width and then
+        # crop down, don't ask me why. The fonts render at strange
+        # sizes otherwise.
+        width = 1024
+        crop_width = (theme.num_columns * theme.column_width) + (
+            theme.padding_width * 2
+        )
+        imgkit_options = {
+            "width": width,
+            # Crop center portion of rendered image
+            "crop-x": int((width - crop_width) / 2),
+            "crop-w": int(crop_width),
+            "crop-y": int(theme.padding_width),
+            "format": "png",
+        }
+        if self._has_xvfb:
+            imgkit_options["xvfb"] = ""
+
+        try:
             with open(report_file, "r") as f:
                 imgkit.from_file(f, output_file, options=imgkit_options)
+            with open(output_file, "rb") as f:
+                return f.read()
+        finally:
+            self._cleanup()
+
+    def write_files(self, files: "List[OutputFile]"):
+        """Write output files to the output directory.
+
+        The report is written both under its ID and to the "latest" alias.
+
+        Args:
+            files (List[OutputFile]): the output files.
+        """
+        for file in files:
+            for path in (file.path, self._alias(file.path)):
+                try:
+                    _write(os.path.join(self.output_dir, path), file.content.data)
+                except Exception:
+                    LOG.exception("Error writing report to output directory")
 
-            output_paths = [
-                os.path.join(self.output_dir, f"{self.report.id}.png"),
-                os.path.join(self.output_dir, f"latest-{self.report.title_slug}.png"),
-            ]
-            for path in output_paths:
-                _copy(output_file, path)
-
-        self._cleanup()
-
-
-def _copy(src, dst):
-    try:
-        if os.path.isfile(src):
-            shutil.copy(src, dst)
-        elif os.path.isdir(src):
-            os.makedirs(dst, exist_ok=True)
-            try:
-                shutil.copytree(src, dst, dirs_exist_ok=True)
-            except TypeError:
-                # On Python < 3.8, where dirs_exist_ok parameter doesn't exist.
-                LOG.debug("shutil.copytree not available, falling back")
-                _copytree(src, dst)
-        else:
-            raise ValueError("Source is not a file or directory")
-    except Exception:
-        LOG.exception("Error copying report to output directory")
-
-
-def _copytree(src, dst, symlinks=False, ignore=None):
-    """Shimmed shutils.copytree that handles directories already existing.
+    def render_output(self, content, blobs):
+        files = self.render_files(content, blobs)
+        if self.output_dir:
+            self.write_files(files)
 
-    Credit: https://stackoverflow.com/a/12514470/493110
 
-    NOTE(jason): Remove when support for Python <3.8 is dropped.
-    """
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            _copytree(s, d, symlinks, ignore)
-        else:
-            os.makedirs(dst, exist_ok=True)
-            shutil.copy2(s, d)
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
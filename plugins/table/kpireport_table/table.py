@@ -1,5 +1,4 @@
-from functools import lru_cache
-
+from kpireport.utils import cached_method
 from kpireport.view import View
 
 DEFAULT_MAX_ROWS = 10
@@ -35,14 +34,23 @@ class Table(View):
         if self.max_rows and not isinstance(self.max_rows, int):
             raise ValueError("Invalid format for 'max_rows', expected int")
 
-    @lru_cache(maxsize=1)
+    @cached_method
     def _query(self):
-        df = self.datasources.query(self.datasource, self.query, **self.query_args)
+        df = self.datasources.query(
+            self.datasource,
+            self.query,
+            hints=dict(limit=self.max_rows),
+            **self.query_args,
+        )
+        # Not all Datasources support limiting the result.
         if self.max_rows:
             return df.head(self.max_rows)
         else:
             return df
 
+    def prefetch(self):
+        self._query()
+
     def render_html(self, j2):
         styles = f"""
         <style>